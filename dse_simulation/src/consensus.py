@@ -39,6 +39,7 @@ end
 
 
 # 7. ////////// COMPUTE INFORMATION FILTER ESTIMATION (@t=k) //////////
+# Agents with the same state layout can be stepped together with dse_lib.BatchedInformationFilter
 if META.threadPool ~= 0
 objectSnapshot = objectIndex  # Make a temporary record of the object set
 parfor(ID1=1:META.totalObjects)
@@ -12,19 +12,20 @@ from std_msgs.msg import MultiArrayDimension
 from dse_msgs.msg import InfFilterPartials
 from dse_msgs.msg import InfFilterResults
 from scipy.spatial.transform import Rotation as R
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
 import matplotlib.pyplot as plt
 
 import dse_constants
 
 
 # Grab the agent with a specific ID
-# Done by looping through the list of agents and checking the ID
+# Done by looping through the list of agents and checking the ID, None if there is no such agent
 def agent_with_id(agents, ID):
-    for i in range(np.shape(agents)[0]):
-        if agents[i].objectID == ID:
-            agent = agents[i]
-            return
-    agent = []
+    for agent in agents:
+        if agent.objectID == ID:
+            return agent
+    return None
 
 
 # Ensures that every agent has the same state variables in the same order
@@ -92,15 +93,13 @@ def apply_comm_model_obs(agents):
 
     # Apply communication model and create list of agents each agent can communicate with
     # Current communication model is the same as the observation model
-    agents_arr = []
-    for agent = agents:
-        agents_arr = [agents_arr, agent[1]]
+    agents_arr = list(agents)
 
-    for agent = agents_arr:
+    for agent in agents_arr:
         agent.memory_id_comm = []
-        for i in range(np.shape(agent.memory_id_obs)[0]):
-            if not isempty(agent_with_id(agents_arr, agent.memory_id_obs[i])):
-                agent.memory_id_comm = [agent.memory_id_comm, agent.memory_id_obs[i]]
+        for id in agent.memory_id_obs:
+            if agent_with_id(agents_arr, id) is not None:
+                agent.memory_id_comm.append(id)
 
 
 # Update the momory_id_comm list in each agent to include each agent they
@@ -214,110 +213,122 @@ def break_agents_into_groups(SIM, agent_data):
 
 
 # Create a graph from a group of agents
+# Returns the graph (see generate_graph) and the ID of the agent at each node
 def create_graph(agents):
-    adj = np.eye(numel(agents))
-
-    id_to_index = []
-    for i in range(np.shape(agents)[0]):
-        id_to_index[i] = agents[i].objectID
-
-    for i in range(np.shape(agents)[0]):
+    id_to_index = [agent.objectID for agent in agents]
+    adj = np.eye(len(agents))
+    for i in range(len(agents)):
         for j in agents[i].memory_id_comm:
-            adj[i, find(j == id_to_index)] = 1
-
-    if size(adj, 1) == 1 & size(adj, 2) == 1:
-        tmp = 0
+            if j in id_to_index:
+                adj[i, id_to_index.index(j)] = 1
 
     graph = generate_graph(adj)
 
     return graph, id_to_index
 
 
-
-# Perform one consensus step
-def consensus_group(agents, step, num_steps):
-    # Perform consensus computations
-
-    ## Initialize Graph
-    # Generate graph
-    # Create adjacency matrix
-    # use generate_graph function
-    [graph, id_to_index] = create_graph(agents)
-    size_comp = networkComponents(graph.p)
-
-    ## Compute and store consensus variables
-    for i in range(np.shape(agents)[0]):
-
-        # Grab variables from neighboring agents
-        Y_local = []
-        y_local = []
-        idx_neighbors = agents[i].memory_id_comm
-
-        for j in range(np.shape(idx_neighbors)[0]):
-            agent = agent_with_id(agents, idx_neighbors[j])
-            Y_local[:,:, j] = (agent.memory_Y)
-            y_local[:,:, j] = (agent.memory_y)
-
-        # Compute and apply CI weights
-        [weights_ci, Y_prior, y_prior] = calc_ci_weights_ver3(Y_local, y_local, 'det')
-
-        delta_I = zeros(size(agents[1].memory_I))
-        delta_i = zeros(size(agents[1].memory_i))
-
-        for j in range(np.shape(agents)[0]):
-            p_jk = graph.p[i, j]
-
-            delta_I = delta_I + p_jk * agents[j].memory_I
-            delta_i = delta_i + p_jk * agents[j].memory_i
-
-        ratio = step / num_steps
-        Y = Y_prior + ratio * size_comp[i] * delta_I
-        y = y_prior + ratio * size_comp[i] * delta_i
-
-        consensus_data[i].Y = Y
-        consensus_data[i].y = y
-        consensus_data[i].Y_prior = Y_prior
-        consensus_data[i].y_prior = y_prior
-        consensus_data[i].delta_I = delta_I
-        consensus_data[i].delta_i = delta_i
-
-    return consensus_data
-
-
-def consensus(agent_groups):
-    num_steps = 20
-    for group_num in range(np.shape(agent_groups)[0]):
-        if numel(agent_groups[group_num]) == 1:
-            agent_groups[group_num].memory_Y = agent_groups[group_num].memory_Y + agent_groups[group_num].memory_I
-            agent_groups[group_num].memory_y = agent_groups[group_num].memory_y + agent_groups[group_num].memory_i
-            agent_groups[group_num].memory_P = np.linalg.inv(agent_groups[group_num].memory_Y)
-            agent_groups[group_num].memory_x = np.linalg.inv(agent_groups[group_num].memory_Y) *agent_groups[group_num].memory_y
+# Consensus on the information of a group of agents that share the same state layout
+# The priors (Y, y) and the measurement contributions (I, i) of all N agents are stored stacked together,
+# as one (N, n, 2n + 2) array, so each consensus step is a single einsum with the Metropolis weights.
+# The averaged measurement contributions are scaled by the size of each agent's network component,
+# so that after enough steps every agent holds the sum of the contributions in its component
+# With prior_fusion='ci', the priors are fused with covariance intersection over each agent's neighborhood
+# instead, which stays consistent when the priors are correlated. The CI weights of all agents are solved
+# together at each step, warm-started from the weights of the previous step (see CIWeightSolver)
+# measurement_ratio weights the measurement term of the posteriors, to ramp it in as the original consensus did
+class ConsensusEngine:
+
+    def __init__(self, adj, num_steps=20, prior_fusion='metropolis', ci_method='det', measurement_ratio=1):
+        self.graph = generate_graph(adj)
+        self.size_comp = networkComponents(adj)[0]
+        self.num_steps = num_steps
+        self.prior_fusion = prior_fusion
+        self.measurement_ratio = measurement_ratio
+
+        # Neighborhood of each agent (itself included), padded to the largest one
+        neighbors = (np.asarray(adj) != 0) | np.eye(np.shape(adj)[0], dtype=bool)
+        self.n_neighbors = np.sum(neighbors, axis=1)
+        self.ci_mask = np.arange(np.max(self.n_neighbors))[None, :] < self.n_neighbors[:, None]
+        self.ci_index = np.zeros(np.shape(self.ci_mask), dtype=int)
+        self.ci_index[self.ci_mask] = np.nonzero(neighbors)[1]
+        self.ci_solver = CIWeightSolver(ci_method)
+        self.ci_weights = None
+
+    # Stack the priors and measurement contributions, shapes (N, n, n) and (N, n, 1)
+    @staticmethod
+    def stack(Y, y, I, i):
+        return np.concatenate((Y, y, I, i), axis=2)
+
+    # Split the stacked variables back into Y, y, I and i
+    @staticmethod
+    def unstack(stacked):
+        n = np.shape(stacked)[1]
+        return stacked[:, :, 0:n], stacked[:, :, n:n+1], stacked[:, :, n+1:2*n+1], stacked[:, :, 2*n+1:2*n+2]
+
+    # One consensus step, each agent takes the Metropolis-weighted average of its neighbors' variables
+    # With CI prior fusion, the priors are averaged with each agent's CI weights instead
+    def step(self, stacked):
+        if self.prior_fusion != 'ci':
+            return np.einsum('ij,jab->iab', self.graph.p, stacked)
+        n = np.shape(stacked)[1]
+        weights = self.ci_weight_matrix(stacked[:, :, 0:n])
+        prior = np.einsum('ij,jab->iab', weights, stacked[:, :, 0:n+1])
+        measurement = np.einsum('ij,jab->iab', self.graph.p, stacked[:, :, n+1:])
+        return np.concatenate((prior, measurement), axis=2)
+
+    # Covariance intersection weights of every agent over its neighborhood, as an (N, N) matrix
+    def ci_weight_matrix(self, Y):
+        self.ci_weights = self.ci_solver.solve(Y[self.ci_index], self.ci_mask, self.ci_weights)
+        weights = np.zeros((np.shape(Y)[0], np.shape(Y)[0]))
+        rows = np.nonzero(self.ci_mask)[0]
+        weights[rows, self.ci_index[self.ci_mask]] = self.ci_weights[self.ci_mask]
+        return weights
+
+    # Run the consensus steps and return the stacked posteriors Y = Y_prior + ratio * size_comp * delta_I
+    def run(self, Y, y, I, i):
+        stacked = self.stack(Y, y, I, i)
+        for step in range(self.num_steps):
+            stacked = self.step(stacked)
+        Y_prior, y_prior, delta_I, delta_i = self.unstack(stacked)
+        scale = self.measurement_ratio * self.size_comp[:, None, None]
+        return Y_prior + scale * delta_I, y_prior + scale * delta_i
+
+
+# Perform the consensus steps on a group of agents
+# The priors are fused with covariance intersection, since the agents' priors are correlated.
+# Step 1 is the agents' own values and steps 2 to num_steps - 1 exchange with the neighbors,
+# with the measurement term of the last step weighted by step / num_steps
+# Returns the stacked information matrices and vectors of the agents after consensus
+def consensus_group(agents, num_steps):
+    graph, id_to_index = create_graph(agents)
+    engine = ConsensusEngine(graph.Adj, max(num_steps - 2, 0), prior_fusion='ci',
+                             measurement_ratio=(num_steps - 1.0) / num_steps)
+    Y = np.stack([agent.memory_Y for agent in agents])
+    y = np.stack([agent.memory_y for agent in agents])
+    I = np.stack([agent.memory_I for agent in agents])
+    i = np.stack([agent.memory_i for agent in agents])
+    return engine.run(Y, y, I, i)
+
+
+# Perform consensus in each group of agents and store the results in the agents
+def consensus(agent_groups, num_steps=20):
+    for group in agent_groups:
+        if len(group) == 1:
+            Y = group[0].memory_Y + group[0].memory_I
+            y = group[0].memory_y + group[0].memory_i
+            Y = Y[None, :, :]
+            y = y[None, :, :]
         else:
-            # Compute first consensus step
-            step = 1
-            for i in range(np.shape(agent_groups[group_num])[0]):
-                consensus_data[step, group_num][i].Y_prior = agent_groups[group_num][i].memory_Y
-                consensus_data[step, group_num][i].y_prior = agent_groups[group_num][i].memory_y
-                consensus_data[step, group_num][i].delta_I = agent_groups[group_num][i].memory_I
-                consensus_data[step, group_num][i].delta_i = agent_groups[group_num][i].memory_i
-
-            # Compute the remaining consensus steps
-            for step in range(2, num_steps):
-                consensus_data[step, group_num] = consensus_group(agent_groups[group_num], step, num_steps)
-
-            # After all agents' variables have been computed, store them
-            for i in range(np.shape(consensus_data[step, group_num])[0]):
-                agent_groups[group_num][i].memory_Y = consensus_data[step, group_num][i].Y_prior
-                agent_groups[group_num][i].memory_y = consensus_data[step, group_num][i].y_prior
-                agent_groups[group_num][i].memory_I = consensus_data[step, group_num][i].delta_I
-                agent_groups[group_num][i].memory_i = consensus_data[step, group_num][i].delta_i
-
-            # Store final consensus in each agent
-            for i in range(np.shape(consensus_data[step, group_num])[0]):
-                agent_groups[group_num][i].memory_Y = consensus_data[step, group_num][i].Y
-                agent_groups[group_num][i].memory_y = consensus_data[step, group_num][i].y
-                agent_groups[group_num][i].memory_P = np.linalg.inv(consensus_data[step, group_num][i].Y)
-                agent_groups[group_num][i].memory_x = np.linalg.inv(consensus_data[step, group_num][i].Y) * consensus_data[step, group_num][i].y
+            Y, y = consensus_group(group, num_steps)
+
+        # Store final consensus in each agent
+        P = np.linalg.inv(Y)
+        x = np.matmul(P, y)
+        for k, agent in enumerate(group):
+            agent.memory_Y = Y[k]
+            agent.memory_y = y[k]
+            agent.memory_P = P[k]
+            agent.memory_x = x[k]
 
     return agent_groups
 
@@ -378,174 +389,225 @@ def position_from_id(agent, id):
 # LC = A(members[1],members[1])
 
 def networkComponents(A):
-    # Number of nodes
-    N = size(A,1)
-    # Remove diagonals
-    A[1:N+1:end] = 0
-    # make symmetric, just in case it isn't
-    A=A+A'
-    # Have we visited a particular node yet?
-    isDiscovered = zeros(N,1)
-    # Empty members cell
-    members = []
-    # check every node
-    for n in range(N):
-        if not isDiscovered[n]:
-            # started a new group so add it to members
-            members[end+1] = n
-            # account for discovering n
-            isDiscovered[n] = 1
-            # set the ptr to 1
-            ptr = 1
-            while (ptr <= length(members[end])):
-                # find neighbors
-                nbrs = find(A[:, members[end](ptr)])
-                # here are the neighbors that are undiscovered
-                newNbrs = nbrs[isDiscovered[nbrs]==0]
-                # we can now mark them as discovered
-                isDiscovered[newNbrs] = 1
-                # add them to member list
-                members[end][end+1:end+length(newNbrs)] = newNbrs
-                # increment ptr so we check the next member of this component
-                ptr = ptr+1
-
-    # number of components
-    nComponents = length(members)
-    for n in range(nComponents):
-        # compute sizes of components
-        group_n = members[n]
-        for j in range(length(group_n)):
-            size_group[group_n[j]] = numel(group_n)
-        #     sizes(n) = length(members[n])
+    # Make symmetric, just in case it isn't, diagonals don't matter
+    A = np.abs(np.asarray(A)) + np.abs(np.transpose(A))
+    nComponents, labels = connected_components(csr_matrix(A), directed=False)
+
+    # Members of each component, sorted descending by component size
+    sizes = np.bincount(labels, minlength=nComponents)
+    order = np.argsort(-sizes, kind='stable')
+    members = [np.flatnonzero(labels == n) for n in order]
+
+    # Size of the component of each node
+    size_group = sizes[labels]
 
     return size_group, nComponents, members
 
 
+# Graph of a group of agents, the adjacency matrix, inclusive node degrees and the MHMC (Metropolis) weights
+class Graph:
+
+    def __init__(self, Adj, d, p):
+        self.Adj = Adj
+        self.d = d
+        self.p = p
+
+
 def generate_graph(Adj):
     # This function accepts an adjecancy matrix where degree of each
     # node is equal to 1 + number of its neighbours. That is, all agents
     # are connected to themselves as well.
-
-    #  number of nodes ( = |v|)
-    nv = size(Adj, 2)
-
-    # Assign the graph adjecancy matrix
-    G.Adj = Adj
+    Adj = np.asarray(Adj)
 
     # Calculate inclusive node degrees
-    for i in range(nv)
-        G.d[i] = sum(G.Adj[i, :]) + 1
+    d = np.sum(Adj, axis=1) + 1
 
     # Calculate weights for MHMC distributed averaging
     # This is slightly different from the formula used in the paper
     # http://citeseerx.ist.psu.edu/viewdoc/download?doi=10.1.1.161.3893&rep=rep1&type=pdf
-    for i in range(nv):
-        for j in range(nv):
-            if G.Adj[i, j] != 0:
-                if i != j:
-                    G.p[i, j] = min(1 / G.d[i], 1 / G.d[j])
-            else:
-                G.p[i, j] = 0
-
-    for i in range(nv):
-        try:
-            G.p[i, i] = 1 - sum(G.p[i, :])
-        except:
-            tmp = 0
-
-    return G
-
-def calc_ci_weights_ver3(S1, local_inf_vec, method_):
-    # Number of covariance matrices 
-    nCovSamples = size(S1, 3)
-
-    # Generate a random initialize weight and normalize it so 
-    # it sums up to 1.
-    x0 = rand(nCovSamples, 1)
-    x0 = x0 ./ sum(x0)
-
-    # Thos constraint ensures that the sun of the weights is 1
-    Aeq = ones(size(x0))'
-    beq = 1
-
-    # Weights belong to the interval [0,1]
-    lb = zeros(size(x0))'
-    ub = ones(size(x0))'
-    A = []
-    b = []
-    nonlcon = []
-
-    if verLessThan('matlab', '8.4'):
-        options = optimset('Algorithm', 'sqp')
-
-        if strcmp(method_, 'tr'):
-            x = fmincon(@cost_ci_tr, x0, A, b, Aeq, beq, lb, ub, nonlcon, options)
-        elif strcmp(method_, 'det'):
-            x = fmincon(@cost_ci_det, x0, A, b, Aeq, beq, lb, ub, nonlcon, options)
-
-        else:
-        options = optimoptions('fmincon', 'Display', 'none', 'Algorithm', 'sqp')
+    p = np.minimum(1.0 / d[:, None], 1.0 / d[None, :])
+    p[Adj == 0] = 0
+    np.fill_diagonal(p, 0)
+    np.fill_diagonal(p, 1 - np.sum(p, axis=1))
 
-        if strcmp(method_, 'tr'):
-            x = fmincon(@cost_ci_tr, x0, A, b, Aeq, beq, lb, ub, nonlcon, options)
-        elif strcmp(method_, 'det'):
-            x = fmincon(@cost_ci_det, x0, A, b, Aeq, beq, lb, ub, nonlcon, options)
+    return Graph(Adj, d, p)
 
-    # CI weghts
-    weights_ci = x
 
-    # Normalize just in case
-    if sum(weights_ci) > 1:
-        weights_ci = weights_ci ./ sum(weights_ci)
+# Covariance intersection weights of a set of information matrices, and the fused information matrix and vector
+# S1              - Stacked information matrices, shape (N, n, n)
+# local_inf_vec   - Stacked information vectors, shape (N, n, 1)
+# method_         - 'det' or 'tr', the cost of the fused covariance that is minimized
+# weights_0       - Optional initial weights, e.g. the weights of the previous consensus step
+def calc_ci_weights_ver3(S1, local_inf_vec, method_, weights_0=None):
+    if weights_0 is not None:
+        weights_0 = np.reshape(weights_0, (1, -1))
+    weights_ci = CIWeightSolver(method_).solve(S1[None], w0=weights_0)[0]
 
     # Now that we have the weights, calculate w1*I1+...+wn*In
-    inf_vect = special_dot_sum(weights_ci, local_inf_vec, 0)
-    inf_mat = calc_inf_ci(x)
+    inf_vect = np.einsum('k,kab->ab', weights_ci, local_inf_vec)
+    inf_mat = calc_inf_ci(weights_ci, S1)
 
     return weights_ci, inf_mat, inf_vect
 
 
-# Trace cost function as the objective function
-def cost_ci_tr(x):
-    information_matrix = zeros(size(S1[:, :, 1]))
+# Solver for covariance intersection weights on the simplex, for a batch of problems at once
+# Minimizes -log det(M) (method 'det') or trace(M^-1) (method 'tr') of M = sum_k w_k * S_k, w_k >= 0, sum w_k = 1.
+# Each iteration takes a Newton step on the face of the simplex of the non-zero weights, with the gradient and
+# Hessian computed analytically from one Cholesky factor of M:
+#   'det': with W_k = L^-1 * S_k * L^-T, g_k = -trace(W_k) and H_kl = trace(W_k * W_l)
+#   'tr':  with P = M^-1 and A_k = P * S_k, g_k = -trace(A_k * P) and H_kl = 2 * trace(A_k * A_l * P)
+# Weights at zero are released when their gradient is below the weighted mean gradient
+class CIWeightSolver:
+
+    def __init__(self, method='det', tol=1e-12, max_iter=50):
+        self.method = method
+        self.tol = tol
+        self.max_iter = max_iter
+        self.n_iter = 0
+
+    # Cholesky factors of a stack of matrices, and which of them are positive definite
+    # The factors of the others are set to the identity
+    @staticmethod
+    def cholesky(M):
+        try:
+            return np.linalg.cholesky(M), np.ones(np.shape(M)[0], dtype=bool)
+        except np.linalg.LinAlgError:
+            L = np.zeros(np.shape(M))
+            ok = np.ones(np.shape(M)[0], dtype=bool)
+            for b in range(np.shape(M)[0]):
+                try:
+                    L[b] = np.linalg.cholesky(M[b])
+                except np.linalg.LinAlgError:
+                    L[b] = np.eye(np.shape(M)[1])
+                    ok[b] = False
+            return L, ok
+
+    # Cost of each problem and, with derivatives, its gradient and Hessian
+    # S - Stacked information matrices, shape (B, K, n, n), w - weights, shape (B, K)
+    # Problems whose fused matrix is not positive definite get an infinite cost, a zero gradient
+    # and an identity Hessian, so the solver never steps into them and stops where it already is
+    def evaluate(self, S, w, derivatives=True):
+        M = np.einsum('bk,bkij->bij', w, S)
+        M = 0.5 * (M + np.transpose(M, (0, 2, 1)))
+        L, ok = self.cholesky(M)
+        L_inv = np.linalg.inv(L)
+
+        if self.method == 'tr':
+            f = np.where(ok, np.sum(L_inv**2, axis=(1, 2)), np.inf)
+            if not derivatives:
+                return f
+            P = np.matmul(np.transpose(L_inv, (0, 2, 1)), L_inv)
+            A = np.matmul(P[:, None], S)
+            AP = np.matmul(A, P[:, None])
+            g = -np.einsum('bkii->bk', AP)
+            H = 2 * np.einsum('bkij,blji->bkl', A, AP)
+        else:
+            f = np.where(ok, -2 * np.sum(np.log(np.diagonal(L, axis1=1, axis2=2)), axis=1), np.inf)
+            if not derivatives:
+                return f
+            W = np.matmul(np.matmul(L_inv[:, None], S), np.transpose(L_inv, (0, 2, 1))[:, None])
+            g = -np.einsum('bkii->bk', W)
+            H = np.einsum('bkij,blij->bkl', W, W)
+        g = np.where(ok[:, None], g, 0)
+        H = np.where(ok[:, None, None], H, np.eye(np.shape(w)[1]))
+        return f, g, H
+
+    # Weights of each problem, shape (B, K)
+    # mask    - Which of the K matrices take part in each problem, the others get a zero weight
+    # w0      - Initial weights (warm start), uniform over the mask by default
+    #           A warm start whose fused matrix is singular (typically a vertex of the simplex) is pulled back
+    #           toward uniform
+    def solve(self, S, mask=None, w0=None):
+        B, K = np.shape(S)[0:2]
+        if mask is None:
+            mask = np.ones((B, K), dtype=bool)
+        uniform = mask / np.sum(mask, axis=1, keepdims=True).astype(np.float64)
+        if w0 is None:
+            w = uniform
+        else:
+            w = np.where(mask, np.clip(w0, 0, None), 0)
+            total = np.sum(w, axis=1, keepdims=True)
+            w = np.where(total > 0, w / np.where(total > 0, total, 1), uniform)
+
+        # Padded matrices are never weighted, but must keep the Cholesky factorizations defined
+        S = np.where(mask[:, :, None, None], S, 0)
+
+        eps = 1e-14
+        for pullback in range(30):
+            singular = np.isinf(self.evaluate(S, w, derivatives=False))
+            if not np.any(singular):
+                break
+            w = np.where(singular[:, None], 0.5 * w + 0.5 * uniform, w)
+
+        for self.n_iter in range(self.max_iter):
+            f, g, H = self.evaluate(S, w)
+
+            # Free weights: the non-negligible ones, and the others if they would decrease the cost
+            nu = np.sum(w * g, axis=1, keepdims=True)
+            free = mask & ((w > 1e-9) | (g < nu))
+
+            # Newton step on the face of the simplex, from the KKT system [H 1; 1^T 0] [d; lambda] = [-g; 0]
+            # Fixed weights get an identity row so their step is zero
+            reg = 1e-12 * np.max(np.abs(np.diagonal(H, axis1=1, axis2=2)), axis=1)
+            KKT = np.zeros((B, K + 1, K + 1))
+            KKT[:, 0:K, 0:K] = H * free[:, :, None] * free[:, None, :]
+            KKT[:, np.arange(K), np.arange(K)] += np.where(free, reg[:, None], 1)
+            KKT[:, 0:K, K] = free
+            KKT[:, K, 0:K] = free
+            rhs = np.zeros((B, K + 1, 1))
+            rhs[:, 0:K, 0] = -g * free
+            d = np.linalg.solve(KKT, rhs)[:, 0:K, 0] * free
+
+            decrement = -np.sum(g * d, axis=1)
+            done = decrement <= self.tol * np.maximum(1, np.abs(f))
+            if np.all(done):
+                break
+
+            # Step a fraction of the way to the boundary, so the non-zero weights stay positive,
+            # then backtrack until the cost decreases. A singular fused matrix has an infinite cost and is rejected
+            shrinking = (d < 0) & (w > eps)
+            ratio = np.where(shrinking, w / np.where(shrinking, -d, 1), np.inf)
+            alpha = np.minimum(1, 0.99 * np.min(ratio, axis=1))
+            for backtrack in range(30):
+                w_new = np.clip(w + alpha[:, None] * d, 0, None)
+                w_new = w_new / np.sum(w_new, axis=1, keepdims=True)
+                f_new = self.evaluate(S, w_new, derivatives=False)
+                accepted = done | (f_new <= f - 1e-4 * alpha * decrement)
+                if np.all(accepted):
+                    break
+                alpha = np.where(accepted, alpha, alpha / 2)
+
+            # Problems that never found a decrease keep their weights
+            w = np.where((done | ~accepted)[:, None], w, w_new)
+        return w
 
-    for i_tr in range(length(x)):
-        information_matrix = information_matrix + x[i_tr, 1] * (S1[:, :, i_tr])
 
-    # Make the information matrix symetric in case numerical errors during the summation calculation
-    information_matrix = 0.5 * (information_matrix + information_matrix')
+# Trace cost function as the objective function
+def cost_ci_tr(x, S1):
+    information_matrix = calc_inf_ci(x, S1)
 
-    cost_tr = trace(np.linalg.inv(information_matrix))
+    cost_tr = np.trace(np.linalg.inv(information_matrix))
     return cost_tr
 
 
 # Determinant cost function
-def cost_ci_det(x):
-    information_matrix = zeros(size(S1[:, :, 1]))
+def cost_ci_det(x, S1):
+    information_matrix = calc_inf_ci(x, S1)
 
-    for i_det in range(length(x)):
-        information_matrix = information_matrix + x[i_det, 1] * (S1[:, :, i_det])
-
-    # Make the information matrix symetric in case numerical errors during the summation calculation
-    information_matrix = 0.5 * (information_matrix + information_matrix')
-
-    cost_det = -log(det(information_matrix))
+    sign, logdet = np.linalg.slogdet(information_matrix)
+    cost_det = -logdet
 
     # cost calculation near the singularity.
-    if isinf(cost_det):
-        cost_det = log(det(np.linalg.inv(information_matrix)))
+    if sign <= 0:
+        cost_det = np.inf
 
     return cost_det
 
 
-def calc_inf_ci(x):
-    information_matrix = zeros(size(S1[:, :, 1]))
-
-    for i_det in range(length(x)):
-        information_matrix = information_matrix  +x[i_det, 1] * (S1[:, :, i_det])
+def calc_inf_ci(x, S1):
+    information_matrix = np.einsum('k,kab->ab', x, S1)
 
     # Make the information matrix symetric in case numerical errors during the summation calculation
-    information_matrix = 0.5 * (information_matrix + information_matrix')
+    information_matrix = 0.5 * (information_matrix + np.transpose(information_matrix))
 
     return information_matrix
-
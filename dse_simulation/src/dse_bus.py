@@ -0,0 +1,147 @@
+import collections
+import rospy
+from rospy.numpy_msg import numpy_msg
+
+
+# Publish/subscribe used by the DSE nodes, so the same nodes can run on ROS or together in one process
+# The nodes create their publishers and subscribers through dse_bus.Publisher and dse_bus.Subscriber,
+# and read the clock through dse_bus.get_time, dse_bus.now and dse_bus.sleep, which all go to the current
+# backend. The default backend is rospy, call set_backend(InProcessBus()) before creating the nodes to run
+# them without a roscore. rospy.init_node is then not needed either
+
+
+# Backend that uses rospy publishers and subscribers
+# Topics use the numpy_msg version of the message classes, so received array fields are numpy arrays read
+# straight from the message buffer, which dse_lib.multi_array_data then uses without copying
+class RospyBus:
+
+    def publisher(self, topic, msg_type, queue_size=10):
+        return rospy.Publisher(topic, numpy_msg(msg_type), queue_size=queue_size)
+
+    def subscriber(self, topic, msg_type, callback):
+        return rospy.Subscriber(topic, numpy_msg(msg_type), callback)
+
+    def get_time(self):
+        return rospy.get_time()
+
+    def now(self):
+        return rospy.Time.now()
+
+    def sleep(self, duration):
+        rospy.sleep(duration)
+
+
+# Backend that hands every message to the subscribers of its topic within this process
+# Messages are passed by reference, without serialization, so numpy arrays stored in them are shared with
+# the subscribers. Readers should not modify them (see dse_lib.multi_array_data)
+# If synchronous, publish calls the subscribers right away, otherwise messages are queued until spin_once
+# The clock is simulated, it starts at start_time and only moves forward with sleep
+class InProcessBus:
+
+    def __init__(self, synchronous=True, start_time=0.0):
+        self.synchronous = synchronous
+        self.callbacks = collections.defaultdict(list)
+        self.queue = collections.deque()
+        self.n_published = collections.Counter()
+        self.time = start_time
+
+    def get_time(self):
+        return self.time
+
+    def now(self):
+        return rospy.Time.from_sec(self.time)
+
+    def sleep(self, duration):
+        self.time += duration
+
+    def publisher(self, topic, msg_type, queue_size=10):
+        return InProcessPublisher(self, topic)
+
+    def subscriber(self, topic, msg_type, callback):
+        self.callbacks[topic].append(callback)
+        return InProcessSubscriber(self, topic, callback)
+
+    def publish(self, topic, msg):
+        self.n_published[topic] += 1
+        if self.synchronous:
+            self.deliver(topic, msg)
+        else:
+            self.queue.append((topic, msg))
+
+    # Call every subscriber of the topic with the message
+    def deliver(self, topic, msg):
+        for callback in list(self.callbacks[topic]):
+            callback(msg)
+
+    # Deliver the queued messages, including the ones published while delivering. Returns how many were delivered
+    def spin_once(self):
+        n = 0
+        while len(self.queue) > 0:
+            topic, msg = self.queue.popleft()
+            self.deliver(topic, msg)
+            n += 1
+        return n
+
+
+class InProcessPublisher:
+
+    def __init__(self, bus, topic):
+        self.bus = bus
+        self.name = topic
+
+    def publish(self, msg):
+        self.bus.publish(self.name, msg)
+
+    # Number of subscribers, same as rospy.Publisher.get_num_connections
+    def get_num_connections(self):
+        return len(self.bus.callbacks[self.name])
+
+    def unregister(self):
+        pass
+
+
+class InProcessSubscriber:
+
+    def __init__(self, bus, topic, callback):
+        self.bus = bus
+        self.name = topic
+        self.callback = callback
+
+    def unregister(self):
+        if self.callback in self.bus.callbacks[self.name]:
+            self.bus.callbacks[self.name].remove(self.callback)
+
+
+bus = RospyBus()
+
+
+# Use another backend for the publishers and subscribers created from now on
+def set_backend(backend):
+    global bus
+    bus = backend
+    return bus
+
+
+# Create a publisher on the current backend, same arguments as rospy.Publisher
+def Publisher(topic, msg_type, queue_size=10):
+    return bus.publisher(topic, msg_type, queue_size)
+
+
+# Create a subscriber on the current backend, same arguments as rospy.Subscriber
+def Subscriber(topic, msg_type, callback):
+    return bus.subscriber(topic, msg_type, callback)
+
+
+# Current time of the backend in seconds, same as rospy.get_time
+def get_time():
+    return bus.get_time()
+
+
+# Current time of the backend as a rospy.Time, same as rospy.Time.now
+def now():
+    return bus.now()
+
+
+# Sleep for a duration in seconds on the backend's clock, same as rospy.sleep
+def sleep(duration):
+    bus.sleep(duration)
@@ -9,4 +9,5 @@ INF_MATRIX_INITIAL = 10000          # Initial information matrix (covariance) va
 INF_VECTOR_INITIAL = 0.01           # Initial information vector (states) value. x = Y^-1*y, equivalent to 1
 MOTION_BASE_COVARIANCE = 0.000001   # Motion model covariance for velocity. Equivalent to 1 mm/sec standard deviation
 GAZEBO_REFERENCE_OBJECT_NAME = 'aruco_marker::link'
-GAZEBO_REFERENCE_OBJECT_ID = 0
\ No newline at end of file
+GAZEBO_REFERENCE_OBJECT_ID = 0
+EMPTY_SLOT_ID = -2                  # ID listed for a state slot whose agent was dropped (-1 is used for waypoints)
\ No newline at end of file
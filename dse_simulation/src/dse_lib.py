@@ -12,6 +12,7 @@ from std_msgs.msg import MultiArrayDimension
 from dse_msgs.msg import InfFilterPartials
 from dse_msgs.msg import InfFilterResults
 from scipy.spatial.transform import Rotation as R
+from scipy import linalg
 import matplotlib.pyplot as plt
 
 import dse_constants
@@ -64,6 +65,20 @@ def aruco_R_from_range_3D(range):
     return r_var
 
 
+# Batched aruco_R_from_range, returns the diagonal of R for every range, shape (n * 6,)
+def aruco_R_from_range_batched(range):
+    x = 10*np.array([0.01, 0.01, 0.01, 0.01, 0.01, 0.01]) # Radians
+    r_std = np.asarray(range)[:, None] * x[None, :]
+    return np.ravel(r_std * r_std)
+
+
+# Batched aruco_R_from_range_3D, returns the diagonal of R for every range, shape (n * 3,)
+def aruco_R_from_range_3D_batched(range):
+    x = 10*np.array([0.01, 0.01, 0.01]) # Radians
+    r_std = (np.asarray(range)[:, None] + 0.001) * x[None, :]
+    return np.ravel(r_std * r_std)
+
+
 # Compute the 2D rotation matrix from the angle theta
 def theta_2_rotm(theta):
     R = np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
@@ -72,18 +87,70 @@ def theta_2_rotm(theta):
 
 # Converts a quaternion into euler angles, using the euler order described in dse_constants.py
 def quat2eul(quat):
-    r = R.from_quat(quat)
-    eul = r.as_euler(dse_constants.EULER_ORDER)
+    eul = quat2eul_batched(np.reshape(quat, (1, 4)))[0]
     return eul
 
 
 # Converts euler angles into a quaternion, using the euler order described in dse_constants.py
 def eul2quat(eul):
-    r = R.from_euler(dse_constants.EULER_ORDER, eul[:, 0])
-    quat = r.as_quat()
+    quat = eul2quat_batched(np.reshape(eul, (1, 3)))[0]
     return quat
 
 
+# Converts quaternions [x, y, z, w], shape (n, 4), into euler angles, shape (n, 3)
+def quat2eul_batched(quat):
+    if dse_constants.EULER_ORDER == 'zyx':
+        return quat_to_euler_zyx(quat)
+    return R.from_quat(quat).as_euler(dse_constants.EULER_ORDER)
+
+
+# Converts euler angles, shape (n, 3), into quaternions [x, y, z, w], shape (n, 4)
+def eul2quat_batched(eul):
+    if dse_constants.EULER_ORDER == 'zyx':
+        return euler_zyx_to_quat(eul)
+    return R.from_euler(dse_constants.EULER_ORDER, eul).as_quat()
+
+
+# Quaternions [x, y, z, w], shape (n, 4), to euler angles [z_ang, y_ang, x_ang] (extrinsic 'zyx'), shape (n, 3)
+# Same as R.from_quat(quat).as_euler('zyx'), computed from the needed rotation matrix entries
+def quat_to_euler_zyx(quat):
+    q = np.asarray(quat, dtype=np.float64)
+    q = q / np.linalg.norm(q, axis=1)[:, None]
+    x, y, z, w = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    r00 = 1 - 2 * (y * y + z * z)
+    r01 = 2 * (x * y - z * w)
+    r02 = 2 * (x * z + y * w)
+    r12 = 2 * (y * z - x * w)
+    r22 = 1 - 2 * (x * x + y * y)
+    return np.stack((np.arctan2(-r01, r00), np.arcsin(np.clip(r02, -1, 1)), np.arctan2(-r12, r22)), axis=1)
+
+
+# Euler angles [z_ang, y_ang, x_ang] (extrinsic 'zyx'), shape (n, 3), to quaternions [x, y, z, w], shape (n, 4)
+# Same as R.from_euler('zyx', eul).as_quat(), the product of the three axis quaternions qx * qy * qz
+def euler_zyx_to_quat(eul):
+    half = 0.5 * np.asarray(eul, dtype=np.float64)
+    ca, cb, cc = np.cos(half[:, 0]), np.cos(half[:, 1]), np.cos(half[:, 2])
+    sa, sb, sc = np.sin(half[:, 0]), np.sin(half[:, 1]), np.sin(half[:, 2])
+    return np.stack((cc * sb * sa + sc * cb * ca,
+                     cc * sb * ca - sc * cb * sa,
+                     cc * cb * sa + sc * sb * ca,
+                     cc * cb * ca - sc * sb * sa), axis=1)
+
+
+# Heading (the first 'zyx' euler angle) of quaternions [x, y, z, w], shape (n, 4), for the planar case
+def quat2yaw(quat):
+    q = np.asarray(quat, dtype=np.float64)
+    x, y, z, w = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    return np.arctan2(2 * (z * w - x * y), w * w + x * x - y * y - z * z)
+
+
+# Quaternions [x, y, z, w], shape (n, 4), of a rotation by yaw about the z axis, shape (n,)
+def yaw2quat(yaw):
+    half = 0.5 * np.asarray(yaw, dtype=np.float64)
+    zeros = np.zeros(np.shape(half))
+    return np.stack((zeros, zeros, np.sin(half), np.cos(half)), axis=1)
+
+
 # Expects a quaternion in the form: orientation.x,y,z,w
 def quat_from_pose2eul(orientation):
     quat = [0, 0, 0, 0]
@@ -156,38 +223,86 @@ def pose_from_state_3D(x):
 
 
 # Fill and return a pose array with values from the state variable x
+# All orientations are converted in one batched call
 def pose_array_from_state(pose_array, x, dim_state, dim_obs):
     num_objs = int(len(x) / dim_state)
-    for i in range(num_objs):
-
-        i_low = dim_state * i
-        i_high = i_low + dim_obs
-        x_i = x[i_low:i_high]
-
-        if dim_state == 6:
-            pose_array.poses.append(pose_from_state_3D(x_i))
-        else:
-            pose_array.poses.append(pose_from_state(x_i))
-
+    x_objs = np.reshape(x, (num_objs, dim_state))[:, 0:dim_obs]
+    pose_array.poses.extend(poses_from_arrays(*pose_arrays_from_obs(x_objs, dim_obs)))
     return pose_array
 
 
 # Fill and return a pose array with values from the state variable x
+# All orientations are converted in one batched call. The poses can also be given as an (n, 7) pose array
 def state_from_pose_array(pose_array, dim_state, dim_obs):
-    num_objs = np.shape(pose_array.poses)[0]
-    x = np.zeros((num_objs * dim_state, 1))
+    if not isinstance(pose_array, np.ndarray):
+        pose_array = pose_array.poses
+    position, quat = arrays_from_poses(pose_array)
+    num_objs = np.shape(position)[0]
+    x = np.zeros((num_objs, dim_state))
+
+    if dim_obs == 3:
+        x[:, 0:2] = position[:, 0:2]
+        x[:, 2] = quat2yaw(quat)
+    else:
+        x[:, 0:3] = position
+        x[:, 3:6] = quat2eul_batched(quat)
 
-    for i in range(num_objs):
+    return np.reshape(x, (num_objs * dim_state, 1))
 
-        i_low = dim_state * i
-        i_high = i_low + dim_obs
 
-        if dim_state == 6:
-            x[i_low:i_high] = state_from_pose_3D(pose_array.poses[i])
-        else:
-            x[i_low:i_high] = state_from_pose(pose_array.poses[i])
+# Positions, shape (n, 3), and quaternions [x, y, z, w], shape (n, 4), of a list of poses
+def arrays_from_poses(poses):
+    pose_arr = pose_matrix_from_poses(poses)
+    return pose_arr[:, 0:3], pose_arr[:, 3:7]
+
+
+# Contiguous (n, 7) array of [position x, y, z, quaternion x, y, z, w], one row per pose
+# An array that is already in this form is passed through unchanged
+def pose_matrix_from_poses(poses):
+    if isinstance(poses, np.ndarray):
+        return np.reshape(poses, (-1, 7))
+    pose_arr = np.array([(pose.position.x, pose.position.y, pose.position.z, pose.orientation.x,
+                          pose.orientation.y, pose.orientation.z, pose.orientation.w) for pose in poses])
+    return np.reshape(pose_arr, (len(poses), 7))
+
+
+# IDs, shape (n,), and (n, 7) pose array (see pose_matrix_from_poses) of a PoseMarkers message
+def arrays_from_pose_markers(markers):
+    ids = np.array(markers.ids, dtype=int)
+    return ids, pose_matrix_from_poses(markers.pose_array.poses)
 
-    return x
+
+# Fill and return a PoseMarkers message from IDs, shape (n,), and an (n, 7) pose array
+def pose_markers_from_arrays(markers, ids, pose_arr):
+    pose_arr = np.reshape(pose_arr, (-1, 7))
+    markers.ids = [int(id) for id in ids]
+    markers.pose_array.poses = poses_from_arrays(pose_arr[:, 0:3], pose_arr[:, 3:7])
+    return markers
+
+
+# List of poses from positions, shape (n, 3), and quaternions [x, y, z, w], shape (n, 4)
+def poses_from_arrays(position, quat):
+    poses = []
+    for i in range(np.shape(position)[0]):
+        pose = Pose()
+        pose.position.x, pose.position.y, pose.position.z = position[i]
+        pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w = quat[i]
+        poses.append(pose)
+    return poses
+
+
+# Positions and quaternions of stacked observations or agent poses, shape (n, dim_obs)
+# 3D-observation: [x, y, theta], 6D-observation: [x, y, z, z_ang, y_ang, x_ang]
+def pose_arrays_from_obs(z, dim_obs):
+    n = np.shape(z)[0]
+    position = np.zeros((n, 3))
+    if dim_obs == 3:
+        position[:, 0:2] = z[:, 0:2]
+        quat = yaw2quat(z[:, 2])
+    else:
+        position[:, :] = z[:, 0:3]
+        quat = eul2quat_batched(z[:, 3:6])
+    return position, quat
 
 
 # Expects a pose in the form: x, y, z, w
@@ -226,46 +341,375 @@ def pose_from_measurement_3D(x):
 
 
 # Fill and return a pose array with values from the measurement z
+# All orientations are converted in one batched call
 def pose_array_from_measurement(pose_array, z, dim_obs):
     num_objs = int(len(z) / dim_obs)
-    for i in range(num_objs):
-
-        i_low = dim_obs * i
-        i_high = i_low + dim_obs
-        x_i = z[i_low:i_high]
-
-        if dim_obs == 3:
-            pose_array.poses.append(pose_from_measurement_3D(x_i))
-        else:
-            pose_array.poses.append(pose_from_measurement(x_i))
-
+    z_objs = np.reshape(z, (num_objs, dim_obs))
+    pose_array.poses.extend(poses_from_arrays(*pose_arrays_from_obs(z_objs, dim_obs)))
     return pose_array
 
 
 # Fill in a multi-array ROS message type with a 2D input array
+# A contiguous array is stored as a flat view, without copying
 def multi_array_2d_input(mat, multi_arr):
-    multi_arr.layout.dim.append(MultiArrayDimension())
-    multi_arr.layout.dim.append(MultiArrayDimension())
-    multi_arr.layout.dim[0].label = 'rows'
-    multi_arr.layout.dim[0].size = np.shape(mat)[0]
-    multi_arr.layout.dim[0].stride = np.shape(mat)[0]*np.shape(mat)[1]
-    multi_arr.layout.dim[1].label = 'cols'
-    multi_arr.layout.dim[1].size = np.shape(mat)[1]
-    multi_arr.layout.dim[1].stride = np.shape(mat)[1]
-    multi_arr.layout.data_offset = 0
-
-    multi_arr.data = mat.flatten()
+    rows, cols = np.shape(mat)
+    multi_array_set_layout(multi_arr, ['rows', 'cols'], [rows, cols], [rows * cols, cols])
+    multi_arr.data = np.ravel(mat)
     return multi_arr
 
 
 # Grab and return a 2D array from a multi-array ROS message
+# Block-encoded arrays (see multi_array_blocks_input) are expanded back into the dense matrix,
+# as are packed symmetric arrays (see multi_array_sym_input)
 def multi_array_2d_output(multi_arr):
-    arr = np.array(multi_arr.data)
+    if multi_array_is_blocks(multi_arr):
+        return multi_array_blocks_to_dense(multi_arr)
+    if multi_array_is_packed_sym(multi_arr):
+        return multi_array_sym_output(multi_arr)
     shape = [multi_arr.layout.dim[0].size, multi_arr.layout.dim[1].size]
-    mat = arr.reshape(shape)
+    mat = multi_array_data(multi_arr).reshape(shape)
     return mat
 
 
+# Set the layout of a multi-array ROS message, reusing the dimension objects it already has
+def multi_array_set_layout(multi_arr, labels, sizes, strides):
+    dims = multi_arr.layout.dim
+    del dims[len(labels):]
+    while len(dims) < len(labels):
+        dims.append(MultiArrayDimension())
+    for dim, label, size, stride in zip(dims, labels, sizes, strides):
+        dim.label = label
+        dim.size = size
+        dim.stride = stride
+    multi_arr.layout.data_offset = 0
+    return multi_arr
+
+
+# Flat float array of the data of a multi-array ROS message
+# Raw buffers are viewed through np.frombuffer and arrays (numpy_msg, as received through dse_bus.RospyBus) are
+# used as they are, without copying.
+# The result may share memory with the message, so it is read-only
+def multi_array_data(multi_arr, dtype=np.float64):
+    data = multi_arr.data
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        arr = np.frombuffer(data, dtype=dtype)
+    else:
+        arr = np.asarray(data, dtype=dtype).view()
+    arr.setflags(write=False)
+    return arr
+
+
+# Fill in a multi-array ROS message type with a symmetric 2D input array
+# Only the upper triangle is sent, row by row, and the layout is labeled 'packed_sym'
+def multi_array_sym_input(mat, multi_arr):
+    n = np.shape(mat)[0]
+    n_packed = int(n * (n + 1) / 2)
+    multi_array_set_layout(multi_arr, ['packed_sym', 'cols'], [n, n], [n_packed, n])
+    multi_arr.data = mat[np.triu_indices(n)]
+    return multi_arr
+
+
+# Grab and return the full symmetric 2D array from a packed multi-array ROS message
+def multi_array_sym_output(multi_arr):
+    n = multi_arr.layout.dim[0].size
+    rows, cols = np.triu_indices(n)
+    data = multi_array_data(multi_arr)
+    mat = np.zeros((n, n))
+    mat[rows, cols] = data
+    mat[cols, rows] = data
+    return mat
+
+
+# Check whether a multi-array ROS message carries the packed upper triangle of a symmetric matrix
+def multi_array_is_packed_sym(multi_arr):
+    return len(multi_arr.layout.dim) > 0 and multi_arr.layout.dim[0].label == 'packed_sym'
+
+
+# Fill in a QuantizedArray ROS message with a 2D input array, quantized to save bandwidth
+# precision       - 'int16', rounded with one scale per block_size x block_size block, otherwise 'float32'
+# conservative    - For symmetric positive definite information matrices. The decoded matrix is scaled down
+#                   (see conservative_scale) so it never holds more information than the input
+# The quantized values are sent as raw bytes in the uint8[] data field
+def quantized_array_input(mat, quantized, precision='int16', block_size=6, conservative=False):
+    mat = np.asarray(mat, dtype=np.float64)
+    rows, cols = np.shape(mat)
+    if precision == 'int16':
+        scales = quantization_scales(mat, block_size)
+        values = np.round(mat / expand_block_scales(scales, block_size, rows, cols)).astype('<i2')
+    else:
+        precision = 'float32'
+        scales = np.zeros(0)
+        values = mat.astype('<f4')
+
+    quantized.precision = precision
+    quantized.rows = rows
+    quantized.cols = cols
+    quantized.block_size = block_size
+    quantized.block_scales = np.ravel(scales)
+    quantized.conservative = conservative
+    quantized.scale = 1.0
+    if conservative:
+        quantized.scale = conservative_scale(mat, dequantize(values, scales, block_size))
+    quantized.data = values.tobytes()
+    return quantized
+
+
+# Grab and return the 2D array from a QuantizedArray ROS message (see quantized_array_input)
+def quantized_array_output(quantized):
+    rows = quantized.rows
+    cols = quantized.cols
+    dtype = np.dtype('<i2') if quantized.precision == 'int16' else np.dtype('<f4')
+    data = quantized.data
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        values = np.frombuffer(data, dtype=dtype, count=rows*cols)
+    else:
+        values = np.asarray(data, dtype=np.uint8).view(dtype)
+    values = values.reshape((rows, cols))
+
+    mat = dequantize(values, np.asarray(quantized.block_scales, dtype=np.float64), quantized.block_size)
+    if quantized.conservative:
+        mat = quantized.scale * (mat + np.transpose(mat)) / 2
+    return mat
+
+
+# Check whether a QuantizedArray ROS message carries an array
+def quantized_array_is_set(quantized):
+    return len(quantized.precision) > 0
+
+
+# Grab and return the 2D array of a message field sent either quantized or as a multi-array
+def multi_array_or_quantized_output(multi_arr, quantized):
+    if quantized_array_is_set(quantized):
+        return quantized_array_output(quantized)
+    return multi_array_2d_output(multi_arr)
+
+
+# Scale of each block_size x block_size block of mat for int16 quantization, the largest value maps to 32767
+def quantization_scales(mat, block_size):
+    rows, cols = np.shape(mat)
+    n_block_rows = int(np.ceil(rows / float(block_size)))
+    n_block_cols = int(np.ceil(cols / float(block_size)))
+    padded = np.zeros((n_block_rows * block_size, n_block_cols * block_size))
+    padded[0:rows, 0:cols] = np.abs(mat)
+    max_abs = np.max(np.reshape(padded, (n_block_rows, block_size, n_block_cols, block_size)), axis=(1, 3))
+    max_abs[max_abs == 0] = 32767
+    return max_abs / 32767
+
+
+# Scale of every value of a rows x cols array from the scales of its blocks
+def expand_block_scales(scales, block_size, rows, cols):
+    scales = np.reshape(scales, (int(np.ceil(rows / float(block_size))), -1))
+    return np.repeat(np.repeat(scales, block_size, axis=0), block_size, axis=1)[0:rows, 0:cols]
+
+
+# Float64 values of quantized values, int16 with per-block scales or float32 (no scales)
+def dequantize(values, scales, block_size):
+    if values.dtype == np.int16:
+        rows, cols = np.shape(values)
+        return values * expand_block_scales(scales, block_size, rows, cols)
+    return values.astype(np.float64)
+
+
+# Factor s for which s * mat_q holds no more information than mat, with mat symmetric positive definite.
+# With E = mat_q - mat and mat = L * L^T, mat - s * mat_q = (1 - s) * mat - s * E, which is positive
+# semi-definite for s = 1 / (1 + lambda_max(L^-1 * E * L^-T)). Unlike subtracting a bound from the diagonal,
+# scaling keeps the decoded matrix positive definite, even for weakly observed states.
+# The relative margin of 1e-6 covers the rounding of these computations and of the reader's scaling
+def conservative_scale(mat, mat_q):
+    mat = (mat + np.transpose(mat)) / 2
+    err = (mat_q + np.transpose(mat_q)) / 2 - mat
+    L = linalg.cholesky(mat, lower=True, check_finite=False)
+    L_inv_err = linalg.solve_triangular(L, err, lower=True, check_finite=False)
+    err_rel = linalg.solve_triangular(L, np.transpose(L_inv_err), lower=True, check_finite=False)
+    lambda_max = np.max(np.linalg.eigvalsh((err_rel + np.transpose(err_rel)) / 2))
+    return 1 / (1 + max(lambda_max, 0) + 1e-6)
+
+
+# Check whether a multi-array ROS message carries a list of blocks instead of a dense matrix
+def multi_array_is_blocks(multi_arr):
+    return len(multi_arr.layout.dim) > 0 and multi_arr.layout.dim[0].label in ('blocks', 'sym_blocks')
+
+
+# Fill in a multi-array ROS message type with a list of blocks of a larger 2D array
+# rows/cols       - Index (in blocks) of each block within the full array
+# blocks          - Array of blocks, shape (n_blocks, block_rows, block_cols)
+# shape           - Shape of the full array
+# symmetric       - Only one of each pair of mirrored blocks is sent, the reader fills in the transpose
+# Each block is stored as [row, col, block.flatten()]
+def multi_array_blocks_input(rows, cols, blocks, shape, multi_arr, symmetric=False):
+    n_blocks = len(rows)
+    block_rows = np.shape(blocks)[1]
+    block_cols = np.shape(blocks)[2]
+    record = 2 + block_rows * block_cols
+
+    labels = ['sym_blocks' if symmetric else 'blocks', 'rows', 'cols', 'block_rows', 'block_cols']
+    sizes = [n_blocks, shape[0], shape[1], block_rows, block_cols]
+    strides = [n_blocks * record, 0, 0, block_rows * block_cols, block_cols]
+    multi_array_set_layout(multi_arr, labels, sizes, strides)
+
+    data = np.zeros((n_blocks, record))
+    data[:, 0] = rows
+    data[:, 1] = cols
+    data[:, 2:] = np.reshape(blocks, (n_blocks, block_rows * block_cols))
+    multi_arr.data = np.ravel(data)
+    return multi_arr
+
+
+# Grab and return the block list from a block-encoded multi-array ROS message
+# Returns the block row/col indices, the blocks, the full array shape and whether it is symmetric
+def multi_array_blocks_output(multi_arr):
+    dims = multi_arr.layout.dim
+    n_blocks = dims[0].size
+    shape = [dims[1].size, dims[2].size]
+    block_rows = dims[3].size
+    block_cols = dims[4].size
+    symmetric = dims[0].label == 'sym_blocks'
+
+    data = multi_array_data(multi_arr).reshape((n_blocks, 2 + block_rows * block_cols))
+    rows = data[:, 0].astype(int)
+    cols = data[:, 1].astype(int)
+    blocks = data[:, 2:].reshape((n_blocks, block_rows, block_cols))
+    return rows, cols, blocks, shape, symmetric
+
+
+# Expand a block-encoded multi-array ROS message into the dense 2D array
+def multi_array_blocks_to_dense(multi_arr):
+    shape = [multi_arr.layout.dim[1].size, multi_arr.layout.dim[2].size]
+    return multi_array_blocks_add(multi_arr, np.zeros(shape))
+
+
+# Add the blocks of a block-encoded multi-array ROS message to the dense 2D array mat, in place
+# Repeated blocks are summed, so per-observation contributions can be sent without combining them first
+def multi_array_blocks_add(multi_arr, mat):
+    rows, cols, blocks, shape, symmetric = multi_array_blocks_output(multi_arr)
+    block_rows = np.shape(blocks)[1]
+    block_cols = np.shape(blocks)[2]
+
+    for row, col, block in zip(rows, cols, blocks):
+        mat[row*block_rows:(row+1)*block_rows, col*block_cols:(col+1)*block_cols] += block
+        if symmetric and row != col:
+            mat[col*block_cols:(col+1)*block_cols, row*block_rows:(row+1)*block_rows] += np.transpose(block)
+    return mat
+
+
+# Fill in the matrix and vector multi-array ROS messages with per-observation contributions
+# (see InformationFilterEngine.observation_blocks), as the observer/observed blocks of I and i
+def multi_array_observation_input(obs_slots, I_blocks, i_blocks, n_stored, matrix_arr, vector_arr):
+    n_obs = len(obs_slots)
+    d = int(np.shape(I_blocks)[1] / 2)
+    dim = n_stored * d
+
+    rows = np.concatenate((obs_slots[:, 0], obs_slots[:, 0], obs_slots[:, 1]))
+    cols = np.concatenate((obs_slots[:, 0], obs_slots[:, 1], obs_slots[:, 1]))
+    blocks = np.concatenate((I_blocks[:, 0:d, 0:d], I_blocks[:, 0:d, d:], I_blocks[:, d:, d:]))
+    matrix_arr = multi_array_blocks_input(rows, cols, blocks, [dim, dim], matrix_arr, symmetric=True)
+
+    rows = np.concatenate((obs_slots[:, 0], obs_slots[:, 1]))
+    blocks = np.concatenate((i_blocks[:, 0:d], i_blocks[:, d:]))
+    vector_arr = multi_array_blocks_input(rows, np.zeros(2 * n_obs), blocks, [dim, 1], vector_arr)
+    return matrix_arr, vector_arr
+
+
+# Fill in an InfBlocks ROS message with a list of blocks keyed by agent ID
+# row_ids/col_ids - ID of the agent of each block's rows/columns, no column IDs for vector blocks
+# blocks          - Array of blocks, shape (n_blocks, block_rows, block_cols)
+# symmetric       - Only one of each pair of mirrored blocks is sent, the reader fills in the transpose
+def inf_blocks_input(row_ids, col_ids, blocks, inf_blocks, symmetric=False):
+    blocks = np.asarray(blocks, dtype=np.float64)
+    inf_blocks.block_rows = np.shape(blocks)[1]
+    inf_blocks.block_cols = np.shape(blocks)[2]
+    inf_blocks.symmetric = symmetric
+    inf_blocks.row_ids = [int(id) for id in row_ids]
+    inf_blocks.col_ids = [int(id) for id in col_ids]
+    inf_blocks.data = np.ravel(blocks)
+    return inf_blocks
+
+
+# Grab and return the blocks of an InfBlocks ROS message
+# Returns the row and column IDs of each block, the blocks and whether the message is symmetric
+def inf_blocks_output(inf_blocks):
+    n_blocks = len(inf_blocks.row_ids)
+    shape = (n_blocks, inf_blocks.block_rows, inf_blocks.block_cols)
+    blocks = multi_array_data(inf_blocks).reshape(shape)
+    return np.array(inf_blocks.row_ids, dtype=int), np.array(inf_blocks.col_ids, dtype=int), blocks, \
+        inf_blocks.symmetric
+
+
+# Add the blocks of an InfBlocks ROS message to the dense 2D array mat, in place
+# The IDs are resolved to rows and columns of mat through the ID list. Repeated blocks are summed,
+# and blocks without column IDs are vector blocks
+def inf_blocks_add(inf_blocks, mat, id_list):
+    rows, cols, blocks = inf_blocks_entries(inf_blocks, id_list)
+    np.add.at(mat, (rows[:, :, None], cols[:, None, :]), blocks)
+    return mat
+
+
+# Overwrite the blocks of the dense 2D array mat with the blocks of an InfBlocks ROS message, in place
+def inf_blocks_set(inf_blocks, mat, id_list):
+    rows, cols, blocks = inf_blocks_entries(inf_blocks, id_list)
+    mat[rows[:, :, None], cols[:, None, :]] = blocks
+    return mat
+
+
+# Rows and columns within the dense array of every block of an InfBlocks ROS message, and the blocks
+# The transposes of the mirrored blocks of a symmetric message are included
+def inf_blocks_entries(inf_blocks, id_list):
+    row_ids, col_ids, blocks, symmetric = inf_blocks_output(inf_blocks)
+    block_rows = inf_blocks.block_rows
+    block_cols = inf_blocks.block_cols
+    agents = agent_index(id_list, block_rows)
+    rows = block_rows * agents.slots(row_ids)[:, None] + np.arange(block_rows)
+    if len(col_ids) == 0:
+        cols = np.zeros((len(row_ids), block_cols), dtype=int) + np.arange(block_cols)
+    else:
+        cols = block_cols * agents.slots(col_ids)[:, None] + np.arange(block_cols)
+    rows = np.reshape(rows, (len(row_ids), block_rows))
+    cols = np.reshape(cols, (len(row_ids), block_cols))
+    if symmetric:
+        off_diag = row_ids != col_ids
+        return np.concatenate((rows, cols[off_diag])), np.concatenate((cols, rows[off_diag])), \
+            np.concatenate((blocks, np.transpose(blocks[off_diag], (0, 2, 1))))
+    return rows, cols, blocks
+
+
+# Fill in the matrix and vector InfBlocks ROS messages with per-observation contributions
+# (see InformationFilterEngine.observation_blocks), keyed by the IDs of the observer and observed agent
+# obs_ids - IDs of the observer and the observed agent of each observation, shape (n_obs, 2)
+def inf_observation_blocks_input(obs_ids, I_blocks, i_blocks, matrix_blocks, vector_blocks):
+    obs_ids = np.reshape(obs_ids, (-1, 2))
+    d = int(np.shape(I_blocks)[1] / 2)
+
+    row_ids = np.concatenate((obs_ids[:, 0], obs_ids[:, 0], obs_ids[:, 1]))
+    col_ids = np.concatenate((obs_ids[:, 0], obs_ids[:, 1], obs_ids[:, 1]))
+    blocks = np.concatenate((I_blocks[:, 0:d, 0:d], I_blocks[:, 0:d, d:], I_blocks[:, d:, d:]))
+    matrix_blocks = inf_blocks_input(row_ids, col_ids, blocks, matrix_blocks, symmetric=True)
+
+    row_ids = np.concatenate((obs_ids[:, 0], obs_ids[:, 1]))
+    blocks = np.concatenate((i_blocks[:, 0:d], i_blocks[:, d:]))
+    vector_blocks = inf_blocks_input(row_ids, [], blocks, vector_blocks)
+    return matrix_blocks, vector_blocks
+
+
+# Check whether an InfFilterPartials ROS message carries its observations in the multi-array obs_matrix
+# (dense or block-encoded), instead of the InfBlocks keyed by agent ID
+def inf_partial_has_obs_matrix(partial):
+    return len(partial.obs_matrix.layout.dim) > 0
+
+
+# Grab and return the dense observation contributions (I, i) of an InfFilterPartials ROS message
+# Empty InfBlocks mean no observation, and give zero contributions
+def inf_partial_observation_output(partial, dim_state):
+    if inf_partial_has_obs_matrix(partial):
+        return multi_array_2d_output(partial.obs_matrix), multi_array_2d_output(partial.obs_vector)
+    n = dim_state * len(partial.ids)
+    inf_I = np.zeros((n, n))
+    inf_i = np.zeros((n, 1))
+    if len(partial.obs_matrix_blocks.row_ids) > 0:
+        inf_blocks_add(partial.obs_matrix_blocks, inf_I, partial.ids)
+        inf_blocks_add(partial.obs_vector_blocks, inf_i, partial.ids)
+    return inf_I, inf_i
+
+
 # def observe_agent2_from_agent1_Hz(agent1_global, agent2_global):
 #     H = dual_relative_obs_jacobian(agent1_global, agent2_global)
 #     z = H.dot(np.concatenate(agent1_global, agent2_global))
@@ -340,21 +784,19 @@ def agent2_from_frame_agent1_3D(agent2_global, agent1_in_agent2):
     return z
 
 
+# ids is either an AgentIndex or an array of IDs
 def relative_states_from_global_3D(rel_id, ids, states, dim_state, dim_obs):
-    rel_index = np.where(ids == rel_id)[0][0]
-    obj_ids = ids[np.where(ids != rel_id)]
+    index = agent_index(ids, dim_state)
+    obj_ids = np.array([id for id in index.active_ids() if id != rel_id])
 
-    rel_state = states[rel_index: (rel_index + dim_state)]
-    indices = np.ones(np.shape(states)[0], dtype=bool)
-    indices[rel_index: (rel_index + dim_state)] = np.zeros((dim_state))
-    obj_states = states[indices, :]
+    rel_state = index.state(states, rel_id)
 
-    transformed_states = np.zeros(np.shape(obj_states))
+    transformed_states = np.zeros((len(obj_ids) * dim_state, 1))
     for i in range(len(obj_ids)):
         min_index = i * dim_state
         max_index = min_index + dim_obs
 
-        obj_state = obj_states[min_index:max_index]
+        obj_state = index.state(states, obj_ids[i])[0:dim_obs]
         transformed_state = agent2_to_frame_agent1_3D(rel_state[0:dim_obs, :], obj_state)
         transformed_states[min_index:max_index] = transformed_state
 
@@ -362,163 +804,416 @@ def relative_states_from_global_3D(rel_id, ids, states, dim_state, dim_obs):
 
 
 # Compute the observation jacobian H for a 6D-obs system.
-# Currently no functions for the angles, DO NOT USE
+# Given two states [x, y, z, z_ang, y_ang, x_ang] in the global coordinate system, see relative_pose_obs
 def dual_relative_obs_jacobian(state1, state2):
-
-    [x1, y1, z1, p1, t1, s1] = state1
-    [x2, y2, z2, p2, t2, s2] = state2
-
-    Jx = [-np.cos(s1) * np.cos(t1), -np.cos(t1) * np.sin(s1), np.sin(t1), 0, 0, 0,
-          np.cos(s1) * np.cos(t1), np.cos(t1) * np.sin(s1), -np.sin(t1), 0, 0, 0]
-
-    Jy = [np.cos(p1) * np.sin(s1) - np.cos(s1) * np.sin(p1) * np.sin(t1),
-          - np.cos(p1) * np.cos(s1) - np.sin(p1) * np.sin(s1) * np.sin(t1), -np.cos(t1) * np.sin(p1), 0, 0, 0,
-          np.cos(s1) * np.sin(p1) * np.sin(t1) - np.cos(p1) * np.sin(s1),
-          np.cos(p1) * np.cos(s1) + np.sin(p1) * np.sin(s1) * np.sin(t1), np.cos(t1) * np.sin(p1), 0, 0, 0]
-
-    Jz = [- np.sin(p1) * np.sin(s1) - np.cos(p1) * np.cos(s1) * np.sin(t1),
-          np.cos(s1) * np.sin(p1) - np.cos(p1) * np.sin(s1) * np.sin(t1), -np.cos(p1) * np.cos(t1), 0, 0, 0,
-          np.sin(p1) * np.sin(s1) + np.cos(p1) * np.cos(s1) * np.sin(t1),
-          np.cos(p1) * np.sin(s1) * np.sin(t1) - np.cos(s1) * np.sin(p1), np.cos(p1) * np.cos(t1), 0, 0, 0]
-
-    Jp = [0, 0, 0, 0, 0, 0,
-          0, 0, 0, 0, 0, 0]
-
-    Jt = [0, 0, 0, 0, 0, 0,
-          0, 0, 0, 0, 0, 0]
-
-    Js = [0, 0, 0, 0, 0, 0,
-          0, 0, 0, 0, 0, 0]
-
-    J = [Jx, Jy, Jz, Jp, Jt, Js]
-    return J
+    x1 = np.ravel(state1)[0:6][None, :]
+    x2 = np.ravel(state2)[0:6][None, :]
+    z, J = relative_pose_obs(x1, x2)
+    return J[0].tolist()
+
+
+# Rotation matrices from euler angles [z_ang, y_ang, x_ang] (extrinsic 'zyx', R = Rx * Ry * Rz), shape (n, 3)
+# Returns R, shape (n, 3, 3), and the derivative of R with respect to each angle, shape (n, 3, 3, 3)
+def rotm_from_euler_zyx(eul):
+    n = np.shape(eul)[0]
+    c = np.cos(eul)
+    s = np.sin(eul)
+    rot = np.zeros((3, n, 3, 3))
+    d_rot = np.zeros((3, n, 3, 3))
+
+    # Rotations about z, y and x, and their derivatives
+    for k, (i, j) in enumerate([(0, 1), (2, 0), (1, 2)]):
+        axis = 2 - k
+        rot[k, :, axis, axis] = 1
+        rot[k, :, i, i] = c[:, k]
+        rot[k, :, j, j] = c[:, k]
+        rot[k, :, i, j] = -s[:, k]
+        rot[k, :, j, i] = s[:, k]
+        d_rot[k, :, i, i] = -s[:, k]
+        d_rot[k, :, j, j] = -s[:, k]
+        d_rot[k, :, i, j] = -c[:, k]
+        d_rot[k, :, j, i] = c[:, k]
+
+    Rz, Ry, Rx = rot
+    R_0 = np.matmul(Rx, np.matmul(Ry, Rz))
+    dR = np.stack((np.matmul(Rx, np.matmul(Ry, d_rot[0])),
+                   np.matmul(Rx, np.matmul(d_rot[1], Rz)),
+                   np.matmul(d_rot[2], np.matmul(Ry, Rz))), axis=1)
+    return R_0, dR
+
+
+# Euler angles [z_ang, y_ang, x_ang] (extrinsic 'zyx') of rotation matrices, shape (n, 3, 3)
+# If dR is given, shape (n, k, 3, 3), also returns the derivatives of the angles, shape (n, 3, k)
+def euler_zyx_from_rotm(R_0, dR=None):
+    r00 = R_0[:, 0, 0]
+    r01 = R_0[:, 0, 1]
+    r02 = np.clip(R_0[:, 0, 2], -1, 1)
+    r12 = R_0[:, 1, 2]
+    r22 = R_0[:, 2, 2]
+    eul = np.stack((np.arctan2(-r01, r00), np.arcsin(r02), np.arctan2(-r12, r22)), axis=1)
+    if dR is None:
+        return eul
+
+    d_a = (r01[:, None] * dR[:, :, 0, 0] - r00[:, None] * dR[:, :, 0, 1]) / (r00 * r00 + r01 * r01)[:, None]
+    d_b = dR[:, :, 0, 2] / np.sqrt(1 - r02 * r02)[:, None]
+    d_c = (r12[:, None] * dR[:, :, 2, 2] - r22[:, None] * dR[:, :, 1, 2]) / (r22 * r22 + r12 * r12)[:, None]
+    return eul, np.stack((d_a, d_b, d_c), axis=1)
+
+
+# Batched relative pose observation of agent 2 from agent 1, for a 6D-observation system
+# x1, x2 - Poses [x, y, z, z_ang, y_ang, x_ang] of the observers and targets, shape (n, 6)
+# Returns the predicted measurements [R1^T * (t2 - t1), euler(R1^T * R2)], shape (n, 6),
+# and their jacobians with respect to [x1, x2], shape (n, 6, 12)
+def relative_pose_obs(x1, x2):
+    n = np.shape(x1)[0]
+    R1, dR1 = rotm_from_euler_zyx(x1[:, 3:6])
+    R2, dR2 = rotm_from_euler_zyx(x2[:, 3:6])
+    R1_T = np.transpose(R1, (0, 2, 1))
+    dR1_T = np.transpose(dR1, (0, 1, 3, 2))
+
+    # Relative position, linear in t1/t2 and rotated by the observer's angles
+    dt = (x2[:, 0:3] - x1[:, 0:3])[:, :, None]
+    t_rel = np.matmul(R1_T, dt)[:, :, 0]
+    J = np.zeros((n, 6, 12))
+    J[:, 0:3, 0:3] = -R1_T
+    J[:, 0:3, 6:9] = R1_T
+    J[:, 0:3, 3:6] = np.transpose(np.matmul(dR1_T, dt[:, None])[:, :, :, 0], (0, 2, 1))
+
+    # Relative rotation R1^T * R2, differentiated through the euler angle extraction
+    R_rel = np.matmul(R1_T, R2)
+    dR_rel = np.concatenate((np.matmul(dR1_T, R2[:, None]), np.matmul(R1_T[:, None], dR2)), axis=1)
+    eul, d_eul = euler_zyx_from_rotm(R_rel, dR_rel)
+    J[:, 3:6, 3:6] = d_eul[:, :, 0:3]
+    J[:, 3:6, 9:12] = d_eul[:, :, 3:6]
+
+    return np.concatenate((t_rel, eul), axis=1), J
 
 
 # Compute the observation jacobian H for a 3D-observation system
 # Given two state vectors in the global coordinate system, x1 and x2
 # What is the jacobian of the local observation of x2 from x1
 def dual_relative_obs_jacobian_3D(state1, state2):
-
-    [x1, y1, t1] = state1
-    [x2, y2, t2] = state2
-
-    Jx = [-np.cos(t1), -np.sin(t1), 0, np.cos(t1), np.sin(t1), 0]
-    Jy = [np.sin(t1), -np.cos(t1), 0, -np.sin(t1), np.cos(t1), 0]
-    Jt = [0, 0, 1, 0, 0, -1]
-
-    J = [Jx, Jy, Jt]
+    t1 = np.ravel(state1)[2]
+    J = relative_obs_jacobian_3D(np.array([t1]))[0]
+    return J.tolist()
+
+
+# Batched observation jacobian for a 3D-observation system, one jacobian per observer angle t1
+# Returns an array of shape (n_obs, 3, 6), the columns being [x1, y1, t1, x2, y2, t2]
+def relative_obs_jacobian_3D(t1):
+    c = np.cos(t1)
+    s = np.sin(t1)
+    J = np.zeros((len(t1), 3, 6))
+
+    J[:, 0, 0] = -c
+    J[:, 0, 1] = -s
+    J[:, 0, 3] = c
+    J[:, 0, 4] = s
+    J[:, 1, 0] = s
+    J[:, 1, 1] = -c
+    J[:, 1, 3] = -s
+    J[:, 1, 4] = c
+    J[:, 2, 2] = 1
+    J[:, 2, 5] = -1
     return J
 
 
 # If the agent doesn't know about a newly observed agent, extend all variables to accomodate it
+# id_list is either an AgentIndex or an array of IDs, and is returned as the same type.
+# A passed-in AgentIndex is copied before new agents are added to it.
+# All new agents are added in a single extension. Since they share no information with the known agents,
+# x and P are only computed for the known agents (one Cholesky) and extended in closed form.
 def extend_arrays(observed_ids, id_list, Y_11, y_11, dim_state):
-    # Compute x and P so that if there are no new agents it doesn't error out
-    x_11 = np.linalg.inv(Y_11).dot(y_11)
-    P_11 = np.linalg.inv(Y_11)
-
-    for id in observed_ids:
-        # If we found a new agent
-        if not np.isin(id, id_list):
-            id_list = np.concatenate((id_list, [id]))
-            dim = len(id_list) * dim_state
-
-            # Extend the information matrix Y
-            Y_11_tmp = dse_constants.INF_MATRIX_INITIAL * np.eye(dim)
-            Y_11_tmp[0:np.shape(Y_11)[0], 0:np.shape(Y_11)[0]] = Y_11
-            Y_11 = Y_11_tmp
-
-            # Extend the information vector y
-            y_11_tmp = dse_constants.INF_VECTOR_INITIAL * np.arange(1, dim+1)[:, None]
-            y_11_tmp[0:np.shape(y_11)[0]] = y_11
-            y_11 = y_11_tmp
-
-            # re-compute x and P to match
-            x_11 = np.linalg.inv(Y_11).dot(y_11)
-            P_11 = np.linalg.inv(Y_11)
-    
-    return id_list, Y_11, y_11, P_11, x_11
+    index = agent_index(id_list, dim_state)
+    new_ids = [id for id in unique_ids(observed_ids) if id not in index]
+    n_old = np.shape(Y_11)[0]
+
+    if len(new_ids) > 0:
+        if index is id_list:
+            index = index.copy()
+        slots = [index.add(id) for id in new_ids]
+
+        # Slots freed by dropped agents are reused, reset their information to the initial values
+        reused = [slot for slot in slots if dim_state * slot < n_old]
+        if reused:
+            Y_11 = np.array(Y_11)
+            y_11 = np.array(y_11)
+            for slot in reused:
+                s = slice(dim_state * slot, dim_state * (slot + 1))
+                Y_11[s, :] = 0
+                Y_11[:, s] = 0
+                Y_11[s, s] = dse_constants.INF_MATRIX_INITIAL * np.eye(dim_state)
+                y_11[s] = dse_constants.INF_VECTOR_INITIAL * np.arange(s.start + 1, s.stop + 1)[:, None]
+
+    # Compute x and P of the already known agents
+    Y_chol = linalg.cho_factor(Y_11, lower=True, check_finite=False)
+    x_11 = linalg.cho_solve(Y_chol, y_11, check_finite=False)
+    P_11 = linalg.cho_solve(Y_chol, np.eye(n_old), check_finite=False)
+
+    dim = len(index) * dim_state
+    if dim > n_old:
+        # Extend the information matrix Y and vector y
+        Y_11_tmp = dse_constants.INF_MATRIX_INITIAL * np.eye(dim)
+        Y_11_tmp[0:n_old, 0:n_old] = Y_11
+        Y_11 = Y_11_tmp
+        y_11_tmp = dse_constants.INF_VECTOR_INITIAL * np.arange(1, dim+1)[:, None]
+        y_11_tmp[0:n_old] = y_11
+        y_11 = y_11_tmp
+
+        # Extend x and P to match, the new blocks are decoupled so P = Y^-1 block by block
+        P_11_tmp = np.eye(dim) / dse_constants.INF_MATRIX_INITIAL
+        P_11_tmp[0:n_old, 0:n_old] = P_11
+        P_11 = P_11_tmp
+        x_11_tmp = y_11 / dse_constants.INF_MATRIX_INITIAL
+        x_11_tmp[0:n_old] = x_11
+        x_11 = x_11_tmp
+
+    if not isinstance(id_list, AgentIndex):
+        return index.ids, Y_11, y_11, P_11, x_11
+    return index, Y_11, y_11, P_11, x_11
+
+
+# The IDs of a message in order of first appearance, without repeats
+def unique_ids(ids):
+    seen = set()
+    unique = []
+    for id in ids:
+        if id not in seen:
+            seen.add(id)
+            unique.append(id)
+    return unique
 
 
 # Fill in the matrices F and Q:
 # F - Motion Jacobian
 # Q - Motion Covariance
-def fill_FQ(id_list, dt, x_11, dim_state, dim_obs):
+# If inverse is set, also returns F^-1 and Q^-1, computed block by block in closed form (see fill_FQ_blocks)
+def fill_FQ(id_list, dt, x_11, dim_state, dim_obs, inverse=False):
+    blocks = fill_FQ_blocks(id_list, dt, x_11, dim_state, dim_obs, inverse)
+    return tuple(block_diag_from_blocks(block) for block in blocks)
+
+
+# Batched version of fill_FQ: computes every agent's F and Q block at once from the stacked state.
+# Returns arrays of shape (n_agents, dim_state, dim_state), the diagonal blocks of F and Q.
+# If inverse is set, also returns the closed-form inverses of each block:
+# F = [[I, A], [0, B]] with B a rotation, so F^-1 = [[I, -A * B^T], [0, B^T]], and Q is diagonal.
+def fill_FQ_blocks(id_list, dt, x_11, dim_state, dim_obs, inverse=False):
     n_stored = len(id_list)
-    F_0 = np.zeros((n_stored * dim_state, n_stored * dim_state))
-    Q_0 = np.zeros((n_stored * dim_state, n_stored * dim_state))
-    
-    # Fill in Q and F (Different for waypoint vs. robot)
-    for i in range(len(id_list)):
-        i_low = dim_state * i
-        i_high = i_low + dim_state
-
-        # If we are looking at ID 0, it is a waypoint and as such doesn't move (F is identity matrix)
-        if id_list[i] == -1:
-            Q_0[i_low:i_high, i_low:i_high] = q_distance_3D(dt, x_11, i, dim_state)
-            F_0[i_low:i_high, i_low:i_high] = f_eye(dim_state)
-        else:
-            # Else use the unicycle model
-            if dim_obs == 3:
+    x = np.reshape(x_11, (n_stored, dim_state))
+    waypoint = np.asarray(agent_index(id_list, dim_state).ids) == -1
+    return unicycle_FQ_blocks(dt, x, waypoint, dim_state, dim_obs, inverse)
 
-                # Q is a function of distance traveled in the last time step
-                Q_0[i_low:i_high, i_low:i_high] = q_distance_3D(dt, x_11, i, dim_state)
-                F_0[i_low:i_high, i_low:i_high] = f_unicycle_3D(dt, x_11, i, dim_state)
-            else:
-                # Q is a function of distance traveled in the last time step
-                Q_0[i_low:i_high, i_low:i_high] = q_distance(dt, x_11, i, dim_state)
-                F_0[i_low:i_high, i_low:i_high] = f_unicycle(dt, x_11, i, dim_state)
 
+# Batched version of fill_FQ for a stack of states with the same ID list, x of shape (N, n_stored * dim_state, 1)
+# Returns F and Q of every state, shape (N, n_stored * dim_state, n_stored * dim_state)
+def fill_FQ_stacked(id_list, dt, x, dim_state, dim_obs):
+    n_batch = np.shape(x)[0]
+    n_stored = len(id_list)
+    waypoint = np.asarray(agent_index(id_list, dim_state).ids) == -1
+    F_blocks, Q_blocks = unicycle_FQ_blocks(dt, np.reshape(x, (n_batch * n_stored, dim_state)),
+                                            np.tile(waypoint, n_batch), dim_state, dim_obs)
+    F_0 = block_diag_from_blocks(np.reshape(F_blocks, (n_batch, n_stored, dim_state, dim_state)))
+    Q_0 = block_diag_from_blocks(np.reshape(Q_blocks, (n_batch, n_stored, dim_state, dim_state)))
     return F_0, Q_0
 
 
+# F and Q blocks of the unicycle model for agent states x, shape (n, dim_state), see fill_FQ_blocks
+# waypoint marks the rows of x that are waypoints
+def unicycle_FQ_blocks(dt, x, waypoint, dim_state, dim_obs, inverse=False):
+    n_stored = np.shape(x)[0]
+
+    F_blocks = np.tile(np.eye(dim_state), (n_stored, 1, 1))
+    Q_blocks = np.tile(np.eye(dim_state), (n_stored, 1, 1))
+
+    # Unicycle model, with the position/angle, velocity and angular rate indices of each state size
+    if dim_obs == 3:
+        i_pos, i_vel, i_rate = [0, 1], [3, 4], [5]
+    else:
+        i_pos, i_vel, i_rate = [0, 1], [6, 7], [9]
+    w = x[:, i_rate[0]]
+    s = np.sin(w * dt)
+    c = np.cos(w * dt)
+
+    # Using the fundamental theorem of engineering, sin(x) = x,
+    # sin(a*x)/x = a (Really only when x is 0)
+    moving = w != 0
+    w_safe = np.where(moving, w, 1)
+    sin_w = np.where(moving, s / w_safe, dt)
+    cos_w = np.where(moving, (1 - c) / w_safe, 0)
+
+    F_blocks[:, i_pos[0], i_vel[0]] = sin_w
+    F_blocks[:, i_pos[0], i_vel[1]] = -cos_w
+    F_blocks[:, i_pos[1], i_vel[0]] = cos_w
+    F_blocks[:, i_pos[1], i_vel[1]] = sin_w
+    F_blocks[:, i_vel[0], i_vel[0]] = c
+    F_blocks[:, i_vel[0], i_vel[1]] = -s
+    F_blocks[:, i_vel[1], i_vel[0]] = s
+    F_blocks[:, i_vel[1], i_vel[1]] = c
+    if dim_obs == 3:
+        F_blocks[:, 2, 5] = dt
+        Q_blocks[:] = q_distance_3D_blocks(dt, x)
+    else:
+        F_blocks[:, 3:6, 9:12] = dt * np.eye(3)
+        Q_blocks[:] = q_distance_blocks(dt, x)
+
+    # Waypoints don't move (F is identity matrix), and always use the 3D-observation covariance
+    F_blocks[waypoint] = np.eye(dim_state)
+    if dim_obs != 3:
+        Q_blocks[waypoint] = q_distance_3D_blocks(dt, x[waypoint])
+
+    if not inverse:
+        return F_blocks, Q_blocks
+
+    half = int(dim_state / 2)
+    B_inv = np.transpose(F_blocks[:, half:, half:], (0, 2, 1))
+    F_inv_blocks = np.tile(np.eye(dim_state), (n_stored, 1, 1))
+    F_inv_blocks[:, 0:half, half:] = -np.matmul(F_blocks[:, 0:half, half:], B_inv)
+    F_inv_blocks[:, half:, half:] = B_inv
+    Q_inv_blocks = np.zeros((n_stored, dim_state, dim_state))
+    diag = np.arange(dim_state)
+    Q_inv_blocks[:, diag, diag] = 1.0 / Q_blocks[:, diag, diag]
+    return F_blocks, Q_blocks, F_inv_blocks, Q_inv_blocks
+
+
+# Build a dense block-diagonal matrix from an array of blocks, shape (n_blocks, dim, dim)
+# Any leading dimensions are treated as a stack, e.g. (N, n_blocks, dim, dim) gives N block-diagonal matrices
+def block_diag_from_blocks(blocks):
+    shape = np.shape(blocks)
+    n_blocks = shape[-3]
+    dim = shape[-1]
+    mat = np.einsum('...iab,ij->...iajb', blocks, np.eye(n_blocks))
+    return mat.reshape(shape[:-3] + (n_blocks * dim, n_blocks * dim))
+
+
 # Fill in the matrices R and H, as well as the vector z
 # R - Measurement Covariance
 # H - Measurement Jacobian
 # z - The measurement itself
 def fill_RHz(id_list, my_id, observed_ids, observed_poses, x_11, euler_order, dim_state, dim_obs, R_var = 0.001):
+    R_0, H_0, z_0 = fill_RHz_batched(id_list, my_id, observed_ids, observed_poses, x_11, euler_order, dim_state,
+                                     dim_obs, R_var)
+    return np.diag(R_0), H_0, z_0
+
+
+# Batched version of fill_RHz, R is returned as the vector of its diagonal
+# All quaternions are converted in one call, IDs are resolved through an AgentIndex,
+# and each observation's jacobian is scattered into its own rows of H
+# If return_angle_mask is set, also returns the mask of the angle rows of z (see angle_rows)
+def fill_RHz_batched(id_list, my_id, observed_ids, observed_poses, x_11, euler_order, dim_state, dim_obs,
+                     R_var = 0.001, return_angle_mask=False):
+    R_0, J_0, z_0, obs_slots = fill_RHz_compact(id_list, my_id, observed_ids, observed_poses, x_11, euler_order,
+                                                dim_state, dim_obs, R_var)
+    H_0 = H_from_compact(J_0, obs_slots, len(id_list), dim_state)
+    if return_angle_mask:
+        return R_0, H_0, z_0, angle_rows(len(observed_ids), dim_obs)
+    return R_0, H_0, z_0
+
+
+# Compact version of fill_RHz_batched. Each observation only involves the observer and the observed agent,
+# so instead of H this returns one jacobian per observation, shape (n_obs, dim_obs, 2 * dim_state),
+# with respect to [observer state, observed state], and the slots of both agents, shape (n_obs, 2).
+# observed_poses is either a list of poses or an (n_obs, 7) pose array (see arrays_from_pose_markers)
+# If return_angle_mask is set, also returns the mask of the angle rows of z (see angle_rows)
+def fill_RHz_compact(id_list, my_id, observed_ids, observed_poses, x_11, euler_order, dim_state, dim_obs,
+                     R_var = 0.001, return_angle_mask=False):
 
     # Define the sizes of each variable
-    n_stored = len(id_list)
     n_obs = len(observed_ids)
-    R_0 = R_var * np.eye(n_obs * dim_obs)
-    H_0 = np.zeros((n_obs * dim_obs, n_stored * dim_state))
-    z_0 = np.zeros((n_obs * dim_obs, 1))
-    
-    # Fill in H and Z
-    for i in range(len(observed_ids)):
-        id = observed_ids[i]
-        index = np.where(id_list == id)[0][0]           # Index of observed agent
-        obs_index = np.where(id_list == my_id)[0][0]    # Index of observing agent
-
-        i_low = dim_obs * i
-        i_high = i_low + dim_obs
+    J_0 = np.zeros((n_obs, dim_obs, 2 * dim_state))
+    if n_obs == 0:
+        outputs = (np.zeros(0), J_0, np.zeros((0, 1)), np.zeros((0, 2), dtype=int))
+        if return_angle_mask:
+            return outputs + (angle_rows(0, dim_obs),)
+        return outputs
+
+    # Index of each observed agent and of the observing agent
+    agents = agent_index(id_list, dim_state)
+    index = agents.slots(observed_ids)
+    obs_index = agents.slot(my_id)
+    obs_slots = np.stack((obs_index * np.ones(n_obs, dtype=int), index), axis=1)
+
+    # Compute the euler angles from the quaternions passed in
+    # https://docs.scipy.org/doc/scipy/reference/generated/scipy.spatial.transform.Rotation.from_quat.html
+    pose_arr = pose_matrix_from_poses(observed_poses)
+    z_eul = R.from_quat(pose_arr[:, 3:7]).as_euler(euler_order)
+
+    # Different functions for 3D vs. 6D observation
+    if dim_obs == 3:
+        z_pos = pose_arr[:, 0:2]
+        z_0 = np.concatenate((z_pos, z_eul[:, 0:1]), axis=1)
+        dist = np.linalg.norm(z_pos, axis=1)
+        R_0 = 1 * aruco_R_from_range_3D_batched(dist)
+
+        t1 = np.ravel(x_11)[dim_state * obs_index + 2] * np.ones(n_obs)
+        Jacobian = relative_obs_jacobian_3D(t1)
+    else:
+        z_pos = pose_arr[:, 0:3]
+        z_0 = np.concatenate((z_pos, z_eul), axis=1)
+        dist = np.linalg.norm(z_pos, axis=1)
+        R_0 = 1 * aruco_R_from_range_batched(dist)
+
+        # The observation is nonlinear, so z is replaced by the linearized z - h(x) + H * x,
+        # with the angle differences wrapped to [-pi, pi]
+        x_agents = np.reshape(x_11, (-1, dim_state))
+        x1 = np.tile(x_agents[obs_index, 0:dim_obs], (n_obs, 1))
+        x2 = x_agents[index, 0:dim_obs]
+        z_pred, Jacobian = relative_pose_obs(x1, x2)
+        innovation = wrap_angles(z_0, z_pred, angle_rows(n_obs, dim_obs).reshape((n_obs, dim_obs))) - z_pred
+        z_0 = innovation + np.matmul(Jacobian, np.concatenate((x1, x2), axis=1)[:, :, None])[:, :, 0]
+
+    J_0[:, :, 0:dim_obs] = Jacobian[:, :, 0:dim_obs]
+    J_0[:, :, dim_state:dim_state+dim_obs] = Jacobian[:, :, dim_obs:2*dim_obs]
+    if return_angle_mask:
+        return R_0, J_0, np.reshape(z_0, (n_obs * dim_obs, 1)), obs_slots, angle_rows(n_obs, dim_obs)
+    return R_0, J_0, np.reshape(z_0, (n_obs * dim_obs, 1)), obs_slots
+
+
+# Mask of the rows of a stacked measurement z that are angles
+# 3D-observation: [x, y, theta], 6D-observation: [x, y, z, z_ang, y_ang, x_ang]
+def angle_rows(n_obs, dim_obs):
+    mask = np.zeros((n_obs, dim_obs), dtype=bool)
+    if dim_obs == 3:
+        mask[:, 2] = True
+    else:
+        mask[:, 3:6] = True
+    return np.ravel(mask)
 
-        # Compute the euler angles from the quaternion passed in
-        quat = np.zeros(4)
-        quat[0] = observed_poses[i].orientation.x
-        quat[1] = observed_poses[i].orientation.y
-        quat[2] = observed_poses[i].orientation.z
-        quat[3] = observed_poses[i].orientation.w
-        r = R.from_quat(quat)
-        # https://docs.scipy.org/doc/scipy/reference/generated/scipy.spatial.transform.Rotation.from_quat.html
-        z_eul = r.as_euler(euler_order)
-
-        # Different functions for 3D vs. 6D observation
-        if dim_obs == 3:
-            z_pos = np.array([observed_poses[i].position.x, observed_poses[i].position.y])
-            z_eul = [z_eul[0]]
-            dist = np.linalg.norm(z_pos)
-            R_0[i_low:i_high, i_low:i_high] = 1 * aruco_R_from_range_3D(dist)
-            H_0 = h_camera_3D(H_0, x_11, obs_index, index, dim_state, dim_obs)
-        else:
-            z_pos = np.array(observed_poses[i].position.x, observed_poses[i].position.y, observed_poses[i].position.z)
-            dist = np.linalg.norm(z_pos)
-            R_0[i_low:i_high, i_low:i_high] = 1 * aruco_R_from_range(dist)
-            H_0 = h_camera(H_0, x_11, obs_index, index, dim_state, dim_obs)
 
-        z_0[i_low:i_high] = np.concatenate((z_pos, z_eul))[:, None]
+# Shift the angles of the measurement z by multiples of 2 pi so that z - h is within [-pi, pi)
+# h is the predicted measurement (e.g. H * x), angle_mask the angle rows of z (see angle_rows)
+def wrap_angles(z_0, h_0, angle_mask):
+    z_0 = np.array(z_0, dtype=np.float64)
+    y = z_0[angle_mask] - h_0[angle_mask]
+    z_0[angle_mask] = h_0[angle_mask] + np.mod(y + np.pi, 2 * np.pi) - np.pi
+    return z_0
 
-    return R_0, H_0, z_0
+
+# Scatter compact per-observation jacobians (see fill_RHz_compact) into the full jacobian H
+def H_from_compact(J_0, obs_slots, n_stored, dim_state):
+    n_obs, dim_obs, _ = np.shape(J_0)
+    H_0 = np.zeros((n_obs, dim_obs, n_stored, dim_state))
+    obs = np.arange(n_obs)
+    H_0[obs, :, obs_slots[:, 0], :] = J_0[:, :, 0:dim_state]
+    H_0[obs, :, obs_slots[:, 1], :] = J_0[:, :, dim_state:]
+    return H_0.reshape((n_obs * dim_obs, n_stored * dim_state))
+
+
+# Compute H * x from compact per-observation jacobians (see fill_RHz_compact) without forming H
+def H_dot_from_compact(J_0, obs_slots, x, dim_state):
+    x_agents = np.reshape(x, (-1, dim_state))
+    x_pairs = np.concatenate((x_agents[obs_slots[:, 0]], x_agents[obs_slots[:, 1]]), axis=1)
+    return np.reshape(np.matmul(J_0, x_pairs[:, :, None]), (-1, 1))
+
+
+# Scatter-add per-observation contributions (see InformationFilterEngine.observation_blocks) into Y and y
+# Y and y are modified in place, the work is proportional to the number of observations
+def add_observation_blocks(Y, y, obs_slots, I_blocks, i_blocks, dim_state):
+    d = dim_state
+    rows = d * obs_slots[:, :, None] + np.arange(d)[None, None, :]
+    rows = rows.reshape((len(obs_slots), 2 * d))
+    np.add.at(Y, (rows[:, :, None], rows[:, None, :]), I_blocks)
+    np.add.at(y, (rows, 0), i_blocks[:, :, 0])
+    return Y, y
 
 
 # Fill in the matrix B and the vector u
@@ -533,9 +1228,10 @@ def fill_Bu(id_list, my_id, ctrl_ids, x, ctrl, dim_state, dim_obs):
     u = np.zeros((n_stored * dim_state, 1))
 
     # For each agent that we have a control signal:
+    agents = agent_index(id_list, dim_state)
     for i in range(len(ctrl_ids)):
         id = ctrl_ids[i]
-        index = np.where(id_list == id)[0][0]           # Index of observed agent
+        index = agents.slot(id)                         # Index of observed agent
 
         i_low = dim_state * index
         i_high = i_low + dim_obs
@@ -549,6 +1245,883 @@ def fill_Bu(id_list, my_id, ctrl_ids, x, ctrl, dim_state, dim_obs):
     return B, u
 
 
+# Information filter predict/update steps computed with Cholesky/LU factorizations and triangular solves
+# instead of dense inverses. Every factorization is computed at most once per step and reused within it.
+class InformationFilterEngine:
+
+    def __init__(self, dim_state, dim_obs):
+        self.dim_state = dim_state
+        self.dim_obs = dim_obs
+
+        # Factorizations cached from the last call, reused within a step
+        self.Y_chol = None
+        self.F_lu = None
+        self.S_chol = None
+
+    # Recover the Kalman state x = Y^-1 * y (and optionally the covariance P = Y^-1) from one Cholesky of Y
+    def recover(self, Y, y, covariance=True):
+        self.Y_chol = linalg.cho_factor(Y, lower=True, check_finite=False)
+        x = linalg.cho_solve(self.Y_chol, y, check_finite=False)
+        if not covariance:
+            return x
+        P = linalg.cho_solve(self.Y_chol, np.eye(np.shape(Y)[0]), check_finite=False)
+        return x, P
+
+    # Prediction step, equivalent to:
+    #   M = F^-T * Y * F^-1,  C = M * (M + Q^-1)^-1,  L = I - C
+    #   Y_01 = L * M * L^T + C * Q^-1 * C^T,  y_01 = L * F^-T * y
+    # Rewritten as Y_01 = Q^-1 - Q^-1 * (M + Q^-1)^-1 * Q^-1 and y_01 = Q^-1 * (M + Q^-1)^-1 * F^-T * y,
+    # which needs one LU of F, one Cholesky of Q and one Cholesky of (M + Q^-1).
+    # If F^-1 or Q^-1 are already known they can be passed in and the matching factorization is skipped.
+    def predict(self, Y_11, y_11, F_0, Q_0, F_inv=None, Q_inv=None):
+        if F_inv is None:
+            self.F_lu = linalg.lu_factor(F_0, check_finite=False)
+            FtY = linalg.lu_solve(self.F_lu, Y_11, trans=1, check_finite=False)
+            M_0 = linalg.lu_solve(self.F_lu, np.transpose(FtY), trans=1, check_finite=False)
+            a_0 = linalg.lu_solve(self.F_lu, y_11, trans=1, check_finite=False)
+        else:
+            M_0 = np.transpose(F_inv).dot(Y_11.dot(F_inv))
+            a_0 = np.transpose(F_inv).dot(y_11)
+
+        if Q_inv is None:
+            Q_chol = linalg.cho_factor(Q_0, lower=True, check_finite=False)
+            Q_inv = linalg.cho_solve(Q_chol, np.eye(np.shape(Q_0)[0]), check_finite=False)
+
+        self.S_chol = linalg.cho_factor(M_0 + Q_inv, lower=True, check_finite=False)
+        Y_01 = Q_inv - Q_inv.dot(linalg.cho_solve(self.S_chol, Q_inv, check_finite=False))
+        y_01 = Q_inv.dot(linalg.cho_solve(self.S_chol, a_0, check_finite=False))
+
+        # Remove round-off asymmetry so later Cholesky factorizations of Y stay valid
+        Y_01 = 0.5 * (Y_01 + np.transpose(Y_01))
+        return Y_01, y_01
+
+    # Measurement contributions I = H^T * R^-1 * H and i = H^T * R^-1 * z
+    # R is either the full measurement covariance or the vector of its diagonal
+    def observation(self, H_0, R_0, z_0):
+        if np.ndim(R_0) == 1:
+            r_std = np.sqrt(R_0)[:, None]
+            W_0 = H_0 / r_std
+            w_0 = z_0 / r_std
+        else:
+            R_chol = linalg.cholesky(R_0, lower=True, check_finite=False)
+            W_0 = linalg.solve_triangular(R_chol, H_0, lower=True, check_finite=False)
+            w_0 = linalg.solve_triangular(R_chol, z_0, lower=True, check_finite=False)
+
+        inf_I = np.transpose(W_0).dot(W_0)
+        inf_i = np.transpose(W_0).dot(w_0)
+        return inf_I, inf_i
+
+    # Per-observation measurement contributions from compact jacobians (see fill_RHz_compact)
+    # Returns I and i of every observation, shapes (n_obs, 2 * dim_state, 2 * dim_state) and
+    # (n_obs, 2 * dim_state, 1), over [observer state, observed state]. R is the vector of its diagonal.
+    def observation_blocks(self, J_0, R_0, z_0):
+        n_obs, dim_obs, _ = np.shape(J_0)
+        r_std = np.reshape(np.sqrt(R_0), (n_obs, dim_obs, 1))
+        W_0 = J_0 / r_std
+        w_0 = np.reshape(z_0, (n_obs, dim_obs, 1)) / r_std
+
+        W_0_T = np.transpose(W_0, (0, 2, 1))
+        I_blocks = np.matmul(W_0_T, W_0)
+        i_blocks = np.matmul(W_0_T, w_0)
+        return I_blocks, i_blocks
+
+    # Update step, returns the posterior information variables and the measurement contributions
+    def update(self, Y_01, y_01, H_0, R_0, z_0):
+        inf_I, inf_i = self.observation(H_0, R_0, z_0)
+        Y_00 = Y_01 + inf_I
+        y_00 = y_01 + inf_i
+        return Y_00, y_00, inf_I, inf_i
+
+
+# Estimate held in information form (Y, y), with the Kalman state and covariance recovered on demand.
+# Y is factored once, on first use, x is solved for when first asked for,
+# and covariance is only computed for the blocks that are asked for.
+class InformationEstimate:
+
+    def __init__(self, Y, y, id_list, dim_state=None):
+        if dim_state is None:
+            dim_state = int(np.shape(Y)[0] / len(id_list))
+        self.Y = Y
+        self.y = y
+        self.index = agent_index(id_list, dim_state)
+        self.dim_state = dim_state
+        self._chol = None
+        self._x = None
+        self._P = None
+
+    # Build from the matrix and vector multi-arrays of an InfFilterResults message
+    @classmethod
+    def from_multi_arrays(cls, id_list, matrix_arr, vector_arr, dim_state=None):
+        return cls(multi_array_2d_output(matrix_arr), multi_array_2d_output(vector_arr), id_list, dim_state)
+
+    # Build from an InfFilterResults message, sent quantized or as multi-arrays
+    @classmethod
+    def from_results(cls, results, dim_state=None):
+        return cls(multi_array_or_quantized_output(results.inf_matrix, results.inf_matrix_quantized),
+                   multi_array_or_quantized_output(results.inf_vector, results.inf_vector_quantized),
+                   np.array(results.ids), dim_state)
+
+    # Cholesky factor of Y, computed on first use
+    @property
+    def chol(self):
+        if self._chol is None:
+            self._chol = linalg.cho_factor(self.Y, lower=True, check_finite=False)
+        return self._chol
+
+    # Kalman state x = Y^-1 * y
+    @property
+    def x(self):
+        if self._x is None:
+            self._x = linalg.cho_solve(self.chol, self.y, check_finite=False)
+        return self._x
+
+    # Full covariance P = Y^-1, prefer cov() when only some agents are needed
+    @property
+    def P(self):
+        if self._P is None:
+            self._P = linalg.cho_solve(self.chol, np.eye(np.shape(self.Y)[0]), check_finite=False)
+        return self._P
+
+    # State of one agent
+    def state(self, id):
+        return self.index.state(self.x, id)
+
+    # Covariance block between two agents (or the marginal covariance of one agent), see cov_blocks
+    def cov(self, id_1, id_2=None):
+        if id_2 is None or id_2 == id_1:
+            return self.cov_blocks([id_1])
+        if self._P is not None:
+            return self.index.cov(self._P, id_1, id_2)
+        d = self.dim_state
+        return self.cov_blocks([id_1, id_2])[0:d, d:2*d]
+
+    # Joint covariance of a set of agents, in the order given, without forming the full P
+    # With Y = L * L^T, P_SS = E_S^T * Y^-1 * E_S = Z^T * Z where L * Z = E_S.
+    # Rows of Z above the first selected state are zero, so only the trailing part of L is used.
+    def cov_blocks(self, ids):
+        d = self.dim_state
+        if self._P is not None:
+            rows = np.concatenate([np.arange(self.index.state_slice(id).start, self.index.state_slice(id).stop)
+                                   for id in ids])
+            return self._P[np.ix_(rows, rows)]
+
+        slots = self.index.slots(ids)
+        start = d * np.min(slots)
+        E = np.zeros((np.shape(self.Y)[0] - start, len(ids) * d))
+        for i, slot in enumerate(slots):
+            E[d*slot-start:d*(slot+1)-start, i*d:(i+1)*d] = np.eye(d)
+        L = self.chol[0][start:, start:]
+        Z = linalg.solve_triangular(L, E, lower=True, check_finite=False)
+        return np.transpose(Z).dot(Z)
+
+
+# Encoder of a delta-encoded stream of information results (see InfFilterResultsDelta)
+# Every keyframe_period messages, when the ID list changes, or on request, every block is sent.
+# In between only the blocks that changed since the previous message are sent, with their new values.
+# Blocks of free slots (dse_constants.EMPTY_SLOT_ID) are never sent.
+# Dense results are diffed as whole matrices (encode), block-sparse results block by block (encode_blocks)
+class DeltaStreamEncoder:
+
+    def __init__(self, keyframe_period=50):
+        self.keyframe_period = keyframe_period
+        self.seq = 0
+        self.requested = True
+        self.ids = None
+        self.Y = None
+        self.y = None
+        self.Y_blocks = None
+        self.y_blocks = None
+
+    # Send a keyframe next, e.g. when a subscriber missed a message
+    def request_keyframe(self):
+        self.requested = True
+
+    # Whether the next message with this ID list is a keyframe. previous is the stored state it would be diffed with
+    def next_is_keyframe(self, ids, previous):
+        return self.requested or previous is None or ids != self.ids or \
+            (self.keyframe_period > 0 and self.seq % self.keyframe_period == 0)
+
+    # Fill in the header of the message and move on to the next one
+    def finish(self, ids, keyframe, msg):
+        msg.seq = self.seq
+        msg.keyframe = keyframe
+        msg.ids = ids
+        self.seq = (self.seq + 1) % 2**32
+        self.requested = False
+        self.ids = ids
+        return msg
+
+    # Fill in an InfFilterResultsDelta message with the information matrix and vector of the ID list
+    def encode(self, ids, Y, y, msg):
+        ids = list(ids)
+        n = len(ids)
+        d = int(np.shape(Y)[0] / n)
+        keyframe = self.next_is_keyframe(ids, self.Y)
+
+        # Changed blocks, only the upper triangle of Y is sent
+        Y_blocks = np.reshape(Y, (n, d, n, d))
+        y_blocks = np.reshape(y, (n, d, 1))
+        if keyframe:
+            changed_Y = np.any(Y_blocks != 0, axis=(1, 3))
+            changed_y = np.any(y_blocks != 0, axis=(1, 2))
+        else:
+            changed_Y = np.any(Y_blocks != np.reshape(self.Y, (n, d, n, d)), axis=(1, 3))
+            changed_y = np.any(y_blocks != np.reshape(self.y, (n, d, 1)), axis=(1, 2))
+        id_arr = np.array(ids)
+        active = id_arr != dse_constants.EMPTY_SLOT_ID
+        rows, cols = np.nonzero(np.triu(changed_Y & active[:, None] & active[None, :]))
+        slots = np.flatnonzero(changed_y & active)
+
+        inf_blocks_input(id_arr[rows], id_arr[cols], np.reshape(Y_blocks[rows, :, cols, :], (-1, d, d)),
+                         msg.inf_matrix_blocks, symmetric=True)
+        inf_blocks_input(id_arr[slots], [], y_blocks[slots], msg.inf_vector_blocks)
+
+        self.Y = np.array(Y, dtype=np.float64)
+        self.y = np.array(y, dtype=np.float64)
+        self.Y_blocks = None
+        self.y_blocks = None
+        return self.finish(ids, keyframe, msg)
+
+    # Fill in an InfFilterResultsDelta message from block-sparse information (see BlockInformation)
+    # Each block is compared with the same block of the previous message, so the cost scales with the number of
+    # coupled pairs instead of n^2. Blocks that are gone since the previous message are sent as zeros
+    def encode_blocks(self, inf, msg):
+        ids = list(inf.ids)
+        d = inf.dim_state
+        keyframe = self.next_is_keyframe(ids, self.Y_blocks)
+        previous_Y = {} if keyframe else self.Y_blocks
+        previous_y = {} if keyframe else self.y_blocks
+
+        # Changed or new blocks with their values, removed blocks as zeros
+        Y_changed = [(key, block) for key, block in inf.Y.items() if not np.array_equal(block, previous_Y.get(key))]
+        Y_changed += [(key, np.zeros((d, d))) for key in previous_Y if key not in inf.Y]
+        y_changed = [(id, vector) for id, vector in inf.y.items() if not np.array_equal(vector, previous_y.get(id))]
+        y_changed += [(id, np.zeros((d, 1))) for id in previous_y if id not in inf.y]
+        Y_changed = [(key, block) for key, block in Y_changed if dse_constants.EMPTY_SLOT_ID not in key]
+        y_changed = [(id, vector) for id, vector in y_changed if id != dse_constants.EMPTY_SLOT_ID]
+
+        inf_blocks_input([key[0] for key, block in Y_changed], [key[1] for key, block in Y_changed],
+                         np.reshape([block for key, block in Y_changed], (len(Y_changed), d, d)),
+                         msg.inf_matrix_blocks, symmetric=True)
+        inf_blocks_input([id for id, vector in y_changed], [],
+                         np.reshape([vector for id, vector in y_changed], (len(y_changed), d, 1)),
+                         msg.inf_vector_blocks)
+
+        # The blocks are replaced, not modified, by BlockInformation, so the dicts can keep references to them
+        self.Y_blocks = dict(inf.Y)
+        self.y_blocks = dict(inf.y)
+        self.Y = None
+        self.y = None
+        return self.finish(ids, keyframe, msg)
+
+
+# Decoder of a delta-encoded stream of information results (see DeltaStreamEncoder)
+# Keeps the information matrix and vector up to date by overwriting the blocks each message carries.
+# Free slots get an identity block so the cached matrix stays invertible
+class DeltaStreamDecoder:
+
+    def __init__(self, dim_state):
+        self.dim_state = dim_state
+        self.seq = None
+        self.ids = None
+        self.Y = None
+        self.y = None
+        self.n_gaps = 0
+        self._estimate = None
+
+    # Whether a keyframe has been applied and no message was missed since
+    def synced(self):
+        return self.seq is not None
+
+    # Apply a message. Returns False if it can't be applied because a message was missed,
+    # in which case every message is dropped until the next keyframe, which should be requested
+    def apply(self, msg):
+        ids = list(msg.ids)
+        if not msg.keyframe:
+            if not self.synced() or msg.seq != (self.seq + 1) % 2**32 or ids != self.ids:
+                if self.synced():
+                    self.n_gaps += 1
+                self.seq = None
+                return False
+        else:
+            d = self.dim_state
+            self.ids = ids
+            self.Y = np.zeros((len(ids) * d, len(ids) * d))
+            self.y = np.zeros((len(ids) * d, 1))
+            for slot in np.flatnonzero(np.array(ids) == dse_constants.EMPTY_SLOT_ID):
+                self.Y[slot*d:(slot+1)*d, slot*d:(slot+1)*d] = np.eye(d)
+
+        inf_blocks_set(msg.inf_matrix_blocks, self.Y, self.ids)
+        inf_blocks_set(msg.inf_vector_blocks, self.y, self.ids)
+        self.seq = msg.seq
+        self._estimate = None
+        return True
+
+    # Estimate of the current information matrix and vector (see InformationEstimate), reused until the next message
+    def estimate(self):
+        if self._estimate is None:
+            self._estimate = InformationEstimate(self.Y, self.y, self.ids, self.dim_state)
+        return self._estimate
+
+
+# Kalman filter steps on the same inputs as the information filter, used to cross-check it
+# R is either the full measurement covariance or the vector of its diagonal
+def kalman_step(x_11, P_11, F_0, Q_0, H_0, R_0, z_0):
+    if np.ndim(R_0) == 1:
+        R_0 = np.diag(R_0)
+    x_01 = F_0.dot(x_11)
+    P_01 = F_0.dot(P_11.dot(np.transpose(F_0))) + Q_0
+    y = z_0 - H_0.dot(x_01)
+    S = H_0.dot(P_01.dot(np.transpose(H_0))) + R_0
+    K = np.transpose(np.linalg.solve(S, H_0.dot(P_01)))
+    x_00 = x_01 + K.dot(y)
+    P_00 = (np.eye(np.shape(K)[0]) - K.dot(H_0)).dot(P_01)
+    return x_01, P_01, x_00, P_00
+
+
+# Runs a shadow Kalman filter next to the information filter on a sample of steps, or on request,
+# and records how far the two have diverged.
+# sample_period - Check every sample_period-th step, 0 only checks when requested
+# rtol/atol     - Tolerances of the comparison, as in np.allclose
+# engine        - InformationFilterEngine that recovers x and P from the information variables, usually the
+#                 engine of the filter being checked
+class ShadowKalmanVerifier:
+
+    names = ['x_01', 'P_01', 'x_00', 'P_00']
+
+    def __init__(self, sample_period=0, rtol=1e-05, atol=1e-08, engine=None):
+        self.sample_period = sample_period
+        self.engine = engine
+        self.rtol = rtol
+        self.atol = atol
+        self.step = 0
+        self.requested = False
+        self.n_checked = 0
+        self.n_diverged = 0
+        self.errors = np.zeros(len(self.names))
+        self.diverged = []
+
+    # Check the next step regardless of the sample period
+    def request(self):
+        self.requested = True
+
+    # Call once per step, returns whether this step should be checked
+    def due(self):
+        self.step += 1
+        due = self.requested or (self.sample_period > 0 and self.step % self.sample_period == 0)
+        self.requested = False
+        return due
+
+    # Compare the information filter prior (Y_01, y_01) and posterior (Y_00, y_00) with the Kalman filter
+    # Returns the names of the quantities that diverged, the max abs error of each is kept in self.errors
+    def check(self, x_11, P_11, F_0, Q_0, H_0, R_0, z_0, Y_01, y_01, Y_00, y_00):
+        kalman = kalman_step(x_11, P_11, F_0, Q_0, H_0, R_0, z_0)
+        inf_x_01, inf_P_01 = self.engine.recover(Y_01, y_01)
+        inf_x_00, inf_P_00 = self.engine.recover(Y_00, y_00)
+        information = [inf_x_01, inf_P_01, inf_x_00, inf_P_00]
+
+        self.n_checked += 1
+        self.diverged = []
+        for i in range(len(self.names)):
+            self.errors[i] = np.max(np.abs(kalman[i] - information[i]))
+            if not np.allclose(information[i], kalman[i], rtol=self.rtol, atol=self.atol):
+                self.diverged.append(self.names[i])
+
+        if self.diverged:
+            self.n_diverged += 1
+            rospy.logwarn('information filter diverged from the Kalman filter at step %d in %s, max abs error %s',
+                          self.step, ', '.join(self.diverged), str(self.errors))
+        else:
+            rospy.logdebug('information filter matches the Kalman filter at step %d, max abs error %s',
+                           self.step, str(self.errors))
+        return self.diverged
+
+    # Statistics of the last check as a row: [step, checks, divergences, max abs error of x_01, P_01, x_00, P_00]
+    def stats(self):
+        return np.concatenate(([self.step, self.n_checked, self.n_diverged], self.errors))[None, :]
+
+
+# Square-root information filter, keeps an upper-triangular R with Y = R^T * R and r with y = R^T * r.
+# Y itself is never inverted or propagated, which keeps the filter stable when Y is badly conditioned
+# (e.g. INF_MATRIX_INITIAL next to a small motion covariance). Both steps only use orthogonal and triangular
+# factorizations:
+#   predict: RQ of [F * R^-1, Q^1/2] = U * Q_rq, so P_01 = U * U^T and R_01 = U^-1 (no QR of a 2n x 2n array).
+#            The RQ is computed as the QR of the transpose with the columns reversed, which LAPACK does faster
+#   update:  QR of R stacked over [W, w], with W = R_z^-1/2 * H and w = R_z^-1/2 * z. LAPACK tpqrt uses the
+#            triangle of R, so m measurement rows cost O(m * n^2) instead of a dense QR of the whole stack
+class SquareRootInformationFilter:
+
+    def __init__(self, dim_state, dim_obs, R_0=None, r_0=None):
+        self.dim_state = dim_state
+        self.dim_obs = dim_obs
+        self.R = R_0
+        self.r = r_0
+
+    # Set the factor from an information matrix and vector (one Cholesky)
+    def set_information(self, Y, y):
+        self.R = linalg.cholesky(Y, lower=False, check_finite=False)
+        self.r = linalg.solve_triangular(self.R, y, trans=1, check_finite=False)
+        return self
+
+    # Add agents in the given slots, initialized the same way as extend_arrays (see InformationStateStore.extend)
+    # New agents share no information with the known ones, so slots past the end of R are appended as
+    # decoupled blocks, R = blockdiag(R, sqrt(INF_MATRIX_INITIAL) * I), without refactoring.
+    # Slots freed by dropped agents are reset in Y and refactored
+    def extend(self, slots, dim_state):
+        dim = np.shape(self.R)[0]
+        reused = [slot for slot in slots if dim_state * slot < dim]
+        if reused:
+            Y, y = self.information()
+            for slot in reused:
+                s = slice(dim_state * slot, dim_state * (slot + 1))
+                Y[s, :] = 0
+                Y[:, s] = 0
+                Y[s, s] = dse_constants.INF_MATRIX_INITIAL * np.eye(dim_state)
+                y[s] = dse_constants.INF_VECTOR_INITIAL * np.arange(s.start + 1, s.stop + 1)[:, None]
+            self.set_information(Y, y)
+
+        new_dim = max([dim] + [dim_state * (slot + 1) for slot in slots])
+        if new_dim > dim:
+            r_std = np.sqrt(dse_constants.INF_MATRIX_INITIAL)
+            R = r_std * np.eye(new_dim)
+            R[0:dim, 0:dim] = self.R
+            r = dse_constants.INF_VECTOR_INITIAL * np.arange(1, new_dim + 1)[:, None] / r_std
+            r[0:dim] = self.r
+            self.R = R
+            self.r = r
+        return self
+
+    # Information matrix Y = R^T * R and vector y = R^T * r
+    # R^T * R is one symmetric rank-k product, only its upper triangle is computed and then mirrored
+    def information(self):
+        Y = linalg.blas.dsyrk(1.0, self.R, trans=1)
+        Y = Y + np.transpose(np.triu(Y, 1))
+        return Y, np.transpose(self.R).dot(self.r)
+
+    # Recover the Kalman state x = R^-1 * r (and optionally the covariance P = R^-1 * R^-T)
+    def recover(self, covariance=True):
+        x = linalg.solve_triangular(self.R, self.r, check_finite=False)
+        if not covariance:
+            return x
+        R_inv = linalg.solve_triangular(self.R, np.eye(np.shape(self.R)[0]), check_finite=False)
+        return x, R_inv.dot(np.transpose(R_inv))
+
+    # Prediction step, same inputs as InformationFilterEngine.predict (F_inv and Q_inv are not needed)
+    # The covariance square root R^-1 is propagated and refactored with one RQ, then inverted back
+    def predict(self, F_0, Q_0, F_inv=None, Q_inv=None):
+        dim = np.shape(self.R)[0]
+        R_inv = linalg.lapack.dtrtri(self.R)[0]
+        Q_chol = linalg.cholesky(Q_0, lower=True, check_finite=False)
+        G_t = np.concatenate((np.transpose(F_0.dot(R_inv)), np.transpose(Q_chol)))[:, ::-1]
+        U = np.transpose(linalg.qr(G_t, mode='r', check_finite=False)[0][0:dim])[::-1, ::-1]
+        self.R = linalg.lapack.dtrtri(np.ascontiguousarray(U))[0]
+        self.r = self.R.dot(F_0.dot(R_inv.dot(self.r)))
+        return self.R, self.r
+
+    # Update step, R_0 is either the full measurement covariance or the vector of its diagonal
+    # [R, r] is kept as an upper triangle with an empty last row, and the measurement rows [W, w] are folded in
+    def update(self, H_0, R_0, z_0):
+        dim = np.shape(self.R)[0]
+        if np.ndim(R_0) == 1:
+            r_std = np.sqrt(R_0)[:, None]
+            W_0 = H_0 / r_std
+            w_0 = z_0 / r_std
+        else:
+            R_chol = linalg.cholesky(R_0, lower=True, check_finite=False)
+            W_0 = linalg.solve_triangular(R_chol, H_0, lower=True, check_finite=False)
+            w_0 = linalg.solve_triangular(R_chol, z_0, lower=True, check_finite=False)
+        if len(W_0) == 0:
+            return self.R, self.r
+
+        A = np.zeros((dim + 1, dim + 1))
+        A[0:dim, 0:dim] = self.R
+        A[0:dim, dim:] = self.r
+        A = linalg.lapack.dtpqrt(0, len(W_0), A, np.concatenate((W_0, w_0), axis=1))[0]
+        self.R = A[0:dim, 0:dim]
+        self.r = A[0:dim, dim:]
+        return self.R, self.r
+
+
+# Information filters of N agents with the same state layout, stepped together
+# Y and y are stacked, shapes (N, dim, dim) and (N, dim, 1) with dim = n_stored * dim_state,
+# and every step is one batched numpy call instead of one call per agent.
+# Agents with fewer observations pad H with zero rows (with any positive R), which add no information.
+class BatchedInformationFilter:
+
+    def __init__(self, dim_state, dim_obs, Y, y):
+        self.dim_state = dim_state
+        self.dim_obs = dim_obs
+        self.Y = np.asarray(Y, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+
+    # Number of stacked filters
+    def __len__(self):
+        return np.shape(self.Y)[0]
+
+    # Recover the Kalman states x = Y^-1 * y (and optionally the covariances P = Y^-1) of every filter
+    def recover(self, covariance=True):
+        L = np.linalg.cholesky(self.Y)
+        L_T = np.transpose(L, (0, 2, 1))
+        x = np.linalg.solve(L_T, np.linalg.solve(L, self.y))
+        if not covariance:
+            return x
+        L_inv = np.linalg.solve(L, np.broadcast_to(np.eye(np.shape(L)[1]), np.shape(L)))
+        P = np.matmul(np.transpose(L_inv, (0, 2, 1)), L_inv)
+        return x, P
+
+    # Prediction step of every filter, same equations as InformationFilterEngine.predict
+    # F and Q have shape (N, dim, dim), or (dim, dim) to use the same matrix for every filter
+    def predict(self, F_0, Q_0, F_inv=None, Q_inv=None):
+        shape = np.shape(self.Y)
+        if F_inv is None:
+            F_T = np.broadcast_to(np.swapaxes(F_0, -1, -2), shape)
+            FtY = np.linalg.solve(F_T, self.Y)
+            M_0 = np.linalg.solve(F_T, np.transpose(FtY, (0, 2, 1)))
+            a_0 = np.linalg.solve(F_T, self.y)
+        else:
+            F_inv_T = np.swapaxes(F_inv, -1, -2)
+            M_0 = np.matmul(F_inv_T, np.matmul(self.Y, F_inv))
+            a_0 = np.matmul(F_inv_T, self.y)
+
+        if Q_inv is None:
+            Q_inv = np.linalg.solve(np.broadcast_to(Q_0, shape), np.broadcast_to(np.eye(shape[1]), shape))
+        Q_inv = np.broadcast_to(Q_inv, shape)
+
+        S_0 = M_0 + Q_inv
+        Y_01 = Q_inv - np.matmul(Q_inv, np.linalg.solve(S_0, Q_inv))
+        y_01 = np.matmul(Q_inv, np.linalg.solve(S_0, a_0))
+
+        # Remove round-off asymmetry so later Cholesky factorizations of Y stay valid
+        self.Y = 0.5 * (Y_01 + np.transpose(Y_01, (0, 2, 1)))
+        self.y = y_01
+        return self.Y, self.y
+
+    # Measurement contributions I = H^T * R^-1 * H and i = H^T * R^-1 * z of every filter
+    # H has shape (N, n_rows, dim), R is the diagonal of each covariance (N, n_rows) and z is (N, n_rows, 1)
+    def observation(self, H_0, R_0, z_0):
+        r_std = np.sqrt(R_0)[:, :, None]
+        W_0 = H_0 / r_std
+        w_0 = z_0 / r_std
+
+        W_0_T = np.transpose(W_0, (0, 2, 1))
+        inf_I = np.matmul(W_0_T, W_0)
+        inf_i = np.matmul(W_0_T, w_0)
+        return inf_I, inf_i
+
+    # Update step of every filter, returns the measurement contributions
+    def update(self, H_0, R_0, z_0):
+        inf_I, inf_i = self.observation(H_0, R_0, z_0)
+        self.Y = self.Y + inf_I
+        self.y = self.y + inf_i
+        return inf_I, inf_i
+
+
+# Prune the weak off-diagonal blocks of the information matrix of a group of agents, as in sparse extended
+# information filters, without claiming more information than the input
+# The coupling of agents i and j is rho_ij = ||Y_ii^-1/2 * Y_ij * Y_jj^-1/2||, and blocks with rho_ij <= tol
+# are removed. Removing them subtracts [[rho_ij * Y_ii, Y_ij], [Y_ji, rho_ij * Y_jj]], which is positive
+# semi-definite, so the diagonal blocks are scaled down by the couplings they lose and the result is <= Y.
+# y is recomputed so the state x = Y^-1 * y is unchanged. If the pruned matrix is not positive definite,
+# Y and y are returned as they are
+def sparsify_information(Y, y, dim_state, tol):
+    d = dim_state
+    m = int(np.shape(Y)[0] / d)
+    blocks = np.transpose(np.reshape(Y, (m, d, m, d)), (0, 2, 1, 3))
+    L_inv = np.linalg.inv(np.linalg.cholesky(blocks[np.arange(m), np.arange(m)]))
+    coupling = np.matmul(np.matmul(L_inv[:, None], blocks), np.transpose(L_inv, (0, 2, 1))[None, :])
+    rho = np.linalg.norm(coupling, ord=2, axis=(2, 3))
+    prune = (rho <= tol) & ~np.eye(m, dtype=bool) & np.any(blocks != 0, axis=(2, 3))
+    if not np.any(prune):
+        return Y, y
+
+    kept = np.where(prune[:, :, None, None], 0, blocks)
+    kept[np.arange(m), np.arange(m)] *= (1 - np.sum(np.where(prune, rho, 0), axis=1))[:, None, None]
+    Y_sparse = np.reshape(np.transpose(kept, (0, 2, 1, 3)), (m * d, m * d))
+    try:
+        linalg.cho_factor(Y_sparse, lower=True, check_finite=False)
+    except linalg.LinAlgError:
+        return Y, y
+    x = linalg.cho_solve(linalg.cho_factor(Y, lower=True, check_finite=False), y, check_finite=False)
+    return Y_sparse, Y_sparse.dot(x)
+
+
+# Block-sparse information matrix Y and vector y, stored as one dim_state x dim_state block per agent pair.
+# Only pairs that are coupled have a block. Observations couple the observer and the observed agent, and the
+# prediction fills in every pair within a connected group, so without sparsification a group soon holds all
+# of its n^2 blocks (one agent that sees every tag joins them all in one group).
+# predict can prune the weak couplings it fills in (see sparsify_information), which keeps the stored and sent
+# blocks close to the number of observed pairs. The prediction itself is still dense within each group.
+# Off-diagonal blocks are stored once, under the key ordered by position in the ID list.
+class BlockInformation:
+
+    def __init__(self, dim_state, ids=()):
+        self.dim_state = dim_state
+        self.index = AgentIndex(ids, dim_state)
+        self.Y = {}
+        self.y = {}
+
+    # IDs in state order
+    @property
+    def ids(self):
+        return self.index.id_list
+
+    # Add a newly observed agent, initialized the same way as extend_arrays
+    def add_agent(self, id):
+        slot = self.index.add(id)
+        self.Y[(id, id)] = dse_constants.INF_MATRIX_INITIAL * np.eye(self.dim_state)
+        self.y[id] = dse_constants.INF_VECTOR_INITIAL * \
+            np.arange(slot * self.dim_state + 1, (slot + 1) * self.dim_state + 1)[:, None]
+
+    def key(self, id_1, id_2):
+        if self.index.slot(id_1) <= self.index.slot(id_2):
+            return id_1, id_2
+        return id_2, id_1
+
+    # Grab the Y block between two agents (zeros if they are not coupled)
+    def block(self, id_1, id_2):
+        key = self.key(id_1, id_2)
+        block = self.Y.get(key)
+        if block is None:
+            return np.zeros((self.dim_state, self.dim_state))
+        if key[0] != id_1:
+            return np.transpose(block)
+        return block
+
+    # Add to the Y block between two agents (and implicitly to its mirrored block)
+    def add_block(self, id_1, id_2, block):
+        key = self.key(id_1, id_2)
+        if key[0] != id_1:
+            block = np.transpose(block)
+        if key in self.Y:
+            self.Y[key] = self.Y[key] + block
+        else:
+            self.Y[key] = np.array(block, dtype=np.float64)
+
+    # Add to the y block of an agent
+    def add_vector(self, id, vector):
+        if id in self.y:
+            self.y[id] = self.y[id] + vector
+        else:
+            self.y[id] = np.array(vector, dtype=np.float64)
+
+    # Add another set of information variables (with IDs known to this one) to this one, e.g. Y + I, y + i
+    def add(self, other):
+        for (id_1, id_2), block in other.Y.items():
+            self.add_block(id_1, id_2, block)
+        for id, vector in other.y.items():
+            self.add_vector(id, vector)
+        return self
+
+    # Build from a dense information matrix and vector, keeping only non-zero blocks
+    @classmethod
+    def from_dense(cls, Y, y, id_list, dim_state):
+        inf = cls(dim_state, id_list)
+        for i in range(len(id_list)):
+            i_low = dim_state * i
+            i_high = i_low + dim_state
+            if id_list[i] == dse_constants.EMPTY_SLOT_ID:
+                continue
+            if np.any(y[i_low:i_high]):
+                inf.y[id_list[i]] = np.array(y[i_low:i_high], dtype=np.float64)
+            for j in range(i, len(id_list)):
+                j_low = dim_state * j
+                j_high = j_low + dim_state
+                if id_list[j] != dse_constants.EMPTY_SLOT_ID and np.any(Y[i_low:i_high, j_low:j_high]):
+                    inf.Y[(id_list[i], id_list[j])] = np.array(Y[i_low:i_high, j_low:j_high], dtype=np.float64)
+        return inf
+
+    # Expand into a dense information matrix and vector, ordered by the ID list
+    def to_dense(self):
+        d = self.dim_state
+        dim = len(self.index) * d
+        Y = np.zeros((dim, dim))
+        y = np.zeros((dim, 1))
+        for (id_1, id_2), block in self.Y.items():
+            Y[self.index.state_slice(id_1), self.index.state_slice(id_2)] = block
+            Y[self.index.state_slice(id_2), self.index.state_slice(id_1)] = np.transpose(block)
+        for id, vector in self.y.items():
+            y[self.index.state_slice(id)] = vector
+        return Y, y
+
+    # Split the agents into groups that share no information with each other
+    def components(self):
+        neighbors = dict((id, []) for id in self.index.active_ids())
+        for id_1, id_2 in self.Y:
+            if id_1 != id_2:
+                neighbors[id_1].append(id_2)
+                neighbors[id_2].append(id_1)
+
+        components = []
+        visited = set()
+        for id in self.index.active_ids():
+            if id in visited:
+                continue
+            visited.add(id)
+            component = [id]
+            for member in component:
+                for neighbor in neighbors[member]:
+                    if neighbor not in visited:
+                        visited.add(neighbor)
+                        component.append(neighbor)
+            components.append(sorted(component, key=self.index.slot))
+        return components
+
+    # Dense Y and y of a group of agents
+    def component_dense(self, component):
+        d = self.dim_state
+        Y = np.zeros((len(component) * d, len(component) * d))
+        y = np.zeros((len(component) * d, 1))
+        for i, id_1 in enumerate(component):
+            y[i*d:(i+1)*d] = self.y.get(id_1, np.zeros((d, 1)))
+            for j in range(i, len(component)):
+                block = self.Y.get((id_1, component[j]))
+                if block is not None:
+                    Y[i*d:(i+1)*d, j*d:(j+1)*d] = block
+                    Y[j*d:(j+1)*d, i*d:(i+1)*d] = np.transpose(block)
+        return Y, y
+
+    # Recover the Kalman state x = Y^-1 * y, one small solve per connected group
+    def recover(self):
+        d = self.dim_state
+        x = np.zeros((len(self.index) * d, 1))
+        for component in self.components():
+            Y, y = self.component_dense(component)
+            x_c = linalg.cho_solve(linalg.cho_factor(Y, lower=True, check_finite=False), y, check_finite=False)
+            for i, id in enumerate(component):
+                x[self.index.state_slice(id)] = x_c[i*d:(i+1)*d]
+        return x
+
+    # Prediction step with block-diagonal F and Q, given as dicts of ID -> dim_state x dim_state block.
+    # Since F and Q do not couple agents, the prediction only fills in blocks within each connected group,
+    # so each group is predicted on its own. The inverses of the blocks can be passed in the same way.
+    # With sparsify_tol > 0, the filled-in couplings weaker than sparsify_tol are pruned (see sparsify_information)
+    def predict(self, F_blocks, Q_blocks, engine, F_inv_blocks=None, Q_inv_blocks=None, sparsify_tol=0):
+        d = self.dim_state
+        prior = BlockInformation(d, self.ids)
+        for component in self.components():
+            Y, y = self.component_dense(component)
+            F = linalg.block_diag(*[F_blocks[id] for id in component])
+            Q = linalg.block_diag(*[Q_blocks[id] for id in component])
+            F_inv = None
+            Q_inv = None
+            if F_inv_blocks is not None:
+                F_inv = linalg.block_diag(*[F_inv_blocks[id] for id in component])
+            if Q_inv_blocks is not None:
+                Q_inv = linalg.block_diag(*[Q_inv_blocks[id] for id in component])
+            Y_01, y_01 = engine.predict(Y, y, F, Q, F_inv, Q_inv)
+            if sparsify_tol > 0 and len(component) > 2:
+                Y_01, y_01 = sparsify_information(Y_01, y_01, d, sparsify_tol)
+            for i, id_1 in enumerate(component):
+                prior.y[id_1] = y_01[i*d:(i+1)*d]
+                for j in range(i, len(component)):
+                    block = Y_01[i*d:(i+1)*d, j*d:(j+1)*d]
+                    if i == j or np.any(block):
+                        prior.Y[(id_1, component[j])] = block
+        return prior
+
+    # Measurement contributions I = H^T * R^-1 * H and i = H^T * R^-1 * z, with H ordered by the ID list.
+    # Only the agents that have non-zero columns in H get blocks.
+    # R is either the full measurement covariance or the vector of its diagonal
+    def observation(self, H_0, R_0, z_0):
+        d = self.dim_state
+        if np.ndim(R_0) == 1:
+            r_std = np.sqrt(R_0)[:, None]
+            W_0 = H_0 / r_std
+            w_0 = z_0 / r_std
+        else:
+            R_chol = linalg.cholesky(R_0, lower=True, check_finite=False)
+            W_0 = linalg.solve_triangular(R_chol, H_0, lower=True, check_finite=False)
+            w_0 = linalg.solve_triangular(R_chol, z_0, lower=True, check_finite=False)
+
+        obs = BlockInformation(d, self.ids)
+        active = np.where(np.any(np.reshape(W_0 != 0, (np.shape(W_0)[0], len(self.index), d)), axis=(0, 2)))[0]
+        for a, slot_1 in enumerate(active):
+            W_1 = W_0[:, slot_1*d:(slot_1+1)*d]
+            obs.y[self.ids[slot_1]] = np.transpose(W_1).dot(w_0)
+            for slot_2 in active[a:]:
+                W_2 = W_0[:, slot_2*d:(slot_2+1)*d]
+                obs.Y[(self.ids[slot_1], self.ids[slot_2])] = np.transpose(W_1).dot(W_2)
+        return obs
+
+    # Add per-observation contributions (see InformationFilterEngine.observation_blocks), slots of this ID list
+    def add_observation_blocks(self, obs_slots, I_blocks, i_blocks):
+        d = self.dim_state
+        ids = self.index.ids
+        for (slot_1, slot_2), I, i in zip(obs_slots, I_blocks, i_blocks):
+            id_1 = ids[slot_1]
+            id_2 = ids[slot_2]
+            self.add_block(id_1, id_1, I[0:d, 0:d])
+            self.add_block(id_1, id_2, I[0:d, d:])
+            self.add_block(id_2, id_2, I[d:, d:])
+            self.add_vector(id_1, i[0:d])
+            self.add_vector(id_2, i[d:])
+        return self
+
+    # Add the blocks of matrix and vector InfBlocks ROS messages (see inf_observation_blocks_input)
+    def add_inf_blocks(self, matrix_blocks, vector_blocks):
+        row_ids, col_ids, blocks, symmetric = inf_blocks_output(matrix_blocks)
+        for id_1, id_2, block in zip(row_ids, col_ids, blocks):
+            self.add_block(id_1, id_2, block)
+        row_ids, col_ids, blocks, symmetric = inf_blocks_output(vector_blocks)
+        for id, block in zip(row_ids, blocks):
+            self.add_vector(id, block)
+        return self
+
+    # Update step, returns the posterior and the measurement contributions
+    def update(self, H_0, R_0, z_0):
+        obs = self.observation(H_0, R_0, z_0)
+        posterior = BlockInformation(self.dim_state, self.ids)
+        posterior.add(self).add(obs)
+        return posterior, obs
+
+    # Number of bytes held in blocks
+    def nbytes(self):
+        return sum(block.nbytes for block in self.Y.values()) + sum(vector.nbytes for vector in self.y.values())
+
+    # Fill in the matrix and vector multi-array ROS messages, blocks are keyed by position in the ID list
+    def to_multi_arrays(self, matrix_arr, vector_arr):
+        d = self.dim_state
+        dim = len(self.index) * d
+        keys = list(self.Y.keys())
+        rows = self.index.slots([key[0] for key in keys])
+        cols = self.index.slots([key[1] for key in keys])
+        blocks = np.reshape([self.Y[key] for key in keys], (len(keys), d, d))
+        matrix_arr = multi_array_blocks_input(rows, cols, blocks, [dim, dim], matrix_arr, symmetric=True)
+
+        ids = list(self.y.keys())
+        rows = self.index.slots(ids)
+        blocks = np.reshape([self.y[id] for id in ids], (len(ids), d, 1))
+        vector_arr = multi_array_blocks_input(rows, np.zeros(len(ids)), blocks, [dim, 1], vector_arr)
+        return matrix_arr, vector_arr
+
+    # Build from matrix and vector multi-array ROS messages (block-encoded or dense) and their ID list
+    @classmethod
+    def from_multi_arrays(cls, id_list, matrix_arr, vector_arr):
+        id_list = list(id_list)
+        if not multi_array_is_blocks(matrix_arr):
+            Y = multi_array_2d_output(matrix_arr)
+            y = multi_array_2d_output(vector_arr)
+            return cls.from_dense(Y, y, id_list, int(np.shape(Y)[0] / len(id_list)))
+
+        rows, cols, blocks, shape, symmetric = multi_array_blocks_output(matrix_arr)
+        inf = cls(int(shape[0] / len(id_list)), id_list)
+        for row, col, block in zip(rows, cols, blocks):
+            inf.add_block(id_list[row], id_list[col], block)
+        rows, cols, blocks, shape, symmetric = multi_array_blocks_output(vector_arr)
+        for row, block in zip(rows, blocks):
+            inf.add_vector(id_list[row], block)
+        return inf
+
+    # Build from an InfFilterResults message, sent quantized or as multi-arrays
+    @classmethod
+    def from_results(cls, results):
+        if quantized_array_is_set(results.inf_matrix_quantized):
+            Y = quantized_array_output(results.inf_matrix_quantized)
+            y = quantized_array_output(results.inf_vector_quantized)
+            return cls.from_dense(Y, y, list(results.ids), int(np.shape(Y)[0] / len(results.ids)))
+        return cls.from_multi_arrays(results.ids, results.inf_matrix, results.inf_vector)
+
+
 # Define the measurement jacobian for a camera (3D-observation)
 def h_camera_3D(H, x, agent1, agent2, dim_state, dim_obs):
     agent1_row_min = dim_state * agent1
@@ -582,20 +2155,189 @@ def h_camera(H, x, agent1, agent2, dim_state, dim_obs):
 
 
 # Helper functions
+# id_list is either an AgentIndex or an array of IDs
 def state_from_id(x, id_list, id, dim_state):
-    index = np.where(id_list == id)[0][0]
+    index = agent_index(id_list, dim_state).slot(id)
     i_low = dim_state * index
     i_high = i_low + dim_state
     return x[i_low:i_high]
 
 
 def cov_from_id(P, id_list, id, dim_state):
-    index = np.where(id_list == id)[0][0]
+    index = agent_index(id_list, dim_state).slot(id)
     i_low = dim_state * index
     i_high = i_low + dim_state
     return P[i_low:i_high, i_low:i_high]
 
 
+# Same as cov_from_id, from the information matrix Y instead of P (see InformationEstimate.cov_blocks)
+# Pass a list of IDs to get their joint covariance
+def cov_from_information(Y, id_list, ids, dim_state):
+    inf = InformationEstimate(Y, None, id_list, dim_state)
+    return inf.cov_blocks(np.atleast_1d(ids))
+
+
+# Persistent mapping from agent ID to its slot in the state vector x (and in P, Y and y)
+# Lookups are O(1), and slots freed by dropped agents are reused by the next added agent,
+# so every other agent keeps its slot. Free slots show up as dse_constants.EMPTY_SLOT_ID in the ID list.
+class AgentIndex:
+
+    def __init__(self, ids=(), dim_state=6):
+        self.dim_state = dim_state
+        self.id_list = []
+        self.slot_of = {}
+        self.free = []
+        for id in ids:
+            if id == dse_constants.EMPTY_SLOT_ID:
+                self.free.append(len(self.id_list))
+                self.id_list.append(id)
+            else:
+                self.slot_of[id] = len(self.id_list)
+                self.id_list.append(id)
+
+    def copy(self):
+        index = AgentIndex((), self.dim_state)
+        index.id_list = list(self.id_list)
+        index.slot_of = dict(self.slot_of)
+        index.free = list(self.free)
+        return index
+
+    def __contains__(self, id):
+        return id in self.slot_of
+
+    # Number of slots, including free ones. The state vector holds len(index) * dim_state values
+    def __len__(self):
+        return len(self.id_list)
+
+    # ID of each slot, in state order
+    @property
+    def ids(self):
+        return np.array(self.id_list)
+
+    def active_ids(self):
+        return [id for id in self.id_list if id != dse_constants.EMPTY_SLOT_ID]
+
+    def slot(self, id):
+        return self.slot_of[id]
+
+    def slots(self, ids):
+        return np.array([self.slot_of[id] for id in ids], dtype=int)
+
+    # Add an agent and return its slot, reusing the lowest free slot if there is one
+    def add(self, id):
+        if id in self.slot_of:
+            return self.slot_of[id]
+        if self.free:
+            self.free.sort()
+            slot = self.free.pop(0)
+            self.id_list[slot] = id
+        else:
+            slot = len(self.id_list)
+            self.id_list.append(id)
+        self.slot_of[id] = slot
+        return slot
+
+    # Remove an agent, its slot is kept (so no other agent moves) and reused by the next add
+    def drop(self, id):
+        slot = self.slot_of.pop(id)
+        self.id_list[slot] = dse_constants.EMPTY_SLOT_ID
+        self.free.append(slot)
+        return slot
+
+    # Slice of an agent's values in the state vector
+    def state_slice(self, id):
+        i_low = self.dim_state * self.slot_of[id]
+        return slice(i_low, i_low + self.dim_state)
+
+    # View of an agent's state in x
+    def state(self, x, id):
+        return x[self.state_slice(id)]
+
+    # View of the covariance (or information) block between two agents
+    def cov(self, P, id_1, id_2=None):
+        if id_2 is None:
+            id_2 = id_1
+        return P[self.state_slice(id_1), self.state_slice(id_2)]
+
+
+# Information matrix Y and vector y with their AgentIndex, kept in buffers that grow geometrically.
+# New agents from a message are added in a single extension, Y and y are views into the buffers.
+class InformationStateStore:
+
+    def __init__(self, dim_state, ids=(), capacity=4):
+        self.dim_state = dim_state
+        self.index = AgentIndex((), dim_state)
+        self.capacity = capacity
+        self.Y_buffer = np.zeros((capacity * dim_state, capacity * dim_state))
+        self.y_buffer = np.zeros((capacity * dim_state, 1))
+        self.extend(ids)
+
+    # Information matrix of the stored agents
+    @property
+    def Y(self):
+        dim = len(self.index) * self.dim_state
+        return self.Y_buffer[0:dim, 0:dim]
+
+    # Information vector of the stored agents
+    @property
+    def y(self):
+        dim = len(self.index) * self.dim_state
+        return self.y_buffer[0:dim]
+
+    # Make room for n_agents, at least doubling the capacity when it has to grow
+    # With keep, the stored values are copied into the new buffers
+    def reserve(self, n_agents, keep=True):
+        if n_agents <= self.capacity:
+            return
+        dim = np.shape(self.Y_buffer)[0]
+        self.capacity = max(n_agents, 2 * self.capacity)
+        Y_buffer = np.zeros((self.capacity * self.dim_state, self.capacity * self.dim_state))
+        y_buffer = np.zeros((self.capacity * self.dim_state, 1))
+        if keep:
+            Y_buffer[0:dim, 0:dim] = self.Y_buffer
+            y_buffer[0:dim] = self.y_buffer
+        self.Y_buffer = Y_buffer
+        self.y_buffer = y_buffer
+
+    # Add every unknown ID at once, initialized the same way as extend_arrays. Returns the new slots
+    def extend(self, ids):
+        new_ids = [id for id in unique_ids(ids) if id not in self.index]
+        if len(new_ids) == 0:
+            return []
+
+        slots = [self.index.add(id) for id in new_ids]
+        self.reserve(len(self.index))
+        dim = len(self.index) * self.dim_state
+        for slot in slots:
+            s = slice(self.dim_state * slot, self.dim_state * (slot + 1))
+            self.Y_buffer[s, 0:dim] = 0
+            self.Y_buffer[0:dim, s] = 0
+            self.Y_buffer[s, s] = dse_constants.INF_MATRIX_INITIAL * np.eye(self.dim_state)
+            self.y_buffer[s] = dse_constants.INF_VECTOR_INITIAL * np.arange(s.start + 1, s.stop + 1)[:, None]
+        return slots
+
+    # Remove an agent, its slot is reused by the next new agent
+    def drop(self, id):
+        return self.index.drop(id)
+
+    # Replace the stored values, e.g. with results from the estimator. They are copied into the buffers, which
+    # keep their spare capacity, so agents added after the results don't reallocate them
+    def set(self, ids, Y, y):
+        index = AgentIndex(ids, self.dim_state)
+        self.reserve(len(index), keep=False)
+        self.index = index
+        dim = len(self.index) * self.dim_state
+        self.Y_buffer[0:dim, 0:dim] = Y
+        self.y_buffer[0:dim] = np.reshape(y, (dim, 1))
+
+
+# Use id_list as an AgentIndex, building one if it is a plain array of IDs
+def agent_index(id_list, dim_state):
+    if isinstance(id_list, AgentIndex):
+        return id_list
+    return AgentIndex(id_list, dim_state)
+
+
 # Define motion jacobian for unicycle robot (3D-observation)
 def f_unicycle_3D(dt, x, agent1, dim_state):
     agent1_row_min = dim_state * agent1
@@ -710,7 +2452,7 @@ def q_distance(dt, x, agent1, dim_state):
 
     # Define the velocity covariance
     Q = 1 * np.eye(dim_state)
-    Q[6:12, 6:9] = dse_constants.MOTION_BASE_COVARIANCE / (dt ** 2) * np.eye(6)
+    Q[6:12, 6:12] = dse_constants.MOTION_BASE_COVARIANCE / (dt ** 2) * np.eye(6)
 
     # if Q_pos or Q_theta is <= 0, problems occur
     if Q_pos > 0:
@@ -720,6 +2462,46 @@ def q_distance(dt, x, agent1, dim_state):
     return Q
 
 
+# Batched q_distance_3D, x is the stacked state with shape (n_agents, dim_state)
+def q_distance_3D_blocks(dt, x):
+    n_agents, dim_state = np.shape(x)
+
+    # Q is (dt * (x_dot + 0.001) * 5%) ^ 2
+    Q_pos = (dt * (np.linalg.norm(x[:, 3:5], axis=1) + 0.001) * 0.05) ** 2
+    Q_theta = (dt * (np.abs(x[:, 5]) + 0.001) * 0.05) ** 2
+
+    # Define the velocity covariance
+    Q = np.tile(np.eye(dim_state), (n_agents, 1, 1))
+    Q[:, [3, 4, 5], [3, 4, 5]] = dse_constants.MOTION_BASE_COVARIANCE / (dt ** 2)
+
+    # if Q_pos or Q_theta is <= 0, problems occur
+    Q[:, 0, 0] = np.where(Q_pos > 0, Q_pos, Q[:, 0, 0])
+    Q[:, 1, 1] = np.where(Q_pos > 0, Q_pos, Q[:, 1, 1])
+    Q[:, 2, 2] = np.where(Q_theta > 0, Q_theta, Q[:, 2, 2])
+    return Q
+
+
+# Batched q_distance, x is the stacked state with shape (n_agents, dim_state)
+def q_distance_blocks(dt, x):
+    n_agents, dim_state = np.shape(x)
+
+    # Q is (dt * (x_dot + 0.001) * 5%) ^ 2
+    Q_pos = (dt * (np.linalg.norm(x[:, 6:9], axis=1) + 0.001) * 0.05) ** 2
+    Q_theta = (dt * (np.linalg.norm(x[:, 9:12], axis=1) + 0.001) * 0.05) ** 2
+
+    # Define the velocity covariance
+    Q = np.tile(np.eye(dim_state), (n_agents, 1, 1))
+    vel = np.arange(6, 12)
+    Q[:, vel, vel] = dse_constants.MOTION_BASE_COVARIANCE / (dt ** 2)
+
+    # if Q_pos or Q_theta is <= 0, problems occur
+    pos = np.arange(0, 3)
+    ang = np.arange(3, 6)
+    Q[:, pos, pos] = np.where(Q_pos > 0, Q_pos, 1)[:, None]
+    Q[:, ang, ang] = np.where(Q_theta > 0, Q_theta, 1)[:, None]
+    return Q
+
+
 # Define motion model covariance (static)
 def q_const(dim_state, var=0.000001):
     Q = var * np.eye(dim_state)
@@ -21,6 +21,7 @@ import tf2_ros
 
 import dse_lib
 import dse_constants
+import dse_bus
 roslib.load_manifest('dse_simulation')
 
 
@@ -28,15 +29,15 @@ class information_filter:
 
     # Define initial/setup values
     def __init__(self, dim_state):
-        self.camera_pose_sub = rospy.Subscriber("/dse/pose_markers", PoseMarkers, self.measurement_callback)
-        self.link_states_sub = rospy.Subscriber("/gazebo/link_states", LinkStates, self.gzbo_true_callback)
-        self.python_true_sub = rospy.Subscriber("/dse/python_pose_true", PoseMarkers, self.pthn_true_callback)
-        self.inf_results_sub = rospy.Subscriber("/dse/inf/results", InfFilterResults, self.results_callback)
-        self.meas_vis_pub = rospy.Publisher("/dse/vis/measurement", PoseArray, queue_size=10)
-        self.gzbo_est_vis_pub = rospy.Publisher("/dse/vis/gazebo_true", PoseArray, queue_size=10)
-        self.pthn_est_vis_pub = rospy.Publisher("/dse/vis/python_true", PoseArray, queue_size=10)
-        self.origin_vis_pub = rospy.Publisher("/dse/vis/origin", PoseArray, queue_size=10)
-        self.est_vis_pub = rospy.Publisher("/dse/vis/estimates", PoseArray, queue_size=10)
+        self.camera_pose_sub = dse_bus.Subscriber("/dse/pose_markers", PoseMarkers, self.measurement_callback)
+        self.link_states_sub = dse_bus.Subscriber("/gazebo/link_states", LinkStates, self.gzbo_true_callback)
+        self.python_true_sub = dse_bus.Subscriber("/dse/python_pose_true", PoseMarkers, self.pthn_true_callback)
+        self.inf_results_sub = dse_bus.Subscriber("/dse/inf/results", InfFilterResults, self.results_callback)
+        self.meas_vis_pub = dse_bus.Publisher("/dse/vis/measurement", PoseArray, queue_size=10)
+        self.gzbo_est_vis_pub = dse_bus.Publisher("/dse/vis/gazebo_true", PoseArray, queue_size=10)
+        self.pthn_est_vis_pub = dse_bus.Publisher("/dse/vis/python_true", PoseArray, queue_size=10)
+        self.origin_vis_pub = dse_bus.Publisher("/dse/vis/origin", PoseArray, queue_size=10)
+        self.est_vis_pub = dse_bus.Publisher("/dse/vis/estimates", PoseArray, queue_size=10)
 
         self.dim_state = dim_state
         if self.dim_state == 6:
@@ -48,7 +49,7 @@ class information_filter:
 
         # Define static variables
         self.dt = 0.1
-        self.t_last = rospy.get_time()
+        self.t_last = dse_bus.get_time()
         self.gzbo_ref_obj_state = None
         self.pthn_ref_obj_state = None
 
@@ -81,7 +82,7 @@ class information_filter:
         print('measurement: ' + str(x))
 
         poses = PoseArray()
-        poses.header.stamp = rospy.Time.now()
+        poses.header.stamp = dse_bus.now()
         poses.header.frame_id = 'odom'
 
         if self.gzbo_ref_obj_state is not None:
@@ -108,11 +109,10 @@ class information_filter:
 
     # Create pose_array for the information results
     def pthn_true_callback(self, data):
-        n = len(data.ids)
-        for i in range(n):
-            if data.ids[i] == dse_constants.GAZEBO_REFERENCE_OBJECT_ID:
-                self.pthn_ref_obj_state = dse_lib.state_from_pose_3D(data.pose_array.poses[i])
-                break
+        ids, pose_arr = dse_lib.arrays_from_pose_markers(data)
+        match = np.flatnonzero(ids == dse_constants.GAZEBO_REFERENCE_OBJECT_ID)
+        if len(match) > 0:
+            self.pthn_ref_obj_state = dse_lib.state_from_pose_array(pose_arr[match[0:1]], 3, 3)
 
     def values_in_ref_frame(self, x, id_list, ref_obj, poses):
         if self.dim_obs == 3:
@@ -142,15 +142,13 @@ class information_filter:
     # Create pose_array for the information results
     def results_callback(self, data):
         inf_id_list = np.array(data.ids)
-        inf_Y = dse_lib.multi_array_2d_output(data.inf_matrix)
-        inf_y = dse_lib.multi_array_2d_output(data.inf_vector)
-        inf_x = np.linalg.inv(inf_Y).dot(inf_y)
-        inf_P = np.linalg.inv(inf_Y)
+        inf = dse_lib.InformationEstimate.from_results(data, self.dim_state)
+        inf_x = inf.x
 
         print('estimations: ' + str(inf_x))
 
         poses = PoseArray()
-        poses.header.stamp = rospy.Time.now()
+        poses.header.stamp = dse_bus.now()
         poses.header.frame_id = 'odom'
 
         if self.gzbo_ref_obj_state is not None:
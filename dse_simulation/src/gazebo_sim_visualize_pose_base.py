@@ -21,6 +21,7 @@ import tf2_ros
 
 import dse_lib
 import dse_constants
+import dse_bus
 roslib.load_manifest('dse_simulation')
 
 
@@ -28,14 +29,14 @@ class information_filter:
 
     # Define initial/setup values
     def __init__(self, this_agent_id, dim_state):
-        self.camera_pose_sub = rospy.Subscriber("/dse/pose_markers", PoseMarkers, self.measurement_callback)
-        self.link_states_sub = rospy.Subscriber("/gazebo/link_states", LinkStates, self.gzbo_true_callback)
-        self.python_true_sub = rospy.Subscriber("/dse/python_pose_true", PoseMarkers, self.pthn_true_callback)
-        self.inf_results_sub = rospy.Subscriber("/dse/inf/results", InfFilterResults, self.results_callback)
-        self.meas_vis_pub = rospy.Publisher("/dse/vis/measurement", PoseArray, queue_size=10)
-        self.gzbo_vis_pub = rospy.Publisher("/dse/vis/gazebo_true", PoseArray, queue_size=10)
-        self.pthn_vis_pub = rospy.Publisher("/dse/vis/python_true", PoseArray, queue_size=10)
-        self.est_vis_pub = rospy.Publisher("/dse/vis/estimates", PoseArray, queue_size=10)
+        self.camera_pose_sub = dse_bus.Subscriber("/dse/pose_markers", PoseMarkers, self.measurement_callback)
+        self.link_states_sub = dse_bus.Subscriber("/gazebo/link_states", LinkStates, self.gzbo_true_callback)
+        self.python_true_sub = dse_bus.Subscriber("/dse/python_pose_true", PoseMarkers, self.pthn_true_callback)
+        self.inf_results_sub = dse_bus.Subscriber("/dse/inf/results", InfFilterResults, self.results_callback)
+        self.meas_vis_pub = dse_bus.Publisher("/dse/vis/measurement", PoseArray, queue_size=10)
+        self.gzbo_vis_pub = dse_bus.Publisher("/dse/vis/gazebo_true", PoseArray, queue_size=10)
+        self.pthn_vis_pub = dse_bus.Publisher("/dse/vis/python_true", PoseArray, queue_size=10)
+        self.est_vis_pub = dse_bus.Publisher("/dse/vis/estimates", PoseArray, queue_size=10)
 
         self.dim_state = dim_state
         if self.dim_state == 6:
@@ -48,7 +49,7 @@ class information_filter:
         # Define static variables
         self.this_agent_id = this_agent_id
         self.dt = 0.1
-        self.t_last = rospy.get_time()
+        self.t_last = dse_bus.get_time()
         self.gzbo_ref_obj_state = None
         self.pthn_ref_obj_state = None
 
@@ -56,7 +57,7 @@ class information_filter:
     def measurement_callback(self, data):
         poses = PoseArray()
         poses.poses = data.pose_array.poses
-        poses.header.stamp = rospy.Time.now()
+        poses.header.stamp = dse_bus.now()
         poses.header.frame_id = 'base_link'
         self.meas_vis_pub.publish(poses)
 
@@ -76,31 +77,28 @@ class information_filter:
         if got_tag and got_robot:
             diff = dse_lib.agent2_to_frame_agent1_3D(robot_state, tag_state)
             poses = PoseArray()
-            poses.header.stamp = rospy.Time.now()
+            poses.header.stamp = dse_bus.now()
             poses.header.frame_id = 'base_link'
             poses = dse_lib.pose_array_from_measurement(poses, diff, self.dim_obs)
             self.gzbo_vis_pub.publish(poses)
 
     # Create pose_array for the information results
     def pthn_true_callback(self, data):
-        n = len(data.ids)
-        for i in range(n):
-            if data.ids[i] == dse_constants.GAZEBO_REFERENCE_OBJECT_ID:
-                self.pthn_ref_obj_state = dse_lib.state_from_pose_3D(data.pose_array.poses[i])
-                break
+        ids, pose_arr = dse_lib.arrays_from_pose_markers(data)
+        match = np.flatnonzero(ids == dse_constants.GAZEBO_REFERENCE_OBJECT_ID)
+        if len(match) > 0:
+            self.pthn_ref_obj_state = dse_lib.state_from_pose_array(pose_arr[match[0:1]], 3, 3)
 
     # Create pose_array for the information results
     def results_callback(self, data):
         inf_id_list = np.array(data.ids)
-        inf_Y = dse_lib.multi_array_2d_output(data.inf_matrix)
-        inf_y = dse_lib.multi_array_2d_output(data.inf_vector)
-        self.inf_x = np.linalg.inv(inf_Y).dot(inf_y)
-        inf_P = np.linalg.inv(inf_Y)
+        inf = dse_lib.InformationEstimate.from_results(data, self.dim_state)
+        self.inf_x = inf.x
 
         print('estimations: ' + str(self.inf_x))
 
         poses = PoseArray()
-        poses.header.stamp = rospy.Time.now()
+        poses.header.stamp = dse_bus.now()
         poses.header.frame_id = 'base_link'
 
         estimated_ids, estimated_states = dse_lib.relative_states_from_global_3D(self.this_agent_id, inf_id_list,
@@ -18,6 +18,7 @@ from scipy.spatial.transform import Rotation as R
 
 import dse_lib
 import dse_constants
+import dse_bus
 roslib.load_manifest('dse_simulation')
 
 
@@ -27,11 +28,11 @@ def main(args):
 
     rospy.init_node('inf_est_pub_sim_node', anonymous=True)
     # Publisher for measurements
-    pose_pub = rospy.Publisher("/dse/pose_markers", PoseMarkers, queue_size=10)
+    pose_pub = dse_bus.Publisher("/dse/pose_markers", PoseMarkers, queue_size=10)
     # Publisher for true values
-    true_pub = rospy.Publisher("/dse/python_pose_true", PoseMarkers, queue_size=10)
+    true_pub = dse_bus.Publisher("/dse/python_pose_true", PoseMarkers, queue_size=10)
     # Publisher for true values
-    inf_pub = rospy.Publisher("/dse/inf/results", InfFilterResults, queue_size=10)
+    inf_pub = dse_bus.Publisher("/dse/inf/results", InfFilterResults, queue_size=10)
 
     # Define constants
     dt = 1.0 / rate
@@ -70,6 +71,11 @@ def main(args):
     inf_id_obs = []
     inf_id_comm = []
 
+    # Factorization-based information filter steps
+    engine = dse_lib.InformationFilterEngine(inf_dim_state, inf_dim_obs)
+    # Cross-check against a Kalman filter every 10 steps
+    verifier = dse_lib.ShadowKalmanVerifier(10, engine=engine)
+
     # Initialize information variables
     id_list = [this_agent_id]
     inf_Y = dse_constants.INF_MATRIX_INITIAL * np.eye(dim_state, dtype=np.float64)
@@ -94,7 +100,7 @@ def main(args):
         true_pose = PoseMarkers()
         true_pose.ids = true_id_list
         true_pose.pose_array = dse_lib.pose_array_from_state(true_pose.pose_array, x, dim_state, dim_obs)
-        true_pose.pose_array.header.stamp = rospy.Time.now()
+        true_pose.pose_array.header.stamp = dse_bus.now()
         true_pose.pose_array.header.frame_id = 'dse'
         true_pub.publish(true_pose)
 
@@ -124,91 +130,59 @@ def main(args):
         marker_pose = PoseMarkers()
         marker_pose.ids = [0]
         marker_pose.pose_array = dse_lib.pose_array_from_measurement(marker_pose.pose_array, z_true, dim_obs)
-        marker_pose.pose_array.header.stamp = rospy.Time.now()
+        marker_pose.pose_array.header.stamp = dse_bus.now()
         marker_pose.pose_array.header.frame_id = 'dse'
         pose_pub.publish(marker_pose)
 
         # Grab the tag poses from the camera
-        observed_poses = marker_pose.pose_array.poses
-        observed_ids = marker_pose.ids
+        observed_ids, observed_poses = dse_lib.arrays_from_pose_markers(marker_pose)
         n = 1 + len(observed_ids)
 
         # update local values from the last time step
         Y_11 = inf_Y  # Information matrix - Covariance
         y_11 = inf_y  # Information vector - States
-        x_11 = np.linalg.inv(Y_11).dot(y_11)  # Kalman State
-        P_11 = np.linalg.inv(Y_11)  # Kalman Covariance
 
         # If we find an ID that isn't currently known, add it
         id_list, Y_11, y_11, P_11, x_11 = dse_lib.extend_arrays(observed_ids, id_list, Y_11, y_11, inf_dim_state)
 
         # Fill in R, H, z, F, and Q
-        # R - Measurement Covariance
+        # R - Measurement Covariance (diagonal)
         # H - Measurement Jacobian
         # z - The measurement itself
         # This function is defined in src/dse_lib.py
-        R_0, H_0, z_0 = dse_lib.fill_RHz(id_list, this_agent_id, observed_ids, observed_poses, x_11,
-                                         euler_order, inf_dim_state, inf_dim_obs)
+        R_0, H_0, z_0, angle_mask = dse_lib.fill_RHz_batched(id_list, this_agent_id, observed_ids, observed_poses,
+                                                             x_11, euler_order, inf_dim_state, inf_dim_obs,
+                                                             return_angle_mask=True)
 
         # F - Motion Jacobian
         # Q - Motion Covariance
-        F_0, Q_0 = dse_lib.fill_FQ(id_list, dt, x_11, inf_dim_state, inf_dim_obs)
-
-        y = z_0 - H_0.dot(x_11)
-        while y[2] > np.pi or y[2] < -np.pi:
-            if y[2] > np.pi:
-                z_0[2] = z_0[2] - 2 * np.pi
-            if y[2] < -np.pi:
-                z_0[2] = z_0[2] + 2 * np.pi
-            y = z_0 - H_0.dot(x_11)
-
-        # Compute the information filter steps
-        M_0 = np.transpose(np.linalg.inv(F_0)).dot(Y_11.dot(np.linalg.inv(F_0)))
-        C_0 = M_0.dot(np.linalg.inv(M_0 + np.linalg.inv(Q_0)))
-        L_0 = np.eye(np.shape(C_0)[0]) - C_0
-        Y_01 = L_0.dot(M_0.dot(np.transpose(L_0))) + C_0.dot(np.linalg.inv(Q_0).dot(np.transpose(C_0)))
-        y_01 = L_0.dot(np.transpose(np.linalg.inv(F_0)).dot(y_11))  # + Y_01.dot(B_0.dot(u_0))
-        Y_00 = Y_01 + np.transpose(H_0).dot(np.linalg.inv(R_0).dot(H_0))
-        y_00 = y_01 + np.transpose(H_0).dot(np.linalg.inv(R_0).dot(z_0))
+        F_0, Q_0, F_inv, Q_inv = dse_lib.fill_FQ(id_list, dt, x_11, inf_dim_state, inf_dim_obs, inverse=True)
+
+        # Wrap the angles of every observation so the innovation z - H * x is within [-pi, pi)
+        z_0 = dse_lib.wrap_angles(z_0, H_0.dot(x_11), angle_mask)
+
+        # Compute the information filter steps (factorization-based, see dse_lib.InformationFilterEngine)
+        Y_01, y_01 = engine.predict(Y_11, y_11, F_0, Q_0, F_inv, Q_inv)  # + Y_01.dot(B_0.dot(u_0))
+        Y_00, y_00, inf_I, inf_i = engine.update(Y_01, y_01, H_0, R_0, z_0)
         # Don't use z, loop up extended information filter
 
-        # Compute the Kalman filter steps (For comparison and math checking)
-        x_01 = F_0.dot(x_11)  # + B_0.dot(u_0)
-        P_01 = F_0.dot(P_11.dot(np.transpose(F_0))) + Q_0
-        y = z_0 - H_0.dot(x_01)
-        S = H_0.dot(P_01.dot(np.transpose(H_0))) + R_0
-        K = P_01.dot(np.transpose(H_0).dot(np.linalg.inv(S)))
-        x_00 = x_01 + K.dot(y)
-        P_00 = (np.eye(np.shape(K)[0]) - K.dot(H_0)).dot(P_01)
-
-        kal_x_01 = x_01
-        kal_x_00 = x_00
-        kal_P_01 = P_01
-        kal_P_00 = P_00
-
-        inf_x_01 = np.linalg.inv(Y_01).dot(y_01)
-        inf_x_00 = np.linalg.inv(Y_00).dot(y_00)
-        inf_P_01 = np.linalg.inv(Y_01)
-        inf_P_00 = np.linalg.inv(Y_00)
-
-        kal_x_01_eq_inf_x_01 = np.allclose(kal_x_01, inf_x_01)
-        kal_x_00_eq_inf_x_01 = np.allclose(kal_x_00, inf_x_00)
-        kal_P_01_eq_inf_P_01 = np.allclose(kal_P_01, inf_P_01)
-        kal_P_00_eq_inf_P_00 = np.allclose(kal_P_00, inf_P_00)
-
-        inf_Y = np.linalg.inv(kal_P_00)
-        inf_y = inf_Y.dot(kal_x_00)
+        # Compute the Kalman filter steps on a sample of steps (For comparison and math checking)
+        if verifier.due():
+            verifier.check(x_11, P_11, F_0, Q_0, H_0, R_0, z_0, Y_01, y_01, Y_00, y_00)
+
+        inf_Y = Y_00
+        inf_y = y_00
 
         # Write the consensus variables to the publisher
         inf_results = InfFilterResults()
         inf_results.ids = id_list
-        inf_results.inf_matrix = dse_lib.multi_array_2d_input(inf_Y, inf_results.inf_matrix)
+        inf_results.inf_matrix = dse_lib.multi_array_sym_input(inf_Y, inf_results.inf_matrix)
         inf_results.inf_vector = dse_lib.multi_array_2d_input(inf_y, inf_results.inf_vector)
         inf_pub.publish(inf_results)
 
         # Pause for dt time then run the next step
         k = k + 1
-        rospy.sleep(dt)
+        dse_bus.sleep(dt)
 
 
 if __name__ == '__main__':
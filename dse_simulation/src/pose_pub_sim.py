@@ -17,6 +17,7 @@ from scipy.spatial.transform import Rotation as R
 
 import dse_lib
 import dse_constants
+import dse_bus
 roslib.load_manifest('dse_simulation')
 
 
@@ -26,9 +27,9 @@ def main(args):
 
     rospy.init_node('aruco_sim', anonymous=True)
     # Publisher for measurements
-    pose_pub = rospy.Publisher("/dse/pose_markers", PoseMarkers, queue_size=10)
+    pose_pub = dse_bus.Publisher("/dse/pose_markers", PoseMarkers, queue_size=10)
     # Publisher for true values
-    true_pub = rospy.Publisher("/dse/python_pose_true", PoseMarkers, queue_size=10)
+    true_pub = dse_bus.Publisher("/dse/python_pose_true", PoseMarkers, queue_size=10)
 
     # Define constants
     dt = 1.0 / rate
@@ -69,7 +70,7 @@ def main(args):
         true_pose = PoseMarkers()
         true_pose.ids = [1, 0]
         true_pose.pose_array = dse_lib.pose_array_from_state(true_pose.pose_array, x, dim_state, dim_obs)
-        true_pose.pose_array.header.stamp = rospy.Time.now()
+        true_pose.pose_array.header.stamp = dse_bus.now()
         true_pose.pose_array.header.frame_id = 'dse'
         true_pub.publish(true_pose)
 
@@ -101,13 +102,13 @@ def main(args):
         marker_pose = PoseMarkers()
         marker_pose.ids = [0]
         marker_pose.pose_array = dse_lib.pose_array_from_state(marker_pose.pose_array, z_true, dim_obs, dim_obs)
-        marker_pose.pose_array.header.stamp = rospy.Time.now()
+        marker_pose.pose_array.header.stamp = dse_bus.now()
         marker_pose.pose_array.header.frame_id = 'dse'
         pose_pub.publish(marker_pose)
 
         # Pause for dt time then run the next step
         k = k + 1
-        rospy.sleep(dt)
+        dse_bus.sleep(dt)
 
 
 if __name__ == '__main__':
@@ -24,6 +24,7 @@ from scipy.spatial.transform import Rotation as R
 
 import dse_lib
 import dse_constants
+import dse_bus
 
 roslib.load_manifest('dse_simulation')
 
@@ -31,14 +32,14 @@ class information_filter:
 
     # Define initial/setup values
     def __init__(self, this_agent_id, dim_state):
-        self.pose_sub = rospy.Subscriber("/dse/pose_markers", PoseMarkers, self.measurement_callback)
-        self.true_sub = rospy.Subscriber("/dse/pose_true", PoseMarkers, self.true_callback)
-        self.results_sub = rospy.Subscriber("/dse/inf/results", InfFilterResults, self.results_callback)
-        self.meas_vis_pub = rospy.Publisher("/dse/plt/measurement", Pose, queue_size=10)
-        self.true_robot_pub = rospy.Publisher("/dse/plt/true/robot", Pose, queue_size=10)
-        self.true_tag_pub = rospy.Publisher("/dse/plt/true/tag", Pose, queue_size=10)
-        self.est_robot_pub = rospy.Publisher("/dse/plt/estimates/robot", Pose, queue_size=10)
-        self.est_tag_pub = rospy.Publisher("/dse/plt/estimates/tag", Pose, queue_size=10)
+        self.pose_sub = dse_bus.Subscriber("/dse/pose_markers", PoseMarkers, self.measurement_callback)
+        self.true_sub = dse_bus.Subscriber("/dse/pose_true", PoseMarkers, self.true_callback)
+        self.results_sub = dse_bus.Subscriber("/dse/inf/results", InfFilterResults, self.results_callback)
+        self.meas_vis_pub = dse_bus.Publisher("/dse/plt/measurement", Pose, queue_size=10)
+        self.true_robot_pub = dse_bus.Publisher("/dse/plt/true/robot", Pose, queue_size=10)
+        self.true_tag_pub = dse_bus.Publisher("/dse/plt/true/tag", Pose, queue_size=10)
+        self.est_robot_pub = dse_bus.Publisher("/dse/plt/estimates/robot", Pose, queue_size=10)
+        self.est_tag_pub = dse_bus.Publisher("/dse/plt/estimates/tag", Pose, queue_size=10)
 
         self.dim_state = dim_state
         if self.dim_state == 6:
@@ -72,10 +73,8 @@ class information_filter:
 
         # Grab information values
         inf_id_list = np.array(data.ids)
-        inf_Y = dse_lib.multi_array_2d_output(data.inf_matrix)
-        inf_y = dse_lib.multi_array_2d_output(data.inf_vector)
-        inf_x = np.linalg.inv(inf_Y).dot(inf_y)
-        inf_P = np.linalg.inv(inf_Y)
+        inf = dse_lib.InformationEstimate.from_results(data, self.dim_state)
+        inf_x = inf.x
 
         for i in range(len(inf_id_list)):
             pose = Pose()
@@ -13,10 +13,13 @@ from std_msgs.msg import MultiArrayLayout
 from std_msgs.msg import MultiArrayDimension
 from dse_msgs.msg import InfFilterPartials
 from dse_msgs.msg import InfFilterResults
+from dse_msgs.msg import InfFilterResultsDelta
+from std_msgs.msg import Empty
 from scipy.spatial.transform import Rotation as R
 
 import dse_lib
 import dse_constants
+import dse_bus
 roslib.load_manifest('dse_simulation')
 
 
@@ -40,14 +43,22 @@ class to_tag_controller:
 
     # Set up initial variables
     # Pass in the ID of this agent and the state dimension (6 or 12)
-    def __init__(self, this_agent_id, dim_state, controller_type):
+    # With delta_stream, the estimate is kept up to date from the delta-encoded results stream instead of
+    # decoding the full results every time (see dse_lib.DeltaStreamDecoder). Only use it when the results
+    # producer publishes /dse/inf/results_delta (the direct estimator does when its delta_stream is set,
+    # inf_est_pub_sim.py doesn't)
+    def __init__(self, this_agent_id, dim_state, controller_type, delta_stream=False):
 
         # Define publishers and subscribers
         # Publishes robot control signals
-        self.control_pub = rospy.Publisher('/cmd_vel', Twist, queue_size=10)
+        self.control_pub = dse_bus.Publisher('/cmd_vel', Twist, queue_size=10)
+        # Requests a keyframe when a delta message was missed
+        self.resync_pub = dse_bus.Publisher('/dse/inf/results_resync', Empty, queue_size=10)
         # Subscribe to the final information filter output
-        if controller_type == 0:
-            self.inf_sub = rospy.Subscriber("/dse/inf/results", InfFilterResults, self.inf_callback)
+        if controller_type == 0 and delta_stream:
+            self.inf_sub = dse_bus.Subscriber("/dse/inf/results_delta", InfFilterResultsDelta, self.delta_callback)
+        elif controller_type == 0:
+            self.inf_sub = dse_bus.Subscriber("/dse/inf/results", InfFilterResults, self.inf_callback)
         else:
             rospy.signal_shutdown('invalid controller type in tag_to_controller.py')
 
@@ -63,9 +74,12 @@ class to_tag_controller:
         # Define static variables
         self.this_agent_id = this_agent_id
         self.dt = 0.1
-        self.t_last = rospy.get_time()
+        self.t_last = dse_bus.get_time()
         self.euler_order = dse_constants.EULER_ORDER
 
+        # Delta-encoded results stream
+        self.delta_decoder = dse_lib.DeltaStreamDecoder(self.dim_state)
+
         # Define controller parameters
         self.V_nominal = 0.5 * self.dt          # meters per second (per time step)
         self.V_theta_max = 5 * self.V_nominal   # radians per second (per time step)
@@ -73,11 +87,20 @@ class to_tag_controller:
 
     # When the direct estimator or consensus returns the combined information variables
     def inf_callback(self, data):
-        inf_id_list = np.array(data.ids)
-        inf_Y = dse_lib.multi_array_2d_output(data.inf_matrix)
-        inf_y = dse_lib.multi_array_2d_output(data.inf_vector)
-        inf_x = np.linalg.inv(inf_Y).dot(inf_y)
-        inf_P = np.linalg.inv(inf_Y)
+        inf = dse_lib.InformationEstimate.from_results(data, self.dim_state)
+        self.control(inf)
+
+    # When the direct estimator sends the changed blocks of the combined information variables
+    def delta_callback(self, data):
+        if not self.delta_decoder.apply(data):
+            self.resync_pub.publish(Empty())
+            return
+        self.control(self.delta_decoder.estimate())
+
+    # Apply the controller to the estimate (see dse_lib.InformationEstimate)
+    def control(self, inf):
+        inf_id_list = inf.index
+        inf_x = inf.x
 
         # information filter sub
         #   create state vector and ID vector from input
@@ -111,7 +134,7 @@ class to_tag_controller:
 
         # Pick a target to follow
         target_id = local_ids[0]
-        target_state = local_states[0:self.dim_state]
+        target_state = np.ravel(local_states[0:self.dim_state])
         theta_error = np.arctan2(target_state[1], target_state[0])
 
         # Apply controller
@@ -137,8 +160,8 @@ class to_tag_controller:
     def measurement_callback(self, data):
 
         # Compute the actual dt
-        self.dt = rospy.get_time() - self.t_last
-        self.t_last = rospy.get_time()
+        self.dt = dse_bus.get_time() - self.t_last
+        self.t_last = dse_bus.get_time()
 
         # Grab the tag poses from the camera
         observed_poses = data.pose_array.poses
@@ -228,7 +251,10 @@ class to_tag_controller:
 
 def main(args):
     rospy.init_node('information_filter_node', anonymous=True)
-    il = to_tag_controller(1, 6, 0)   # This agent's ID is 1, and the state dimension is 6 (x, y, w, x_dot, y_dot, w_dot)
+    # Set the private parameter delta_stream (e.g. <param name="delta_stream" value="true"/> in the node's launch
+    # entry) to follow the delta-encoded results stream instead of the full results
+    delta_stream = rospy.get_param('~delta_stream', False)
+    il = to_tag_controller(1, 6, 0, delta_stream)   # This agent's ID is 1, and the state dimension is 6 (x, y, w, x_dot, y_dot, w_dot)
         # Also controller 0 is a constant-velocity proportional angle controller
     try:
         rospy.spin()
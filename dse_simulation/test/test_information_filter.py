@@ -5,22 +5,48 @@ import roslib
 import os
 import sys
 import unittest
+import types
 import rospy
 import rostest
 from optparse import OptionParser
 import numpy as np
 import datetime
 import time
+from geometry_msgs.msg import Pose
+from geometry_msgs.msg import PoseArray
+from geometry_msgs.msg import Twist
 from dse_msgs.msg import PoseMarkers
 from std_msgs.msg import Float64MultiArray
 from std_msgs.msg import MultiArrayLayout
 from std_msgs.msg import MultiArrayDimension
 from dse_msgs.msg import InfFilterPartials
 from dse_msgs.msg import InfFilterResults
+from dse_msgs.msg import InfFilterResultsDelta
+from dse_msgs.msg import QuantizedArray
 from scipy.spatial.transform import Rotation as R
+from scipy import linalg
+from scipy.optimize import minimize
+from importlib.machinery import SourceFileLoader
+from io import BytesIO
+from rospy.numpy_msg import numpy_msg
 
 sys.path.append(os.path.join(sys.path[0], "../src"))
 import dse_lib
+import dse_constants
+import dse_bus
+import consensus_lib
+import to_tag_controller
+
+
+# Load a node script of ../src, which has no .py extension, as a module
+def load_node(name):
+    module = types.ModuleType(name)
+    SourceFileLoader(name, os.path.join(sys.path[0], "../src", name)).exec_module(module)
+    return module
+
+
+direct_estimator = load_node('direct_estimator')
+information_filter = load_node('information_filter')
 
 PKG = 'dse_simulation'
 roslib.load_manifest(PKG)
@@ -71,8 +97,7 @@ class TestInformationFilterCommon(unittest.TestCase):
         inf_id_list = data.ids
         self.inf_Y_prior = dse_lib.multi_array_2d_output(data.inf_matrix_prior)
         self.inf_y_prior = dse_lib.multi_array_2d_output(data.inf_vector_prior)
-        self.inf_I = dse_lib.multi_array_2d_output(data.obs_matrix)
-        self.inf_i = dse_lib.multi_array_2d_output(data.obs_vector)
+        self.inf_I, self.inf_i = dse_lib.inf_partial_observation_output(data, self.dim_state)
 
 
 ##############################################################################
@@ -355,6 +380,1102 @@ class TestInformationFilterValid(TestInformationFilterCommon):
         self.assertEqual(state_dim, np.shape(y_11_2)[0])
         self.assertEqual(len(observed_ids), len(id_list_2))
 
+    def test_information_filter_engine_matches_dense(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_information_filter_engine_matches_dense")
+
+        dim_state = 6
+        n_ids = 3
+        dim = dim_state * n_ids
+        np.random.seed(0)
+
+        A = np.random.rand(dim, dim)
+        Y_11 = A.dot(np.transpose(A)) + dim * np.eye(dim)
+        y_11 = np.random.rand(dim, 1)
+        F_0 = np.eye(dim) + 0.1 * np.random.rand(dim, dim)
+        Q_0 = np.diag(np.random.rand(dim) + 0.01)
+        H_0 = np.random.rand(6, dim)
+        R_0 = np.diag(np.random.rand(6) + 0.1)
+        z_0 = np.random.rand(6, 1)
+
+        # The original dense-inverse form of the information filter
+        M_0 = np.transpose(np.linalg.inv(F_0)).dot(Y_11.dot(np.linalg.inv(F_0)))
+        C_0 = M_0.dot(np.linalg.inv(M_0 + np.linalg.inv(Q_0)))
+        L_0 = np.eye(np.shape(C_0)[0]) - C_0
+        Y_01 = L_0.dot(M_0.dot(np.transpose(L_0))) + C_0.dot(np.linalg.inv(Q_0).dot(np.transpose(C_0)))
+        y_01 = L_0.dot(np.transpose(np.linalg.inv(F_0)).dot(y_11))
+        Y_00 = Y_01 + np.transpose(H_0).dot(np.linalg.inv(R_0).dot(H_0))
+        y_00 = y_01 + np.transpose(H_0).dot(np.linalg.inv(R_0).dot(z_0))
+
+        engine = dse_lib.InformationFilterEngine(dim_state, 3)
+        Y_01_2, y_01_2 = engine.predict(Y_11, y_11, F_0, Q_0)
+        Y_00_2, y_00_2, inf_I, inf_i = engine.update(Y_01_2, y_01_2, H_0, np.diag(R_0), z_0)
+        x_00, P_00 = engine.recover(Y_00_2, y_00_2)
+
+        self.assertEqual(True, np.allclose(Y_01, Y_01_2))
+        self.assertEqual(True, np.allclose(y_01, y_01_2))
+        self.assertEqual(True, np.allclose(Y_00, Y_00_2))
+        self.assertEqual(True, np.allclose(y_00, y_00_2))
+        self.assertEqual(True, np.allclose(np.linalg.inv(Y_00), P_00))
+        self.assertEqual(True, np.allclose(np.linalg.inv(Y_00).dot(y_00), x_00))
+
+    def test_block_information_matches_dense(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_block_information_matches_dense")
+
+        dim_state = 6
+        id_list = [1, 0, 5, 7]
+        dim = dim_state * len(id_list)
+        np.random.seed(1)
+
+        # Agents 1 and 0 share information, 5 and 7 are independent
+        Y_11 = np.zeros((dim, dim))
+        A = np.random.rand(2 * dim_state, 2 * dim_state)
+        Y_11[0:2*dim_state, 0:2*dim_state] = A.dot(np.transpose(A)) + dim * np.eye(2 * dim_state)
+        Y_11[2*dim_state:, 2*dim_state:] = dse_constants.INF_MATRIX_INITIAL * np.eye(2 * dim_state)
+        y_11 = np.random.rand(dim, 1)
+
+        F_blocks = {}
+        Q_blocks = {}
+        for id in id_list:
+            F_blocks[id] = np.eye(dim_state) + 0.1 * np.random.rand(dim_state, dim_state)
+            Q_blocks[id] = np.diag(np.random.rand(dim_state) + 0.01)
+        F_0 = linalg.block_diag(*[F_blocks[id] for id in id_list])
+        Q_0 = linalg.block_diag(*[Q_blocks[id] for id in id_list])
+
+        # Agent 1 observes agent 7
+        H_0 = np.zeros((3, dim))
+        H_0[:, 0:3] = np.random.rand(3, 3)
+        H_0[:, 3*dim_state:3*dim_state+3] = np.random.rand(3, 3)
+        R_0 = np.random.rand(3) + 0.1
+        z_0 = np.random.rand(3, 1)
+
+        engine = dse_lib.InformationFilterEngine(dim_state, 3)
+        Y_01, y_01 = engine.predict(Y_11, y_11, F_0, Q_0)
+        Y_00, y_00, inf_I, inf_i = engine.update(Y_01, y_01, H_0, R_0, z_0)
+
+        inf_11 = dse_lib.BlockInformation.from_dense(Y_11, y_11, id_list, dim_state)
+        self.assertEqual(3, len(inf_11.components()))
+        inf_01 = inf_11.predict(F_blocks, Q_blocks, engine)
+        inf_00, inf_obs = inf_01.update(H_0, R_0, z_0)
+        self.assertEqual(2, len(inf_00.components()))
+
+        Y_00_2, y_00_2 = inf_00.to_dense()
+        self.assertEqual(True, np.allclose(Y_00, Y_00_2))
+        self.assertEqual(True, np.allclose(y_00, y_00_2))
+        self.assertEqual(True, np.allclose(np.linalg.inv(Y_00).dot(y_00), inf_00.recover()))
+
+        # Block-encoded messages decode into the same dense arrays
+        matrix_arr, vector_arr = inf_00.to_multi_arrays(Float64MultiArray(), Float64MultiArray())
+        self.assertEqual(True, np.allclose(Y_00, dse_lib.multi_array_2d_output(matrix_arr)))
+        self.assertEqual(True, np.allclose(y_00, dse_lib.multi_array_2d_output(vector_arr)))
+        inf_00_2 = dse_lib.BlockInformation.from_multi_arrays(id_list, matrix_arr, vector_arr)
+        self.assertEqual(True, np.allclose(Y_00, inf_00_2.to_dense()[0]))
+
+        # Agent 1 observes the others, the prediction fills in the weak couplings between them
+        H_0 = np.zeros((9, dim))
+        for k in range(3):
+            H_0[3*k:3*k+3, 0:3] = -np.eye(3)
+            H_0[3*k:3*k+3, (k+1)*dim_state:(k+1)*dim_state+3] = np.eye(3)
+        inf_00 = inf_01.update(H_0, 0.01 * np.ones(9), z_0.repeat(3, axis=0))[0]
+        inf_10 = inf_00.predict(F_blocks, Q_blocks, engine)
+        self.assertEqual(10, len(inf_10.Y))
+
+        # Pruning them keeps the state, and never adds information
+        inf_10_sparse = inf_00.predict(F_blocks, Q_blocks, engine, sparsify_tol=0.2)
+        self.assertEqual(True, len(inf_10_sparse.Y) < len(inf_10.Y))
+        Y_10, y_10 = inf_10.to_dense()
+        Y_10_sparse, y_10_sparse = inf_10_sparse.to_dense()
+        self.assertEqual(True, np.allclose(np.linalg.solve(Y_10, y_10), np.linalg.solve(Y_10_sparse, y_10_sparse)))
+        self.assertEqual(True, np.all(np.linalg.eigvalsh(Y_10 - Y_10_sparse) > -1e-9))
+
+    def test_fill_FQ_blocks(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_fill_FQ_blocks")
+
+        dt = 0.1
+        for dim_state, dim_obs in [(6, 3), (12, 6)]:
+            id_list = np.array([1, -1, 3, 4])
+            np.random.seed(2)
+            x_11 = np.random.rand(len(id_list) * dim_state, 1)
+            # One agent that isn't turning, to hit the w == 0 limit
+            i_rate = 5 if dim_state == 6 else 9
+            x_11[2 * dim_state + i_rate] = 0
+
+            F_blocks, Q_blocks, F_inv_blocks, Q_inv_blocks = dse_lib.fill_FQ_blocks(id_list, dt, x_11, dim_state,
+                                                                                    dim_obs, inverse=True)
+            F_0, Q_0 = dse_lib.fill_FQ(id_list, dt, x_11, dim_state, dim_obs)
+            self.assertEqual(True, np.allclose(F_0, dse_lib.block_diag_from_blocks(F_blocks)))
+            self.assertEqual(True, np.allclose(np.eye(dim_state), F_blocks[1]))
+
+            for i in range(len(id_list)):
+                i_low = dim_state * i
+                i_high = i_low + dim_state
+                if dim_obs == 3 and id_list[i] != -1:
+                    F_i = dse_lib.f_unicycle_3D(dt, x_11[:, 0], i, dim_state)
+                    self.assertEqual(True, np.allclose(F_i, F_blocks[i]))
+                self.assertEqual(True, np.allclose(Q_0[i_low:i_high, i_low:i_high], Q_blocks[i]))
+                self.assertEqual(True, np.allclose(np.linalg.inv(F_blocks[i]), F_inv_blocks[i]))
+                self.assertEqual(True, np.allclose(np.linalg.inv(Q_blocks[i]), Q_inv_blocks[i]))
+
+    def test_fill_RHz_batched_multiple_observations(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_fill_RHz_batched_multiple_observations")
+
+        id_list = np.array([1, 0, 3, 4])
+        my_id = 1
+        observed_ids = [3, 0]
+        np.random.seed(3)
+        x_11 = np.random.rand(len(id_list) * self.dim_state, 1)
+
+        observed_poses = []
+        for yaw in [0.3, -1.2]:
+            pose = Pose()
+            pose.position.x = np.random.rand()
+            pose.position.y = np.random.rand()
+            quat = R.from_euler(self.euler_order, [yaw, 0, 0]).as_quat()
+            pose.orientation.x = quat[0]
+            pose.orientation.y = quat[1]
+            pose.orientation.z = quat[2]
+            pose.orientation.w = quat[3]
+            observed_poses.append(pose)
+
+        R_0, H_0, z_0 = dse_lib.fill_RHz_batched(id_list, my_id, observed_ids, observed_poses, x_11,
+                                                 self.euler_order, self.dim_state, self.dim_obs)
+        self.assertEqual((2 * self.dim_obs,), np.shape(R_0))
+        self.assertEqual((2 * self.dim_obs, len(id_list) * self.dim_state), np.shape(H_0))
+
+        # Each observation only fills in its own rows of H
+        for i in range(len(observed_ids)):
+            i_low = self.dim_obs * i
+            i_high = i_low + self.dim_obs
+            index = np.where(id_list == observed_ids[i])[0][0]
+            H_i = np.zeros((self.dim_obs, len(id_list) * self.dim_state))
+            H_i = dse_lib.h_camera_3D(H_i, x_11, 0, index, self.dim_state, self.dim_obs)
+            dist = np.linalg.norm([observed_poses[i].position.x, observed_poses[i].position.y])
+            self.assertEqual(True, np.allclose(H_i, H_0[i_low:i_high]))
+            self.assertEqual(True, np.allclose(dse_lib.aruco_R_from_range_3D(dist), np.diag(R_0[i_low:i_high])))
+            self.assertEqual(True, np.allclose([observed_poses[i].position.x, observed_poses[i].position.y],
+                                               z_0[i_low:i_low+2, 0]))
+        self.assertEqual(True, np.allclose([0.3, -1.2], z_0[[2, 5], 0]))
+
+    def test_agent_index_slot_reuse(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_agent_index_slot_reuse")
+
+        dim_state = 6
+        index = dse_lib.AgentIndex([1, 0, 5], dim_state)
+        x = np.arange(len(index) * dim_state, dtype=np.float64)[:, None]
+
+        self.assertEqual(2, index.slot(5))
+        self.assertEqual(True, np.allclose(x[12:18], index.state(x, 5)))
+        self.assertEqual(True, np.allclose(x[12:18], dse_lib.state_from_id(x, index, 5, dim_state)))
+
+        # Views share memory with the state vector
+        index.state(x, 0)[:] = -1
+        self.assertEqual(True, np.allclose(-1, x[6:12]))
+
+        # Dropping keeps every other agent in its slot, the free slot is reused by the next new agent
+        index.drop(0)
+        self.assertEqual(False, 0 in index)
+        self.assertEqual(2, index.slot(5))
+        self.assertEqual(dse_constants.EMPTY_SLOT_ID, index.ids[1])
+
+        Y_11 = 2 * np.eye(len(index) * dim_state)
+        Y_11[0:6, 6:12] = 0.5
+        Y_11[6:12, 0:6] = 0.5
+        y_11 = np.ones((len(index) * dim_state, 1))
+        index_2, Y_11_2, y_11_2, P_11_2, x_11_2 = dse_lib.extend_arrays([7], index, Y_11, y_11, dim_state)
+
+        self.assertEqual(1, index_2.slot(7))
+        self.assertEqual(False, 7 in index)
+        self.assertEqual(np.shape(Y_11), np.shape(Y_11_2))
+        self.assertEqual(True, np.allclose(0, Y_11_2[0:6, 6:12]))
+        self.assertEqual(True, np.allclose(dse_constants.INF_MATRIX_INITIAL * np.eye(dim_state), Y_11_2[6:12, 6:12]))
+        self.assertEqual(True, np.allclose(np.linalg.inv(Y_11_2), P_11_2))
+
+    def test_information_state_store_growth(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_information_state_store_growth")
+
+        dim_state = 6
+        store = dse_lib.InformationStateStore(dim_state, [1], capacity=1)
+        Y_11 = dse_constants.INF_MATRIX_INITIAL * np.eye(dim_state)
+        y_11 = dse_constants.INF_VECTOR_INITIAL * np.arange(1, dim_state + 1)[:, None]
+        Y_11[0, 1] = Y_11[1, 0] = 0.001
+        store.set([1], Y_11, y_11)
+
+        # All new IDs are added in one extension, matching extend_arrays
+        slots = store.extend([3, 2, 3, 1])
+        index, Y_ext, y_ext, P_ext, x_ext = dse_lib.extend_arrays([3, 2, 3, 1], [1], Y_11, y_11, dim_state)
+        self.assertEqual([1, 2], slots)
+        self.assertEqual(True, np.allclose(index, store.index.ids))
+        self.assertEqual(True, np.allclose(Y_ext, store.Y))
+        self.assertEqual(True, np.allclose(y_ext, store.y))
+        self.assertEqual(True, np.allclose(np.linalg.inv(Y_ext), P_ext))
+        self.assertEqual(True, np.allclose(np.linalg.solve(Y_ext, y_ext), x_ext))
+
+        # Capacity at least doubles, so one more agent fits without reallocating
+        self.assertEqual(3, store.capacity)
+        store.extend([4])
+        buffer = store.Y_buffer
+        store.extend([5])
+        self.assertEqual(True, buffer is store.Y_buffer)
+        self.assertEqual(5, len(store.index))
+
+        # Results are copied into the buffers, which keep their spare capacity for the next new agent
+        Y_ext_2 = np.random.rand(4 * dim_state, 4 * dim_state)
+        y_ext_2 = np.random.rand(4 * dim_state, 1)
+        store.set([1, 3, 2, 4], Y_ext_2, y_ext_2)
+        self.assertEqual(True, buffer is store.Y_buffer)
+        self.assertEqual(False, np.shares_memory(Y_ext_2, store.Y))
+        self.assertEqual(True, np.allclose(Y_ext_2, store.Y))
+        self.assertEqual(True, np.allclose(y_ext_2, store.y))
+        store.extend([6])
+        self.assertEqual(True, buffer is store.Y_buffer)
+        self.assertEqual(True, np.allclose(Y_ext_2, store.Y[0:4 * dim_state, 0:4 * dim_state]))
+
+        # More agents than the capacity grow the buffers with room to spare
+        store.set(range(7), np.eye(7 * dim_state), np.zeros(7 * dim_state))
+        self.assertEqual(12, store.capacity)
+        self.assertEqual(True, np.allclose(np.eye(7 * dim_state), store.Y))
+        self.assertEqual((7 * dim_state, 1), np.shape(store.y))
+
+    def test_observation_blocks_scatter_add(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_observation_blocks_scatter_add")
+
+        dim_state = 6
+        dim_obs = 3
+        id_list = [1, 0, 3, 4]
+        x_11 = np.random.rand(len(id_list) * dim_state, 1)
+        observed_ids = [3, 0]
+        observed_poses = []
+        for i in range(len(observed_ids)):
+            pose = Pose()
+            pose.position.x = 1.0 + i
+            pose.position.y = 0.5 - i
+            pose.orientation.z = np.sin(0.1 * (i + 1))
+            pose.orientation.w = np.cos(0.1 * (i + 1))
+            observed_poses.append(pose)
+
+        R_0, H_0, z_0 = dse_lib.fill_RHz_batched(id_list, 1, observed_ids, observed_poses, x_11,
+                                                 dse_constants.EULER_ORDER, dim_state, dim_obs)
+        R_c, J_0, z_c, obs_slots = dse_lib.fill_RHz_compact(id_list, 1, observed_ids, observed_poses, x_11,
+                                                            dse_constants.EULER_ORDER, dim_state, dim_obs)
+        self.assertEqual(True, np.allclose(H_0, dse_lib.H_from_compact(J_0, obs_slots, len(id_list), dim_state)))
+        self.assertEqual(True, np.allclose(H_0.dot(x_11), dse_lib.H_dot_from_compact(J_0, obs_slots, x_11, dim_state)))
+
+        # Scatter-added per-observation blocks match the dense H^T R^-1 H and H^T R^-1 z
+        engine = dse_lib.InformationFilterEngine(dim_state, dim_obs)
+        inf_I, inf_i = engine.observation(H_0, R_0, z_0)
+        I_blocks, i_blocks = engine.observation_blocks(J_0, R_c, z_c)
+        n = len(id_list) * dim_state
+        I_sum, i_sum = dse_lib.add_observation_blocks(np.zeros((n, n)), np.zeros((n, 1)), obs_slots, I_blocks,
+                                                      i_blocks, dim_state)
+        self.assertEqual(True, np.allclose(inf_I, I_sum))
+        self.assertEqual(True, np.allclose(inf_i, i_sum))
+
+        # And survive the block-encoded message, densely and as BlockInformation
+        partial = InfFilterPartials()
+        dse_lib.multi_array_observation_input(obs_slots, I_blocks, i_blocks, len(id_list), partial.obs_matrix,
+                                              partial.obs_vector)
+        self.assertEqual(True, np.allclose(inf_I, dse_lib.multi_array_2d_output(partial.obs_matrix)))
+        self.assertEqual(True, np.allclose(inf_i, dse_lib.multi_array_2d_output(partial.obs_vector)))
+        obs = dse_lib.BlockInformation.from_multi_arrays(id_list, partial.obs_matrix, partial.obs_vector)
+        I_blk, i_blk = obs.to_dense()
+        self.assertEqual(True, np.allclose(inf_I, I_blk))
+        self.assertEqual(True, np.allclose(inf_i, i_blk))
+
+    def test_batched_information_filter(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_batched_information_filter")
+
+        dim_state = 6
+        dim_obs = 3
+        id_list = [1, 0]
+        n_batch = 3
+        dim = len(id_list) * dim_state
+        dt = 0.1
+
+        # Random stacked priors with a random state each
+        A = np.random.rand(n_batch, dim, dim)
+        Y_11 = np.matmul(A, np.transpose(A, (0, 2, 1))) + dim * np.eye(dim)
+        x_11 = np.random.rand(n_batch, dim, 1)
+        y_11 = np.matmul(Y_11, x_11)
+        H_0 = np.random.rand(n_batch, dim_obs, dim)
+        R_0 = np.random.rand(n_batch, dim_obs) + 0.1
+        z_0 = np.random.rand(n_batch, dim_obs, 1)
+
+        batch = dse_lib.BatchedInformationFilter(dim_state, dim_obs, Y_11, y_11)
+        F_0, Q_0 = dse_lib.fill_FQ_stacked(id_list, dt, x_11, dim_state, dim_obs)
+        batch.predict(F_0, Q_0)
+        inf_I, inf_i = batch.update(H_0, R_0, z_0)
+        x_00, P_00 = batch.recover()
+
+        # Each filter matches the same steps done one at a time
+        engine = dse_lib.InformationFilterEngine(dim_state, dim_obs)
+        for k in range(n_batch):
+            F_k, Q_k = dse_lib.fill_FQ(id_list, dt, x_11[k], dim_state, dim_obs)
+            self.assertEqual(True, np.allclose(F_k, F_0[k]))
+            self.assertEqual(True, np.allclose(Q_k, Q_0[k]))
+            Y_01, y_01 = engine.predict(Y_11[k], y_11[k], F_k, Q_k)
+            Y_00, y_00, I_k, i_k = engine.update(Y_01, y_01, H_0[k], R_0[k], z_0[k])
+            self.assertEqual(True, np.allclose(Y_00, batch.Y[k]))
+            self.assertEqual(True, np.allclose(y_00, batch.y[k]))
+            self.assertEqual(True, np.allclose(I_k, inf_I[k]))
+            self.assertEqual(True, np.allclose(np.linalg.solve(Y_00, y_00), x_00[k]))
+            self.assertEqual(True, np.allclose(np.linalg.inv(Y_00), P_00[k]))
+
+    def test_square_root_information_filter(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_square_root_information_filter")
+
+        dim_state = 6
+        dim_obs = 3
+        id_list = [1, 0]
+        dim = len(id_list) * dim_state
+
+        # Badly conditioned prior, as with INF_MATRIX_INITIAL and a small motion covariance
+        A = np.random.rand(dim, dim)
+        Y_11 = A.dot(np.transpose(A)) + dse_constants.INF_MATRIX_INITIAL * np.eye(dim)
+        y_11 = np.random.rand(dim, 1)
+        x_11 = np.linalg.solve(Y_11, y_11)
+        F_0, Q_0 = dse_lib.fill_FQ(id_list, 0.1, x_11, dim_state, dim_obs)
+        H_0 = np.random.rand(2 * dim_obs, dim)
+        R_0 = np.random.rand(2 * dim_obs) + 0.1
+        z_0 = np.random.rand(2 * dim_obs, 1)
+
+        engine = dse_lib.InformationFilterEngine(dim_state, dim_obs)
+        Y_01, y_01 = engine.predict(Y_11, y_11, F_0, Q_0)
+        Y_00, y_00, inf_I, inf_i = engine.update(Y_01, y_01, H_0, R_0, z_0)
+
+        srif = dse_lib.SquareRootInformationFilter(dim_state, dim_obs).set_information(Y_11, y_11)
+        srif.predict(F_0, Q_0)
+        Y_srif, y_srif = srif.information()
+        self.assertEqual(True, np.allclose(Y_01, Y_srif))
+        self.assertEqual(True, np.allclose(y_01, y_srif))
+
+        srif.update(H_0, R_0, z_0)
+        Y_srif, y_srif = srif.information()
+        self.assertEqual(True, np.allclose(srif.R, np.triu(srif.R)))
+        self.assertEqual(True, np.allclose(Y_00, Y_srif))
+        self.assertEqual(True, np.allclose(y_00, y_srif))
+        x_00, P_00 = srif.recover()
+        self.assertEqual(True, np.allclose(np.linalg.solve(Y_00, y_00), x_00))
+        self.assertEqual(True, np.allclose(np.linalg.inv(Y_00), P_00))
+
+        # A frame without observations leaves the factor as it is
+        R_00 = np.copy(srif.R)
+        srif.update(np.zeros((0, dim)), np.zeros(0), np.zeros((0, 1)))
+        self.assertEqual(True, np.all(R_00 == srif.R))
+
+        # Extending the factor with new and reused slots is the same as factoring the extended Y
+        store = dse_lib.InformationStateStore(dim_state, id_list)
+        store.set(id_list, Y_00, y_00)
+        store.drop(0)
+        slots = store.extend([0, 5, 7])
+        srif.extend(slots, dim_state)
+        Y_ext, y_ext, P_ext, x_ext = dse_lib.extend_arrays([5, 7], [1, 0], Y_00, y_00, dim_state)[1:]
+        Y_ext[dim_state:2*dim_state, :] = 0
+        Y_ext[:, dim_state:2*dim_state] = 0
+        Y_ext[dim_state:2*dim_state, dim_state:2*dim_state] = dse_constants.INF_MATRIX_INITIAL * np.eye(dim_state)
+        y_ext[dim_state:2*dim_state] = store.y[dim_state:2*dim_state]
+        Y_srif, y_srif = srif.information()
+        self.assertEqual(True, np.allclose(Y_ext, Y_srif))
+        self.assertEqual(True, np.allclose(y_ext, y_srif))
+        self.assertEqual(True, np.allclose(store.Y, Y_srif))
+        self.assertEqual(True, np.allclose(store.y, y_srif))
+
+    def test_shadow_kalman_verifier(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_shadow_kalman_verifier")
+
+        dim_state = 6
+        dim_obs = 3
+        id_list = [1, 0]
+        dim = len(id_list) * dim_state
+
+        A = np.random.rand(dim, dim)
+        Y_11 = A.dot(np.transpose(A)) + dim * np.eye(dim)
+        y_11 = np.random.rand(dim, 1)
+        x_11 = np.linalg.solve(Y_11, y_11)
+        P_11 = np.linalg.inv(Y_11)
+        F_0, Q_0 = dse_lib.fill_FQ(id_list, 0.1, x_11, dim_state, dim_obs)
+        H_0 = np.random.rand(dim_obs, dim)
+        R_0 = np.random.rand(dim_obs) + 0.1
+        z_0 = np.random.rand(dim_obs, 1)
+
+        engine = dse_lib.InformationFilterEngine(dim_state, dim_obs)
+        Y_01, y_01 = engine.predict(Y_11, y_11, F_0, Q_0)
+        Y_00, y_00, inf_I, inf_i = engine.update(Y_01, y_01, H_0, R_0, z_0)
+
+        # Only every 3rd step is due, or the step after a request
+        verifier = dse_lib.ShadowKalmanVerifier(3, engine=engine)
+        self.assertEqual([False, False, True], [verifier.due() for i in range(3)])
+        verifier.request()
+        self.assertEqual(True, verifier.due())
+
+        self.assertEqual([], verifier.check(x_11, P_11, F_0, Q_0, H_0, R_0, z_0, Y_01, y_01, Y_00, y_00))
+        self.assertEqual(['x_00', 'P_00'], verifier.check(x_11, P_11, F_0, Q_0, H_0, R_0, z_0, Y_01, y_01,
+                                                          Y_01, y_01))
+        stats = verifier.stats()
+        self.assertEqual(True, np.allclose([4, 2, 1], stats[0, 0:3]))
+
+    def test_relative_pose_obs_6D(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_relative_pose_obs_6D")
+
+        n = 4
+        x1 = np.random.rand(n, 6) - 0.5
+        x2 = np.random.rand(n, 6) - 0.5
+
+        # Predicted measurements match the rotation-based relative pose
+        z_pred, J = dse_lib.relative_pose_obs(x1, x2)
+        r1 = R.from_euler(dse_constants.EULER_ORDER, x1[:, 3:6])
+        r2 = R.from_euler(dse_constants.EULER_ORDER, x2[:, 3:6])
+        self.assertEqual(True, np.allclose(r1.inv().apply(x2[:, 0:3] - x1[:, 0:3]), z_pred[:, 0:3]))
+        self.assertEqual(True, np.allclose((r1.inv() * r2).as_euler(dse_constants.EULER_ORDER), z_pred[:, 3:6]))
+
+        # The jacobian matches central differences, including the angle rows
+        x = np.concatenate((x1, x2), axis=1)
+        eps = 1e-6
+        for k in range(12):
+            dx = np.zeros(12)
+            dx[k] = eps
+            z_p = dse_lib.relative_pose_obs(x[:, 0:6] + dx[0:6], x[:, 6:12] + dx[6:12])[0]
+            z_m = dse_lib.relative_pose_obs(x[:, 0:6] - dx[0:6], x[:, 6:12] - dx[6:12])[0]
+            self.assertEqual(True, np.allclose((z_p - z_m) / (2 * eps), J[:, :, k], atol=1e-6))
+
+        # In the 12-state mode z is linearized so that z - H * x is the measured minus predicted pose
+        dim_state = 12
+        id_list = [1, 0]
+        x_11 = np.zeros((len(id_list) * dim_state, 1))
+        x_11[0:6, 0] = x1[0]
+        x_11[12:18, 0] = x2[0]
+        pose = Pose()
+        pose.position.x, pose.position.y, pose.position.z = z_pred[0, 0:3] + 0.01
+        quat = R.from_euler(dse_constants.EULER_ORDER, z_pred[0, 3:6]).as_quat()
+        pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w = quat
+        R_0, H_0, z_0 = dse_lib.fill_RHz_batched(id_list, 1, [0], [pose], x_11, dse_constants.EULER_ORDER,
+                                                 dim_state, 6)
+        self.assertEqual(True, np.allclose([0.01, 0.01, 0.01, 0, 0, 0], np.ravel(z_0 - H_0.dot(x_11))))
+
+    def test_information_estimate_lazy(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_information_estimate_lazy")
+
+        dim_state = 6
+        id_list = [1, 0, 3]
+        dim = len(id_list) * dim_state
+        A = np.random.rand(dim, dim)
+        Y = A.dot(np.transpose(A)) + dim * np.eye(dim)
+        y = np.random.rand(dim, 1)
+        P = np.linalg.inv(Y)
+
+        results = InfFilterResults()
+        results.ids = id_list
+        dse_lib.multi_array_2d_input(Y, results.inf_matrix)
+        dse_lib.multi_array_2d_input(y, results.inf_vector)
+        inf = dse_lib.InformationEstimate.from_multi_arrays(results.ids, results.inf_matrix, results.inf_vector)
+
+        # Nothing is factored until it is used, and P is only built when asked for
+        self.assertEqual(None, inf._chol)
+        self.assertEqual(True, np.allclose(P.dot(y), inf.x))
+        self.assertEqual(True, np.allclose(P.dot(y)[12:18], inf.state(3)))
+        self.assertEqual(True, np.allclose(P[6:12, 12:18], inf.cov(0, 3)))
+        self.assertEqual(True, np.allclose(P[0:6, 0:6], inf.cov(1)))
+        self.assertEqual(None, inf._P)
+        self.assertEqual(True, np.allclose(P, inf.P))
+
+    def test_selected_covariance_blocks(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_selected_covariance_blocks")
+
+        dim_state = 6
+        id_list = [1, 0, 3, 4]
+        dim = len(id_list) * dim_state
+        A = np.random.rand(dim, dim)
+        Y = A.dot(np.transpose(A)) + dim * np.eye(dim)
+        P = np.linalg.inv(Y)
+
+        inf = dse_lib.InformationEstimate(Y, np.zeros((dim, 1)), id_list, dim_state)
+        self.assertEqual(True, np.allclose(dse_lib.cov_from_id(P, id_list, 3, dim_state), inf.cov(3)))
+        self.assertEqual(True, np.allclose(P[18:24, 6:12], inf.cov(4, 0)))
+
+        # Joint covariance in the order asked for
+        rows = np.concatenate((np.arange(18, 24), np.arange(6, 12)))
+        self.assertEqual(True, np.allclose(P[np.ix_(rows, rows)], inf.cov_blocks([4, 0])))
+        self.assertEqual(True, np.allclose(P[np.ix_(rows, rows)],
+                                           dse_lib.cov_from_information(Y, id_list, [4, 0], dim_state)))
+        self.assertEqual(None, inf._P)
+
+    def test_wrap_angles_every_observation(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_wrap_angles_every_observation")
+
+        # Two 3D observations, only the angle rows are wrapped, each into [-pi, pi) around its prediction
+        angle_mask = dse_lib.angle_rows(2, 3)
+        self.assertEqual([False, False, True, False, False, True], list(angle_mask))
+        h_0 = np.array([0.0, 0.0, 3.0, 1.0, 1.0, -3.0])[:, None]
+        z_0 = np.array([10.0, 10.0, -3.0, 11.0, 11.0, 3.0 + 4 * np.pi])[:, None]
+        z_wrapped = dse_lib.wrap_angles(z_0, h_0, angle_mask)
+        self.assertEqual(True, np.allclose(z_0[~angle_mask], z_wrapped[~angle_mask]))
+        self.assertEqual(True, np.allclose([-3.0 + 2 * np.pi, 3.0 - 2 * np.pi], z_wrapped[angle_mask, 0]))
+
+        # 6D observations have three angle rows each
+        self.assertEqual([3, 4, 5, 9, 10, 11], list(np.where(dse_lib.angle_rows(2, 6))[0]))
+
+    def test_predict_with_closed_form_inverses(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_predict_with_closed_form_inverses")
+
+        dim_state = 6
+        dim_obs = 3
+        id_list = [1, 0, 3]
+        dim = len(id_list) * dim_state
+        A = np.random.rand(dim, dim)
+        Y_11 = A.dot(np.transpose(A)) + dim * np.eye(dim)
+        y_11 = np.random.rand(dim, 1)
+        x_11 = np.linalg.solve(Y_11, y_11)
+
+        F_0, Q_0, F_inv, Q_inv = dse_lib.fill_FQ(id_list, 0.1, x_11, dim_state, dim_obs, inverse=True)
+        self.assertEqual(True, np.allclose(np.linalg.inv(F_0), F_inv))
+        self.assertEqual(True, np.allclose(np.linalg.inv(Q_0), Q_inv))
+
+        engine = dse_lib.InformationFilterEngine(dim_state, dim_obs)
+        Y_01, y_01 = engine.predict(Y_11, y_11, F_0, Q_0)
+        Y_01_2, y_01_2 = engine.predict(Y_11, y_11, F_0, Q_0, F_inv, Q_inv)
+        self.assertEqual(True, np.allclose(Y_01, Y_01_2))
+        self.assertEqual(True, np.allclose(y_01, y_01_2))
+
+        # Block-sparse prediction with the inverse blocks
+        F_b, Q_b, F_inv_b, Q_inv_b = dse_lib.fill_FQ_blocks(id_list, 0.1, x_11, dim_state, dim_obs, inverse=True)
+        inf_11 = dse_lib.BlockInformation.from_dense(Y_11, y_11, id_list, dim_state)
+        inf_01 = inf_11.predict(dict(zip(id_list, F_b)), dict(zip(id_list, Q_b)), engine,
+                                dict(zip(id_list, F_inv_b)), dict(zip(id_list, Q_inv_b)))
+        self.assertEqual(True, np.allclose(Y_01, inf_01.to_dense()[0]))
+        self.assertEqual(True, np.allclose(y_01, inf_01.to_dense()[1]))
+
+    def test_batched_quaternion_euler_kernels(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_batched_quaternion_euler_kernels")
+
+        quat = R.random(50, random_state=4).as_quat()
+        eul = R.from_quat(quat).as_euler('zyx')
+        self.assertEqual(True, np.allclose(eul, dse_lib.quat_to_euler_zyx(quat)))
+        self.assertEqual(True, np.allclose(R.from_quat(quat).as_matrix(),
+                                           R.from_quat(dse_lib.euler_zyx_to_quat(eul)).as_matrix()))
+        self.assertEqual(True, np.allclose(eul[:, 0], dse_lib.quat2yaw(quat)))
+        self.assertEqual(True, np.allclose(R.from_euler('z', eul[:, 0:1]).as_quat(), dse_lib.yaw2quat(eul[:, 0])))
+
+        # Pose arrays round trip through the batched converters
+        for dim_state, dim_obs in [(6, 3), (12, 6)]:
+            x = np.random.rand(4 * dim_state, 1) - 0.5
+            poses = dse_lib.pose_array_from_state(PoseArray(), x, dim_state, dim_obs)
+            x_2 = dse_lib.state_from_pose_array(poses, dim_state, dim_obs)
+            x_objs = np.reshape(x, (4, dim_state))
+            x_objs[:, dim_obs:] = 0
+            self.assertEqual(True, np.allclose(np.reshape(x_objs, (-1, 1)), x_2))
+
+    def test_pose_markers_array_conversion(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_pose_markers_array_conversion")
+
+        dim_state = 6
+        dim_obs = 3
+        ids = np.array([3, 0, 7])
+        z = np.random.rand(len(ids) * dim_obs, 1) - 0.5
+        markers = PoseMarkers()
+        markers.ids = list(ids)
+        markers.pose_array = dse_lib.pose_array_from_measurement(markers.pose_array, z, dim_obs)
+
+        # One (n, 7) array round trip of the message
+        ids_2, pose_arr = dse_lib.arrays_from_pose_markers(markers)
+        markers_2 = dse_lib.pose_markers_from_arrays(PoseMarkers(), ids_2, pose_arr)
+        ids_3, pose_arr_3 = dse_lib.arrays_from_pose_markers(markers_2)
+        self.assertEqual(True, np.array_equal(ids, ids_3))
+        self.assertEqual(True, np.allclose(pose_arr, pose_arr_3))
+
+        # fill_RHz gives the same result from the pose array as from the poses
+        id_list = [1, 3, 0, 7]
+        x_11 = np.random.rand(len(id_list) * dim_state, 1)
+        R_1, H_1, z_1 = dse_lib.fill_RHz(id_list, 1, markers.ids, markers.pose_array.poses, x_11, 'zyx',
+                                         dim_state, dim_obs)
+        R_2, H_2, z_2 = dse_lib.fill_RHz(id_list, 1, ids_2, pose_arr, x_11, 'zyx', dim_state, dim_obs)
+        self.assertEqual(True, np.allclose(R_1, R_2))
+        self.assertEqual(True, np.allclose(H_1, H_2))
+        self.assertEqual(True, np.allclose(z_1, z_2))
+        self.assertEqual(True, np.allclose(z, dse_lib.state_from_pose_array(pose_arr, dim_obs, dim_obs)))
+
+    def test_multi_array_zero_copy(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_multi_array_zero_copy")
+
+        mat = np.random.rand(12, 6)
+        multi_arr = Float64MultiArray()
+        multi_arr = dse_lib.multi_array_2d_input(mat, multi_arr)
+        self.assertEqual(True, np.shares_memory(mat, multi_arr.data))
+
+        # Re-encoding into the same message reuses its layout
+        mat_2 = np.random.rand(6, 6)
+        multi_arr = dse_lib.multi_array_2d_input(mat_2, multi_arr)
+        self.assertEqual(2, len(multi_arr.layout.dim))
+        self.assertEqual(True, np.allclose(mat_2, dse_lib.multi_array_2d_output(multi_arr)))
+
+        # Serialized buffers are viewed in place
+        multi_arr.data = mat.tobytes()
+        multi_arr = dse_lib.multi_array_set_layout(multi_arr, ['rows', 'cols'], [12, 6], [72, 6])
+        mat_3 = dse_lib.multi_array_2d_output(multi_arr)
+        self.assertEqual(True, np.allclose(mat, mat_3))
+        self.assertEqual(False, mat_3.flags.writeable)
+
+    def test_multi_array_packed_symmetric(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_multi_array_packed_symmetric")
+
+        n = 18
+        A = np.random.rand(n, n)
+        Y = A.dot(A.T)
+        multi_arr = dse_lib.multi_array_sym_input(Y, Float64MultiArray())
+        self.assertEqual(n * (n + 1) / 2, len(multi_arr.data))
+        self.assertEqual(True, np.allclose(Y, dse_lib.multi_array_2d_output(multi_arr)))
+
+        # Messages can switch between the packed and dense encodings
+        multi_arr = dse_lib.multi_array_2d_input(A, multi_arr)
+        self.assertEqual(True, np.allclose(A, dse_lib.multi_array_2d_output(multi_arr)))
+
+    def test_observation_blocks_by_id(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_observation_blocks_by_id")
+
+        dim_state = 6
+        dim_obs = 3
+        id_list = [1, 0, dse_constants.EMPTY_SLOT_ID, 3, 4]
+        x_11 = np.random.rand(len(id_list) * dim_state, 1)
+        observed_ids = [3, 0, 3]
+        pose_arr = np.zeros((len(observed_ids), 7))
+        pose_arr[:, 0] = [1.0, 2.0, 1.1]
+        pose_arr[:, 1] = [0.5, -0.5, 0.4]
+        pose_arr[:, 3:7] = dse_lib.yaw2quat(np.array([0.1, 0.2, 0.15]))
+
+        R_0, H_0, z_0 = dse_lib.fill_RHz_batched(id_list, 1, observed_ids, pose_arr, x_11,
+                                                 dse_constants.EULER_ORDER, dim_state, dim_obs)
+        R_c, J_0, z_c, obs_slots = dse_lib.fill_RHz_compact(id_list, 1, observed_ids, pose_arr, x_11,
+                                                            dse_constants.EULER_ORDER, dim_state, dim_obs)
+        engine = dse_lib.InformationFilterEngine(dim_state, dim_obs)
+        inf_I, inf_i = engine.observation(H_0, R_0, z_0)
+        I_blocks, i_blocks = engine.observation_blocks(J_0, R_c, z_c)
+
+        # Only the observer/observed blocks are sent, keyed by agent ID
+        partial = InfFilterPartials()
+        dse_lib.inf_observation_blocks_input(np.array(id_list)[obs_slots], I_blocks, i_blocks,
+                                             partial.obs_matrix_blocks, partial.obs_vector_blocks)
+        self.assertEqual(3 * len(observed_ids) * dim_state * dim_state, len(partial.obs_matrix_blocks.data))
+
+        # Accumulated into a dense matrix with another ID order
+        id_list_2 = [4, 3, 1, 0]
+        order = np.concatenate([np.arange(dim_state) + dim_state * id_list.index(id) for id in id_list_2])
+        n = len(id_list_2) * dim_state
+        I_sum = dse_lib.inf_blocks_add(partial.obs_matrix_blocks, np.zeros((n, n)), id_list_2)
+        i_sum = dse_lib.inf_blocks_add(partial.obs_vector_blocks, np.zeros((n, 1)), id_list_2)
+        self.assertEqual(True, np.allclose(inf_I[np.ix_(order, order)], I_sum))
+        self.assertEqual(True, np.allclose(inf_i[order], i_sum))
+
+        # And as BlockInformation
+        obs = dse_lib.BlockInformation(dim_state, id_list)
+        obs.add_inf_blocks(partial.obs_matrix_blocks, partial.obs_vector_blocks)
+        I_blk, i_blk = obs.to_dense()
+        self.assertEqual(True, np.allclose(inf_I, I_blk))
+        self.assertEqual(True, np.allclose(inf_i, i_blk))
+
+        # A frame without observations sends empty blocks, which add nothing
+        id_list = [1, 0, 3, 4]
+        x_11 = np.random.rand(len(id_list) * dim_state, 1)
+        R_c, J_0, z_c, obs_slots = dse_lib.fill_RHz_compact(id_list, 1, [], np.zeros((0, 7)), x_11,
+                                                            dse_constants.EULER_ORDER, dim_state, dim_obs)
+        I_blocks, i_blocks = engine.observation_blocks(J_0, R_c, z_c)
+        Y = np.eye(len(id_list) * dim_state)
+        y = np.ones((len(id_list) * dim_state, 1))
+        dse_bus.set_backend(dse_bus.InProcessBus())
+        try:
+            results = []
+            dse_bus.Subscriber('/dse/inf/results', InfFilterResults, results.append)
+            estimator = direct_estimator.direct_estimator()
+            for block_sparse in [True, False]:
+                partial = InfFilterPartials()
+                partial.ids = id_list
+                if block_sparse:
+                    prior = dse_lib.BlockInformation.from_dense(Y, y, id_list, dim_state)
+                    prior.to_multi_arrays(partial.inf_matrix_prior, partial.inf_vector_prior)
+                else:
+                    dse_lib.multi_array_sym_input(Y, partial.inf_matrix_prior)
+                    dse_lib.multi_array_2d_input(y, partial.inf_vector_prior)
+                dse_lib.inf_observation_blocks_input(np.array(id_list)[obs_slots], I_blocks, i_blocks,
+                                                     partial.obs_matrix_blocks, partial.obs_vector_blocks)
+                inf_I, inf_i = dse_lib.inf_partial_observation_output(partial, dim_state)
+                self.assertEqual(True, np.all(inf_I == 0) and np.all(inf_i == 0))
+                estimator.information_callback(partial)
+                est = dse_lib.InformationEstimate.from_results(results[-1], dim_state)
+                self.assertEqual(True, np.allclose(est.Y, Y))
+                self.assertEqual(True, np.allclose(est.y, y))
+        finally:
+            dse_bus.set_backend(dse_bus.RospyBus())
+
+    def test_direct_estimator_delta_stream(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_direct_estimator_delta_stream")
+
+        dim_state = 6
+        id_list = [1, 0]
+        Y = np.eye(len(id_list) * dim_state)
+        y = np.ones((len(id_list) * dim_state, 1))
+        partial = InfFilterPartials()
+        partial.ids = id_list
+        dse_lib.multi_array_sym_input(Y, partial.inf_matrix_prior)
+        dse_lib.multi_array_2d_input(y, partial.inf_vector_prior)
+        dse_lib.inf_observation_blocks_input(np.zeros((0, 2)), np.zeros((0, 12, 12)), np.zeros((0, 12, 1)),
+                                             partial.obs_matrix_blocks, partial.obs_vector_blocks)
+
+        bus = dse_bus.set_backend(dse_bus.InProcessBus())
+        try:
+            # Off by default, only the full results are published
+            estimator = direct_estimator.direct_estimator()
+            dse_bus.Subscriber('/dse/inf/results_delta', InfFilterResultsDelta, lambda msg: None)
+            estimator.information_callback(partial)
+            self.assertEqual(1, bus.n_published['/dse/inf/results'])
+            self.assertEqual(0, bus.n_published['/dse/inf/results_delta'])
+
+            # Nothing is encoded until someone subscribes, and they get a keyframe first
+            bus = dse_bus.set_backend(dse_bus.InProcessBus())
+            estimator = direct_estimator.direct_estimator(keyframe_period=10, delta_stream=True)
+            estimator.information_callback(partial)
+            self.assertEqual(0, bus.n_published['/dse/inf/results_delta'])
+            received = []
+            dse_bus.Subscriber('/dse/inf/results_delta', InfFilterResultsDelta, received.append)
+            estimator.information_callback(partial)
+            estimator.information_callback(partial)
+            self.assertEqual(2, len(received))
+            self.assertEqual(True, received[0].keyframe)
+            self.assertEqual(False, received[1].keyframe)
+        finally:
+            dse_bus.set_backend(dse_bus.RospyBus())
+
+    def test_delta_stream_results(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_delta_stream_results")
+
+        dim_state = 6
+        ids = [1, 0, 3, 4]
+        n = len(ids) * dim_state
+        A = np.random.rand(n, n)
+        Y = A.dot(A.T) + n * np.eye(n)
+        y = np.random.rand(n, 1)
+        encoder = dse_lib.DeltaStreamEncoder(keyframe_period=10)
+        decoder = dse_lib.DeltaStreamDecoder(dim_state)
+
+        # The first message is a keyframe
+        msg = encoder.encode(ids, Y, y, InfFilterResultsDelta())
+        self.assertEqual(True, msg.keyframe)
+        self.assertEqual(True, decoder.apply(msg))
+        self.assertEqual(True, np.allclose(Y, decoder.Y))
+
+        # Only the blocks of agents 3 and 4 change
+        Y[18:24, 12:24] += 0.5
+        Y[12:24, 18:24] = np.transpose(Y[18:24, 12:24])
+        y[18:24] -= 0.1
+        msg = encoder.encode(ids, Y, y, InfFilterResultsDelta())
+        self.assertEqual(False, msg.keyframe)
+        self.assertEqual(2, len(msg.inf_matrix_blocks.row_ids))
+        self.assertEqual(1, len(msg.inf_vector_blocks.row_ids))
+        self.assertEqual(True, decoder.apply(msg))
+        self.assertEqual(True, np.allclose(Y, decoder.Y))
+        self.assertEqual(True, np.allclose(y, decoder.y))
+        self.assertEqual(True, np.allclose(np.linalg.solve(Y, y), decoder.estimate().x))
+
+        # A missed message is detected and the next keyframe resyncs
+        encoder.encode(ids, 2 * Y, y, InfFilterResultsDelta())
+        msg = encoder.encode(ids, 3 * Y, y, InfFilterResultsDelta())
+        self.assertEqual(False, decoder.apply(msg))
+        self.assertEqual(1, decoder.n_gaps)
+        encoder.request_keyframe()
+        msg = encoder.encode(ids, 4 * Y, y, InfFilterResultsDelta())
+        self.assertEqual(True, decoder.apply(msg))
+        self.assertEqual(True, np.allclose(4 * Y, decoder.Y))
+
+        # Block-sparse results are diffed block by block, a block that is gone is sent as zeros
+        inf = dse_lib.BlockInformation.from_dense(Y, y, ids, dim_state)
+        msg = encoder.encode_blocks(inf, InfFilterResultsDelta())
+        self.assertEqual(True, msg.keyframe)
+        self.assertEqual(True, decoder.apply(msg))
+        self.assertEqual(True, np.allclose(Y, decoder.Y))
+        inf = dse_lib.BlockInformation.from_dense(Y, y, ids, dim_state)
+        del inf.Y[(1, 4)]
+        inf.add_vector(3, np.ones((dim_state, 1)))
+        msg = encoder.encode_blocks(inf, InfFilterResultsDelta())
+        self.assertEqual(False, msg.keyframe)
+        self.assertEqual(1, len(msg.inf_matrix_blocks.row_ids))
+        self.assertEqual(1, len(msg.inf_vector_blocks.row_ids))
+        self.assertEqual(True, decoder.apply(msg))
+        Y_blocks, y_blocks = inf.to_dense()
+        self.assertEqual(True, np.allclose(Y_blocks, decoder.Y))
+        self.assertEqual(True, np.allclose(y_blocks, decoder.y))
+
+    def test_quantized_array_conservative(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_quantized_array_conservative")
+
+        dim_state = 6
+        n = 4 * dim_state
+        A = np.random.rand(n, n) - 0.5
+        Y = A.dot(A.T) + dse_constants.INF_MATRIX_INITIAL * np.eye(n)
+        y = np.random.rand(n, 1)
+
+        # Two weakly observed agents with a precise relative observation between them, so a weakly observed
+        # direction sits under large entries (subtracting a Gershgorin bound makes this one indefinite)
+        H = np.zeros((dim_state, n))
+        H[:, 0:dim_state] = -np.eye(dim_state)
+        H[:, dim_state:2*dim_state] = np.eye(dim_state)
+        B = np.random.rand(dim_state, dim_state) - 0.5
+        Y_weak = A.dot(A.T) + 100 * np.eye(n)
+        Y_weak[0:2*dim_state, :] = 0
+        Y_weak[:, 0:2*dim_state] = 0
+        Y_weak[0:2*dim_state, 0:2*dim_state] = 1e-3 * np.eye(2 * dim_state)
+        Y_weak += 1000 * np.transpose(H).dot(B.dot(B.T) + np.eye(dim_state)).dot(H)
+
+        for precision in ['int16', 'float32']:
+            for Y_in in [Y, Y_weak]:
+                matrix_q = dse_lib.quantized_array_input(Y_in, QuantizedArray(), precision, dim_state,
+                                                         conservative=True)
+                self.assertEqual(True, len(matrix_q.data) <= 4 * n * n)
+                Y_q = dse_lib.quantized_array_output(matrix_q)
+
+                # The quantized matrix never holds more information than the input, and stays positive definite
+                self.assertEqual(True, np.min(np.linalg.eigvalsh(Y_in - Y_q)) >= 0)
+                self.assertEqual(True, np.min(np.linalg.eigvalsh(Y_q)) > 0)
+
+            # The well conditioned matrix loses almost nothing
+            Y_q = dse_lib.quantized_array_output(dse_lib.quantized_array_input(Y, QuantizedArray(), precision,
+                                                                               dim_state, conservative=True))
+            y_q = dse_lib.quantized_array_output(dse_lib.quantized_array_input(y, QuantizedArray(), precision,
+                                                                               dim_state))
+            self.assertEqual(True, np.allclose(Y, Y_q, rtol=1e-3, atol=1e-3 * dse_constants.INF_MATRIX_INITIAL))
+            self.assertEqual(True, np.allclose(y, y_q, atol=1e-4))
+
+        # Results sent quantized are read like the multi-array ones
+        results = InfFilterResults()
+        results.ids = [1, 0, 3, 4]
+        dse_lib.quantized_array_input(Y, results.inf_matrix_quantized, 'int16', dim_state, conservative=True)
+        dse_lib.quantized_array_input(y, results.inf_vector_quantized, 'int16', dim_state)
+        self.assertEqual(0, len(results.inf_matrix.data))
+        inf = dse_lib.InformationEstimate.from_results(results, dim_state)
+        self.assertEqual(True, np.allclose(np.linalg.solve(Y, y), inf.x, atol=1e-6))
+
+    def test_in_process_bus(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_in_process_bus")
+
+        bus = dse_bus.set_backend(dse_bus.InProcessBus())
+        try:
+            controls = []
+            received = []
+            dse_bus.Subscriber('/cmd_vel', Twist, controls.append)
+            dse_bus.Subscriber('/dse/inf/results_delta', InfFilterResultsDelta, received.append)
+            controller = to_tag_controller.to_tag_controller(1, 6, 0, delta_stream=True)
+            results_pub = dse_bus.Publisher('/dse/inf/results_delta', InfFilterResultsDelta)
+
+            # Agent 1 at the origin and agent 0 ahead and to the left of it
+            ids = [1, 0]
+            Y = 100 * np.eye(12)
+            x = np.zeros((12, 1))
+            x[6:8, 0] = [1, 1]
+            encoder = dse_lib.DeltaStreamEncoder()
+            msg = encoder.encode(ids, Y, Y.dot(x), InfFilterResultsDelta())
+            results_pub.publish(msg)
+            self.assertEqual(1, len(controls))
+            self.assertEqual(True, controls[0].angular.z > 0)
+
+            # Messages are passed by reference, arrays included
+            self.assertEqual(True, received[0] is msg)
+            self.assertEqual(True, np.shares_memory(msg.inf_matrix_blocks.data, received[0].inf_matrix_blocks.data))
+
+            self.assertEqual(True, controller.delta_decoder.synced())
+
+            # A missed message makes the controller request a keyframe
+            encoder.encode(ids, Y, Y.dot(x), InfFilterResultsDelta())
+            results_pub.publish(encoder.encode(ids, Y, Y.dot(x), InfFilterResultsDelta()))
+            self.assertEqual(1, bus.n_published['/dse/inf/results_resync'])
+            self.assertEqual(1, len(controls))
+
+            # Queued delivery
+            bus.synchronous = False
+            encoder.request_keyframe()
+            results_pub.publish(encoder.encode(ids, Y, Y.dot(x), InfFilterResultsDelta()))
+            self.assertEqual(1, len(controls))
+            # The results, then the control signal published while handling them
+            self.assertEqual(2, bus.spin_once())
+            self.assertEqual(2, len(controls))
+        finally:
+            dse_bus.set_backend(dse_bus.RospyBus())
+
+    def test_in_process_pipeline(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_in_process_pipeline")
+
+        bus = dse_bus.set_backend(dse_bus.InProcessBus(start_time=5.0))
+        try:
+            results = []
+            controls = []
+            dse_bus.Subscriber('/dse/inf/results', InfFilterResults, results.append)
+            dse_bus.Subscriber('/cmd_vel', Twist, controls.append)
+
+            # The estimation graph of one agent: camera -> filter -> direct estimator -> controller and filter
+            inf_filter = information_filter.information_filter(1, 6)
+            estimator = direct_estimator.direct_estimator()
+            controller = to_tag_controller.to_tag_controller(1, 6, 0)
+            pose_pub = dse_bus.Publisher('/dse/pose_markers', PoseMarkers)
+
+            # Agent 0 seen ahead and to the left of agent 1, with the clock stepping 0.2 s between frames
+            pose_arr = np.array([[1.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0]])
+            for k in range(3):
+                dse_bus.sleep(0.2)
+                pose_pub.publish(dse_lib.pose_markers_from_arrays(PoseMarkers(), [0], pose_arr))
+                self.assertEqual(True, np.isclose(0.2, inf_filter.dt))
+                self.assertEqual(k + 1, len(results))
+                self.assertEqual(k + 1, len(controls))
+
+            self.assertEqual(True, np.isclose(5.6, dse_bus.get_time()))
+            self.assertEqual(True, np.isclose(5.6, dse_bus.now().to_sec()))
+            self.assertEqual(3, bus.n_published['/dse/inf/partial'])
+            self.assertEqual([1, 0], list(results[-1].ids))
+            self.assertEqual(True, controls[-1].angular.z > 0)
+
+            # The control signal is fed back into the filter
+            self.assertEqual(True, np.isclose(controls[-1].angular.z, inf_filter.ctrl[0][5]))
+        finally:
+            dse_bus.set_backend(dse_bus.RospyBus())
+
+    def test_numpy_msg_transport(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_numpy_msg_transport")
+
+        # The rospy backend subscribes with the numpy_msg message classes
+        sub = dse_bus.RospyBus().subscriber('/dse/test/numpy_msg', Float64MultiArray, lambda data: None)
+        self.assertEqual(True, sub.data_class is numpy_msg(Float64MultiArray))
+        sub.unregister()
+
+        # Received arrays are numpy arrays over the message buffer, which multi_array_data doesn't copy
+        Y = np.random.rand(12, 12)
+        Y = Y + np.transpose(Y)
+        for msg in [dse_lib.multi_array_2d_input(Y, Float64MultiArray()),
+                    dse_lib.multi_array_sym_input(Y, Float64MultiArray())]:
+            buff = BytesIO()
+            msg.serialize(buff)
+            received = numpy_msg(Float64MultiArray)()
+            received.deserialize(buff.getvalue())
+            self.assertEqual(True, isinstance(received.data, np.ndarray))
+            self.assertEqual(True, np.shares_memory(received.data, dse_lib.multi_array_data(received)))
+            self.assertEqual(True, np.allclose(Y, dse_lib.multi_array_2d_output(received)))
+
+    def test_consensus_engine(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_consensus_engine")
+
+        # Two groups, a line of three agents and a pair
+        adj = np.eye(5)
+        for i, j in [(0, 1), (1, 2), (3, 4)]:
+            adj[i, j] = 1
+            adj[j, i] = 1
+        graph = consensus_lib.generate_graph(adj)
+        self.assertEqual(True, np.allclose(np.sum(graph.p, axis=1), 1))
+        self.assertEqual(True, np.allclose(graph.p, np.transpose(graph.p)))
+        size_comp, n_comp, members = consensus_lib.networkComponents(adj)
+        self.assertEqual(2, n_comp)
+        self.assertEqual(True, np.array_equal([3, 3, 3, 2, 2], size_comp))
+
+        # After enough steps every agent holds the average prior plus the sum of the measurements of its group
+        n = 12
+        A = np.random.rand(5, n, n)
+        Y = np.matmul(A, np.transpose(A, (0, 2, 1))) + np.eye(n)
+        y = np.random.rand(5, n, 1)
+        A = np.random.rand(5, n, n)
+        I = np.matmul(A, np.transpose(A, (0, 2, 1)))
+        i = np.random.rand(5, n, 1)
+        engine = consensus_lib.ConsensusEngine(adj, num_steps=300)
+        Y_post, y_post = engine.run(Y, y, I, i)
+        for group in members:
+            Y_group = np.mean(Y[group], axis=0) + np.sum(I[group], axis=0)
+            y_group = np.mean(y[group], axis=0) + np.sum(i[group], axis=0)
+            for k in group:
+                self.assertEqual(True, np.allclose(Y_group, Y_post[k]))
+                self.assertEqual(True, np.allclose(y_group, y_post[k]))
+
+    def test_ci_weights_solver(self):
+        ##############################################################################
+        rospy.loginfo("-D- test_ci_weights_solver")
+
+        # A batch of problems with different numbers of matrices, one dominant matrix in each
+        n = 8
+        A = np.random.rand(5, 4, n, n)
+        S = np.matmul(A, np.transpose(A, (0, 1, 3, 2))) + 0.1 * np.eye(n)
+        S[:, 0] = 3 * S[:, 0]
+        mask = np.ones((5, 4), dtype=bool)
+        mask[0, 3] = False
+        mask[1, 2:] = False
+
+        # Same minimum as a general constrained optimizer on each problem, and valid weights
+        for method, cost in [('det', consensus_lib.cost_ci_det), ('tr', consensus_lib.cost_ci_tr)]:
+            solver = consensus_lib.CIWeightSolver(method)
+            weights = solver.solve(S, mask)
+            self.assertEqual(True, np.allclose(np.sum(weights, axis=1), 1))
+            self.assertEqual(True, np.all(weights >= 0))
+            self.assertEqual(True, np.all(weights[~mask] == 0))
+            for b in range(5):
+                k = np.flatnonzero(mask[b])
+                result = minimize(cost, np.ones(len(k)) / len(k), args=(S[b, k],), method='SLSQP',
+                                  bounds=[(0, 1)] * len(k), options={'ftol': 1e-12},
+                                  constraints=[{'type': 'eq', 'fun': lambda x: np.sum(x) - 1}])
+                self.assertEqual(True, cost(weights[b, k], S[b, k]) <= result.fun + 1e-8)
+
+            # Warm-started from the solution, it is already converged
+            solver.solve(S, mask, weights)
+            self.assertEqual(0, solver.n_iter)
+
+            # A vertex whose fused matrix is singular, as a warm start and along the way, is avoided
+            S_singular = np.array([[np.diag([100., 0]), np.diag([0, 100.])]])
+            self.assertEqual(True, np.allclose(solver.solve(S_singular, w0=[[1, 0]]), [[0.5, 0.5]]))
+            S_singular = np.array([[np.diag([100., 0]), np.diag([1., 1.]), np.diag([0, 100.])]])
+            weights = solver.solve(S_singular, w0=[[0, 1, 0]])
+            self.assertEqual(True, np.all(np.isfinite(weights)))
+            self.assertEqual(True, cost(weights[0], S_singular[0]) <= cost(np.array([0, 1., 0]), S_singular[0]))
+
+        # Fused information of a single problem
+        i = np.random.rand(3, n, 1)
+        weights, inf_mat, inf_vect = consensus_lib.calc_ci_weights_ver3(S[1, 0:2], i[0:2], 'det')
+        self.assertEqual(True, np.allclose(inf_mat, np.einsum('k,kab->ab', weights, S[1, 0:2])))
+        self.assertEqual(True, np.allclose(inf_vect, np.einsum('k,kab->ab', weights, i[0:2])))
+
+        # Consensus with CI prior fusion keeps the priors positive definite and reaches agreement
+        adj = np.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]])
+        I = np.stack([np.eye(n)] * 3)
+        engine = consensus_lib.ConsensusEngine(adj, num_steps=100, prior_fusion='ci')
+        Y_post, y_post = engine.run(S[2, 0:3], i, I, i)
+        self.assertEqual(True, np.all(np.linalg.eigvalsh(Y_post) > 0))
+        self.assertEqual(True, np.allclose(Y_post[0], Y_post[2]))
+        self.assertEqual(True, np.allclose(y_post[0], y_post[2]))
+
+        # A group of agents fuses its priors with CI and ramps in the measurement term
+        agents = []
+        for k in range(3):
+            agent = types.SimpleNamespace(objectID=k + 1, memory_id_comm=[j + 1 for j in np.nonzero(adj[k])[0]],
+                                          memory_Y=S[2, k], memory_y=i[k], memory_I=I[k], memory_i=i[k])
+            agents.append(agent)
+        Y_group, y_group = consensus_lib.consensus_group(agents, 20)
+        engine = consensus_lib.ConsensusEngine(adj + np.eye(3), num_steps=18, prior_fusion='ci', measurement_ratio=0.95)
+        Y_post, y_post = engine.run(S[2, 0:3], i, I, i)
+        self.assertEqual(True, np.allclose(Y_group, Y_post))
+        self.assertEqual(True, np.allclose(y_group, y_post))
+
 
 if __name__ == '__main__':
     rospy.loginfo("-I- test_information_filter started")